@@ -77,6 +77,8 @@ MIDDLEWARE = [
     "allauth.account.middleware.AccountMiddleware",
     # Add the profile middleware:
     "users.middleware.ProfileMiddleware",
+    # سطر ملخص لعمليات الترحيل في كل طلب
+    "core.middleware.PostingSummaryMiddleware",
 ]
 
 ROOT_URLCONF = "acc.urls"
@@ -111,6 +113,35 @@ DATABASES = {
     }
 }
 
+# الذاكرة المؤقتة: LocMemCache (خاصة بكل عملية) افتراضيًا، ويتم اختيارها من ACC_CACHE_BACKEND.
+# عند تشغيل أكثر من عامل gunicorn يفضل ذاكرة مشتركة بين العمليات حتى يصل إلغاء نسخة إعدادات النظام
+# عند حفظها إلى كل العمليات خلال ثوانٍ: 'file' على نفس الجهاز (المجلد ACC_CACHE_LOCATION، وكل قراءة منها
+# تفتح ملفًا)، أو 'redis' / 'memcached' (العنوان في ACC_CACHE_LOCATION).
+# مع LocMemCache تعيد العمليات الأخرى قراءة الإعدادات بعد دقيقة على الأكثر.
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+}
+CACHE_BACKEND = os.environ.get('ACC_CACHE_BACKEND', 'locmem')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': os.environ.get('ACC_CACHE_LOCATION', str(BASE_DIR / 'cache') if CACHE_BACKEND == 'file' else ''),
+    }
+}
+
+# إعدادات SQLite لكل اتصال (راجع core/sqlite.py): 'default' بدون تعديل، أو 'production'
+# (WAL و busy_timeout و synchronous=NORMAL ...) عند تشغيل أكثر من عامل على نفس قاعدة البيانات.
+# يمكن تعديل أي قيمة من SQLITE_PRAGMAS، مثال: {'busy_timeout': 30000}
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'default')
+SQLITE_PRAGMAS = {}
+
+if SQLITE_PROFILE == 'production':
+    # بدء المعاملات بقفل الكتابة حتى تنتظر العمليات المتزامنة بعضها بدلًا من فشلها
+    DATABASES['default']['OPTIONS'] = {'transaction_mode': 'IMMEDIATE'}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -164,7 +195,9 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 SITE_ID = 1
 
 AUTHENTICATION_BACKENDS = [
-    # Django default
+    # ModelBackend يحمّل الملف الشخصي مع المستخدم في نفس الاستعلام
+    'users.backends.ProfileModelBackend',
+    # Django default (للجلسات المسجلة قبل إضافة ProfileModelBackend)
     'django.contrib.auth.backends.ModelBackend',
     # Django AllAuth
     'allauth.account.auth_backends.AuthenticationBackend',
@@ -232,5 +265,44 @@ LOGOUT_REDIRECT_URL = 'home'
 # Django Role Permissions
 ROLEPERMISSIONS_MODULE = 'users.roles'
 
+# Logging
+# تفاصيل كل حركة أثناء الترحيل وإعادة حساب الأرصدة تظهر فقط عند ACC_LOG_LEVEL=DEBUG
+ACC_LOG_LEVEL = os.environ.get('ACC_LOG_LEVEL', 'INFO')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {
+            'format': '%(asctime)s %(levelname)s %(name)s: %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'simple',
+        },
+    },
+    'loggers': {
+        app: {
+            'handlers': ['console'],
+            'level': ACC_LOG_LEVEL,
+            'propagate': False,
+        }
+        for app in ['core', 'finances', 'invoices', 'products', 'users']
+    },
+}
+
+# فترة أرصدة الإقفال الدورية للخزن وجهات الاتصال والمنتجات ('day' أو 'month')
+# بعد تغييرها يجب تشغيل: python manage.py rebuild_balance_checkpoints
+LEDGER_CHECKPOINT_PERIOD = 'month'
+
+# عدد الصفوف في كل صفحة من صفحات القوائم (الفواتير، الحركات، جهات الاتصال...)
+LIST_PAGE_SIZE = 50
+
+# تعديل صيغة ترقيم المستندات لكل نوع مستند (راجع core/sequences.py)، مثال:
+# {'invoice': {'prefix': 'INV-{year}-', 'padding': 5, 'reset': 'yearly'}}
+DOCUMENT_NUMBERING = {}
+
 # Custom settings
 # Add any custom settings here
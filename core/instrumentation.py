@@ -0,0 +1,56 @@
+"""
+قياس عمليات الترحيل خلال الطلب الواحد
+
+تقوم المسارات الحرجة (ترحيل الفواتير وإعادة حساب الأرصدة) بزيادة عدادات وأزمنة بسيطة في الذاكرة
+بدون أي تنسيق نصوص، ويكتب PostingSummaryMiddleware سطرًا واحدًا في نهاية الطلب بالعدادات والأزمنة.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+_state = threading.local()
+
+
+def begin():
+    """بدء جمع العدادات لطلب جديد"""
+    _state.counters = {}
+    _state.timings = {}
+
+
+def end():
+    """إنهاء جمع العدادات وإرجاع (العدادات، الأزمنة بالثواني)"""
+    counters = getattr(_state, 'counters', None) or {}
+    timings = getattr(_state, 'timings', None) or {}
+    _state.counters = None
+    _state.timings = None
+    return counters, timings
+
+
+def count(name, amount=1):
+    """زيادة عداد (لا يفعل شيئًا خارج الطلبات)"""
+    counters = getattr(_state, 'counters', None)
+    if counters is not None:
+        counters[name] = counters.get(name, 0) + amount
+
+
+@contextmanager
+def timer(name):
+    """قياس الزمن المستغرق داخل الكتلة وإضافته إلى زمن العملية في الطلب الحالي"""
+    timings = getattr(_state, 'timings', None)
+    if timings is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0) + time.perf_counter() - started
+        count(name)
+
+
+def format_summary(counters, timings):
+    """تنسيق العدادات والأزمنة في سطر واحد (يستدعى مرة واحدة لكل طلب)"""
+    parts = [f"{name}={value}" for name, value in sorted(counters.items())]
+    parts.extend(f"{name}_ms={seconds * 1000:.1f}" for name, seconds in sorted(timings.items()))
+    return ' '.join(parts)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import query_plans
+
+
+class Command(BaseCommand):
+    help = 'التحقق من خطط تنفيذ الاستعلامات الأكثر استخدامًا وفشل الأمر إذا قام أي منها بمسح كامل للجدول'
+
+    def handle(self, *args, **options):
+        failures = []
+
+        for description, full_scans in query_plans.check_plans():
+            if full_scans:
+                failures.append(description)
+                self.stdout.write(self.style.ERROR(f'مسح كامل: {description}'))
+                for line in full_scans:
+                    self.stdout.write(f'    {line}')
+            else:
+                self.stdout.write(f'يستخدم فهرسًا: {description}')
+
+        if failures:
+            raise CommandError(f'{len(failures)} استعلام يقوم بمسح كامل للجدول')
+
+        self.stdout.write(self.style.SUCCESS('جميع الاستعلامات الحرجة تستخدم الفهارس.'))
@@ -0,0 +1,31 @@
+import logging
+import time
+
+from . import instrumentation
+
+logger = logging.getLogger(__name__)
+
+
+class PostingSummaryMiddleware:
+    """كتابة سطر ملخص واحد لكل طلب قام بعمليات ترحيل أو إعادة حساب أرصدة"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        instrumentation.begin()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            counters, timings = instrumentation.end()
+
+        # الطلبات التي لا تقوم بأي ترحيل لا تكتب شيئًا
+        if counters and logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "%s %s %s total_ms=%.1f %s",
+                request.method, request.path, response.status_code,
+                (time.perf_counter() - started) * 1000,
+                instrumentation.format_summary(counters, timings),
+            )
+        return response
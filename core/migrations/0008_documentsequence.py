@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-18 05:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_systemsettings_show_driver_in_permit_report_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_type', models.CharField(max_length=50, verbose_name='نوع المستند')),
+                ('year', models.PositiveIntegerField(default=0, verbose_name='السنة')),
+                ('last_number', models.PositiveBigIntegerField(default=0, verbose_name='آخر رقم')),
+                ('branch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='document_sequences', to='core.branch', verbose_name='الفرع')),
+            ],
+            options={
+                'verbose_name': 'عداد ترقيم مستندات',
+                'verbose_name_plural': 'عدادات ترقيم المستندات',
+                'constraints': [models.UniqueConstraint(fields=('document_type', 'branch', 'year'), name='document_sequence_unique'), models.UniqueConstraint(condition=models.Q(('branch__isnull', True)), fields=('document_type', 'year'), name='document_sequence_unique_no_branch')],
+            },
+        ),
+    ]
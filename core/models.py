@@ -1,6 +1,17 @@
+import copy
+import time
+import uuid
+
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+# نسخة إعدادات النظام المحفوظة في ذاكرة العملية لكل قاعدة بيانات:
+# {المفتاح: [رقم الإصدار، الإعدادات، وقت آخر مقارنة برقم الإصدار في الذاكرة المؤقتة]}
+_system_settings_entry = {}
 
 class Company(models.Model):
     name = models.CharField(_("اسم الشركة"), max_length=255)
@@ -177,8 +188,129 @@ class SystemSettings(models.Model):
     def __str__(self):
         return _("إعدادات النظام")
 
+    # مفاتيح الإعدادات في ذاكرة Django المؤقتة (المشتركة بين العمليات، راجع CACHES في الإعدادات)
+    CACHE_KEY = 'core:system_settings'
+    CACHE_VERSION_KEY = 'core:system_settings:version'
+
+    # مدة صلاحية النسخة المحفوظة (بالثواني) إذا كانت الذاكرة المؤقتة خاصة بكل عملية (LocMemCache)،
+    # لأن إلغاء النسخة عند الحفظ لا يصل إلى العمليات الأخرى في هذه الحالة
+    LOCAL_CACHE_TIMEOUT = 60
+
+    # أقصى مدة (بالثواني) تستخدم فيها العملية نسختها من الإعدادات بدون مقارنة رقم الإصدار في الذاكرة المؤقتة،
+    # حتى لا تتم قراءة الذاكرة المؤقتة (ملف أو طلب شبكة) مع كل استدعاء
+    VERSION_CHECK_INTERVAL = 5
+
+    # الحقول التي تشير إلى سجلات أخرى، لإلغاء النسخة المخزنة عند تعديل أو حذف هذه السجلات
+    REFERENCE_FIELDS = {
+        'Contact': ('default_customer_id', 'default_supplier_id'),
+        'Safe': ('default_safe_id',),
+        'Store': ('default_store_id',),
+    }
+
     @classmethod
-    def get_settings(cls):
-        """الحصول على إعدادات النظام، أو إنشاء إعدادات افتراضية إذا لم تكن موجودة"""
-        settings, created = cls.objects.get_or_create(pk=1)
+    def load_settings(cls):
+        """قراءة الإعدادات من قاعدة البيانات مع السجلات الافتراضية، أو إنشاء إعدادات افتراضية إذا لم تكن موجودة"""
+        settings, created = cls.objects.select_related(
+            'default_customer', 'default_supplier', 'default_safe', 'default_store'
+        ).get_or_create(pk=1)
         return settings
+
+    @classmethod
+    def get_cache_keys(cls):
+        """مفتاحا الإعدادات ورقم الإصدار لقاعدة البيانات الحالية (حتى لا تختلط إعدادات قاعدة الاختبار مثلًا)"""
+        from django.db import connection
+
+        database = connection.settings_dict['NAME']
+        return f'{cls.CACHE_KEY}:{database}', f'{cls.CACHE_VERSION_KEY}:{database}'
+
+    @staticmethod
+    def get_cache_timeout():
+        """بدون انتهاء مع ذاكرة مؤقتة مشتركة، ومدة محدودة إذا كانت خاصة بكل عملية"""
+        if isinstance(caches['default'], (LocMemCache, DummyCache)):
+            return SystemSettings.LOCAL_CACHE_TIMEOUT
+        return None
+
+    @classmethod
+    def get_settings(cls):
+        """
+        الحصول على إعدادات النظام بدون استعلامات بعد أول قراءة
+
+        تُحفظ الإعدادات في ذاكرة العملية وفي ذاكرة Django المؤقتة برقم إصدار يتغير عند حفظ الإعدادات،
+        فتعرف كل عملية تستخدم نفس الذاكرة المؤقتة أن نسختها قديمة. إذا كانت الذاكرة المؤقتة خاصة بكل عملية
+        ينتهي رقم الإصدار بعد LOCAL_CACHE_TIMEOUT فتعيد كل عملية قراءة الإعدادات.
+        تتم مقارنة رقم الإصدار مرة واحدة كل VERSION_CHECK_INTERVAL، وبينها تُستخدم نسخة العملية مباشرة.
+        تُرجع نسخة مستقلة حتى لا يؤثر تعديلها على النسخة المحفوظة.
+        """
+        cache_key, version_key = cls.get_cache_keys()
+        now = time.monotonic()
+
+        entry = _system_settings_entry.get(cache_key)
+        if entry is not None and now - entry[2] < cls.VERSION_CHECK_INTERVAL:
+            return copy.copy(entry[1])
+
+        timeout = cls.get_cache_timeout()
+        version = cache.get(version_key)
+        if version is None:
+            version = uuid.uuid4().hex
+            if not cache.add(version_key, version, timeout):
+                version = cache.get(version_key, version)
+
+        if entry is None or entry[0] != version:
+            shared = cache.get(cache_key)
+            if shared is None or shared[0] != version:
+                shared = (version, cls.load_settings())
+                cache.set(cache_key, shared, timeout)
+            entry = _system_settings_entry[cache_key] = [shared[0], shared[1], now]
+        else:
+            entry[2] = now
+
+        return copy.copy(entry[1])
+
+    @classmethod
+    def get_cached_settings(cls):
+        """الإعدادات المحفوظة حاليًا بدون قراءتها من قاعدة البيانات (أو None)"""
+        cache_key, _ = cls.get_cache_keys()
+        entry = _system_settings_entry.get(cache_key) or cache.get(cache_key)
+        return entry[1] if entry else None
+
+    @classmethod
+    def clear_cache(cls):
+        """إلغاء النسخة المحفوظة من الإعدادات في كل العمليات"""
+        cache_key, version_key = cls.get_cache_keys()
+        _system_settings_entry.clear()
+        cache.set(version_key, uuid.uuid4().hex, cls.get_cache_timeout())
+        cache.delete(cache_key)
+
+    @classmethod
+    def references(cls, instance):
+        """هل السجل (جهة اتصال أو خزنة أو مخزن) مستخدم كقيمة افتراضية في الإعدادات المحفوظة حاليًا؟"""
+        fields = cls.REFERENCE_FIELDS.get(type(instance).__name__)
+        settings = cls.get_cached_settings() if fields else None
+        return settings is not None and any(getattr(settings, field) == instance.pk for field in fields)
+
+
+class DocumentSequence(models.Model):
+    """
+    عداد أرقام المستندات لكل نوع مستند (ولكل فرع وسنة حسب إعدادات الترقيم DOCUMENT_NUMBERING)
+
+    يتم حجز الأرقام منه بزيادة مقفلة على الصف من خلال core.sequences.
+    """
+    document_type = models.CharField(_("نوع المستند"), max_length=50)
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, null=True, blank=True,
+                               related_name='document_sequences', verbose_name=_("الفرع"))
+    # 0 للترقيم المستمر الذي لا يبدأ من جديد كل سنة
+    year = models.PositiveIntegerField(_("السنة"), default=0)
+    last_number = models.PositiveBigIntegerField(_("آخر رقم"), default=0)
+
+    class Meta:
+        verbose_name = _("عداد ترقيم مستندات")
+        verbose_name_plural = _("عدادات ترقيم المستندات")
+        constraints = [
+            models.UniqueConstraint(fields=['document_type', 'branch', 'year'], name='document_sequence_unique'),
+            # القيم الفارغة لا تتكرر في القيد السابق، فيلزم قيد منفصل للعدادات غير المرتبطة بفرع
+            models.UniqueConstraint(fields=['document_type', 'year'], condition=models.Q(branch__isnull=True),
+                                    name='document_sequence_unique_no_branch'),
+        ]
+
+    def __str__(self):
+        return f"{self.document_type} - {self.year or '-'} - {self.last_number}"
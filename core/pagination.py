@@ -0,0 +1,116 @@
+"""
+تقسيم القوائم إلى صفحات
+
+- paginate: ترقيم عادي بالإزاحة (page=N) للقوائم الصغيرة أو التي لا ترتيب ثابت لها.
+- keyset_paginate: ترقيم بالمؤشر على (التاريخ، المعرف) لقوائم الحركات والمستندات، حيث تبدأ كل صفحة
+  من آخر صف في الصفحة السابقة بدلاً من تخطي كل ما قبلها، فيبقى زمن الصفحة ثابتًا مهما كبر الجدول.
+
+في الحالتين يتم الاحتفاظ بمعاملات البحث والتصفية الحالية في روابط الصفحات.
+"""
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+# معاملات الترقيم التي لا يجب نقلها مع فلاتر البحث إلى روابط الصفحات
+PAGE_PARAMS = ('page', 'after', 'before')
+
+
+def get_page_size():
+    """عدد الصفوف في الصفحة الواحدة"""
+    return getattr(settings, 'LIST_PAGE_SIZE', 50)
+
+
+def get_querystring(request):
+    """معاملات الطلب الحالية (البحث والتصفية) بدون معاملات الترقيم"""
+    params = request.GET.copy()
+    for name in PAGE_PARAMS:
+        params.pop(name, None)
+    return params.urlencode()
+
+
+def paginate(request, queryset, per_page=None):
+    """ترقيم عادي بالإزاحة، ويرجع صفحة Django القياسية"""
+    paginator = Paginator(queryset, per_page or get_page_size())
+    return paginator.get_page(request.GET.get('page'))
+
+
+class KeysetPage:
+    """صفحة ناتجة عن الترقيم بالمؤشر، ويمكن المرور عليها في القالب مثل القائمة العادية"""
+
+    is_keyset = True
+
+    def __init__(self, object_list, has_next, has_previous, date_field):
+        self.object_list = object_list
+        self.has_next_page = has_next
+        self.has_previous_page = has_previous
+        self.date_field = date_field
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.has_next_page
+
+    def has_previous(self):
+        return self.has_previous_page
+
+    def has_other_pages(self):
+        return self.has_next_page or self.has_previous_page
+
+    def get_cursor(self, obj):
+        """تحويل موضع الصف إلى مؤشر نصي: <التاريخ>_<المعرف>"""
+        return f"{getattr(obj, self.date_field).isoformat()}_{obj.pk}"
+
+    @property
+    def next_cursor(self):
+        return self.get_cursor(self.object_list[-1]) if self.has_next_page and self.object_list else ''
+
+    @property
+    def previous_cursor(self):
+        return self.get_cursor(self.object_list[0]) if self.has_previous_page and self.object_list else ''
+
+
+def parse_cursor(queryset, date_field, cursor):
+    """قراءة المؤشر وإرجاع (التاريخ، المعرف) أو None إذا كان غير صالح"""
+    if not cursor:
+        return None
+    value, _, pk = cursor.rpartition('_')
+    try:
+        field = queryset.model._meta.get_field(date_field)
+        return field.to_python(value), int(pk)
+    except (ValidationError, ValueError):
+        return None
+
+
+def keyset_paginate(request, queryset, date_field='date', per_page=None):
+    """
+    ترقيم بالمؤشر على (date_field، id) بترتيب تنازلي (الأحدث أولاً)
+
+    المؤشر after يعرض الصفحة التالية (الصفوف الأقدم من آخر صف)، والمؤشر before يعرض الصفحة السابقة.
+    يتم جلب صف إضافي واحد لمعرفة وجود صفحة أخرى بدون استعلام عدّ على الجدول كله.
+    """
+    per_page = per_page or get_page_size()
+    after = parse_cursor(queryset, date_field, request.GET.get('after'))
+    before = parse_cursor(queryset, date_field, request.GET.get('before'))
+
+    if before:
+        date, pk = before
+        rows = list(queryset.filter(
+            Q(**{f'{date_field}__gt': date}) | Q(**{date_field: date, 'id__gt': pk})
+        ).order_by(date_field, 'id')[:per_page + 1])
+        has_previous = len(rows) > per_page
+        object_list = rows[:per_page][::-1]
+        return KeysetPage(object_list, True, has_previous, date_field)
+
+    queryset = queryset.order_by(f'-{date_field}', '-id')
+    if after:
+        date, pk = after
+        queryset = queryset.filter(
+            Q(**{f'{date_field}__lt': date}) | Q(**{date_field: date, 'id__lt': pk})
+        )
+    rows = list(queryset[:per_page + 1])
+    return KeysetPage(rows[:per_page], len(rows) > per_page, after is not None, date_field)
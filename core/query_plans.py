@@ -0,0 +1,96 @@
+"""
+خطط تنفيذ الاستعلامات الأكثر استخدامًا في الترحيل والقوائم والتقارير
+
+يتم التحقق منها في core/tests.py ومن أمر check_query_plans (على قاعدة البيانات الفعلية)،
+ويفشل التحقق إذا قام أي استعلام بمسح كامل لجدوله بدلًا من استخدام فهرس.
+"""
+import re
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from employees.models import Attendance
+from finances import ledger
+from finances.models import SafeTransaction, ContactTransaction, ProductTransaction, StockBalance, BalanceCheckpoint
+from hatchery.models import DisinfectantTransaction, BatchDailyKPI
+from invoices.models import Invoice, Payment
+
+
+def get_hot_queries():
+    """الاستعلامات الحرجة: (الوصف، الاستعلام)"""
+    now = timezone.now()
+    month_ago = now - timedelta(days=30)
+
+    return [
+        ('حركات الخزنة بعد موضع معين', SafeTransaction.objects.filter(
+            safe_id=1, date__gte=month_ago).order_by('date', 'id')),
+        ('آخر رصيد خزنة قبل موضع معين', SafeTransaction.objects.filter(
+            safe_id=1, date__lte=month_ago).order_by('-date', '-id')[:1]),
+        ('حركات الحساب بعد موضع معين', ContactTransaction.objects.filter(
+            contact_id=1, date__gte=month_ago).order_by('date', 'id')),
+        ('آخر رصيد حساب قبل موضع معين', ContactTransaction.objects.filter(
+            contact_id=1, date__lte=month_ago).order_by('-date', '-id')[:1]),
+        ('حركات المنتج مرتبة', ProductTransaction.objects.filter(
+            product_id=1).order_by('date', 'id')),
+        ('حركات المنتج في مخزن خلال فترة', ProductTransaction.objects.filter(
+            product_id=1, store_id=1, date__gte=month_ago)),
+        ('حركات الخزنة للفاتورة', SafeTransaction.objects.filter(invoice_id=1)),
+        ('حركات الحساب للفاتورة', ContactTransaction.objects.filter(invoice_id=1)),
+        ('حركات المنتجات للفاتورة', ProductTransaction.objects.filter(invoice_id=1)),
+        ('قائمة الفواتير', Invoice.objects.order_by('-date', '-id')[:20]),
+        ('قائمة الفواتير حسب النوع', Invoice.objects.filter(
+            invoice_type=Invoice.SALE).order_by('-date', '-id')[:20]),
+        ('صفحة تالية من الفواتير', Invoice.objects.filter(
+            Q(date__lt=month_ago) | Q(date=month_ago, id__lt=1)).order_by('-date', '-id')[:51]),
+        ('صفحة تالية من المدفوعات', Payment.objects.filter(
+            Q(date__lt=month_ago) | Q(date=month_ago, id__lt=1)).order_by('-date', '-id')[:51]),
+        ('صفحة تالية من حركات المخزون', ProductTransaction.objects.filter(
+            Q(date__lt=month_ago) | Q(date=month_ago, id__lt=1)).order_by('-date', '-id')[:51]),
+        ('صفحة تالية من حركات المطهرات', DisinfectantTransaction.objects.filter(
+            Q(transaction_date__lt=month_ago.date()) | Q(transaction_date=month_ago.date(), id__lt=1)
+        ).order_by('-transaction_date', '-id')[:51]),
+        ('مؤشرات المعمل لفترة', BatchDailyKPI.objects.filter(
+            date__gte=month_ago.date(), date__lte=now.date())),
+        ('الحضور الشهري', Attendance.objects.filter(date__year=now.year, date__month=now.month)),
+        ('حضور موظف خلال فترة', Attendance.objects.filter(employee_id=1, date__gte=month_ago.date())),
+        ('رصيد منتج في مخزن', StockBalance.objects.filter(product_id=1, store_id=1)),
+        ('أقرب رصيد إقفال', BalanceCheckpoint.objects.filter(
+            kind=ledger.SAFE, account_id=1, period=BalanceCheckpoint.MONTH,
+            period_end__lt=now.date()).order_by('-period_end')[:1]),
+    ]
+
+
+def get_full_scans(plan, table):
+    """أسطر الخطة التي تمسح جدول الاستعلام بالكامل بدون فهرس"""
+    if connection.vendor == 'postgresql':
+        pattern = re.compile(rf'Seq Scan on {re.escape(table)}\b')
+    else:
+        # SQLite: "SCAN table" بدون "USING INDEX" أو "USING COVERING INDEX"
+        pattern = re.compile(rf'\bSCAN {re.escape(table)}\b(?!.*USING (COVERING )?INDEX)')
+    return [line.strip() for line in plan.splitlines() if pattern.search(line)]
+
+
+@contextmanager
+def planning():
+    """
+    معاملة لحساب الخطط يتم التراجع عنها، مع منع المسح التسلسلي في PostgreSQL
+    (الجداول الصغيرة تُمسح تسلسليًا حتى مع وجود الفهرس، لذلك نمنعه لمعرفة ما إذا كان هناك فهرس مناسب)
+    """
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        yield
+        transaction.set_rollback(True)
+
+
+def check_plans():
+    """(الوصف، أسطر المسح الكامل) لكل استعلام حرج"""
+    with planning():
+        return [
+            (description, get_full_scans(queryset.explain(), queryset.model._meta.db_table))
+            for description, queryset in get_hot_queries()
+        ]
@@ -0,0 +1,234 @@
+"""
+ترقيم المستندات (الفواتير، التحصيلات والمدفوعات، المصروفات، الإيرادات، الإيداع، السحب، أذونات المخزن)
+
+يتم حجز الرقم التالي من عداد لكل نوع مستند (DocumentSequence) بزيادة على صف العداد بعد قفله
+(select_for_update) داخل معاملة حفظ المستند، فلا يحصل مستخدمان على نفس الرقم، وإذا تم التراجع
+عن حفظ المستند يتم التراجع عن الزيادة أيضًا فيبقى الترقيم بدون فجوات. وبدلًا من البحث عن آخر
+مستند وتحليل رقمه مع كل مستند، يتم ذلك مرة واحدة فقط عند إنشاء العداد.
+
+لتقليل التنافس على صف العداد يمكن حجز مجموعة أرقام لكل عملية مرة واحدة (block_size)، ويتم ذلك
+فقط عند الحجز خارج المعاملات (لأن التراجع عن المعاملة يلغي الحجز بينما تبقى الأرقام في ذاكرة
+العملية)، وقد تظهر فجوات في الترقيم عند إعادة تشغيل العملية قبل استخدام كل الأرقام المحجوزة.
+
+إعدادات كل نوع مستند (ويمكن تعديلها من DOCUMENT_NUMBERING في الإعدادات):
+    prefix: بادئة الرقم، ويمكن أن تحتوي على {year} و {branch} (رقم الفرع)
+    padding: عدد خانات الرقم (يكمل بالأصفار من اليسار)
+    reset: 'yearly' لبدء الترقيم من جديد كل سنة (يجب أن تحتوي البادئة على {year})
+    per_branch: عداد منفصل لكل فرع (يجب أن تحتوي البادئة على {branch})
+    block_size: عدد الأرقام المحجوزة لكل عملية (0 للترقيم بدون فجوات)
+"""
+import re
+import threading
+from string import Formatter
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+
+from .models import DocumentSequence
+
+YEARLY = 'yearly'
+
+DEFAULTS = {
+    'prefix': '',
+    'padding': 0,
+    'reset': None,
+    'per_branch': False,
+    'block_size': 0,
+}
+
+# أنواع المستندات ونموذج كل نوع (للبحث عن آخر رقم مستخدم عند إنشاء العداد)
+DOCUMENT_TYPES = {
+    'invoice': {'model': 'invoices.Invoice'},
+    'payment': {'model': 'invoices.Payment'},
+    'expense': {'model': 'finances.Expense', 'prefix': 'EXP-', 'padding': 4},
+    'income': {'model': 'finances.Income', 'prefix': 'INC-', 'padding': 4},
+    'safe_deposit': {'model': 'finances.SafeDeposit', 'prefix': 'DEP-', 'padding': 4},
+    'safe_withdrawal': {'model': 'finances.SafeWithdrawal', 'prefix': 'WDR-', 'padding': 4},
+    'store_permit': {'model': 'finances.StorePermit', 'prefix': 'PER-', 'padding': 4},
+    'store_permit_issue': {'model': 'finances.StorePermit', 'prefix': 'ISS-', 'padding': 4},
+    'store_permit_receive': {'model': 'finances.StorePermit', 'prefix': 'REC-', 'padding': 4},
+}
+
+# الأرقام المحجوزة لهذه العملية: {(نوع المستند، الفرع، السنة): [الرقم التالي، آخر رقم محجوز]}
+_blocks = {}
+_blocks_lock = threading.Lock()
+
+
+def get_format(document_type):
+    """إعدادات ترقيم نوع المستند بعد دمج DOCUMENT_NUMBERING"""
+    if document_type not in DOCUMENT_TYPES:
+        raise ValueError(f"نوع مستند غير معروف: {document_type}")
+
+    number_format = {**DEFAULTS, **DOCUMENT_TYPES[document_type]}
+    number_format.update(getattr(settings, 'DOCUMENT_NUMBERING', {}).get(document_type, {}))
+
+    if number_format['reset'] == YEARLY and '{year}' not in number_format['prefix']:
+        raise ImproperlyConfigured(f"ترقيم {document_type} يبدأ كل سنة ويجب أن تحتوي البادئة على {{year}}")
+    if number_format['per_branch'] and '{branch}' not in number_format['prefix']:
+        raise ImproperlyConfigured(f"ترقيم {document_type} منفصل لكل فرع ويجب أن تحتوي البادئة على {{branch}}")
+    return number_format
+
+
+def _resolve(document_type, branch_id, date):
+    """إعدادات الترقيم ومفتاح العداد (نوع المستند، الفرع، السنة) وبادئة الرقم"""
+    number_format = get_format(document_type)
+    year = (date or timezone.localdate()).year
+    branch_id = branch_id if number_format['per_branch'] else None
+    key = (document_type, branch_id, year if number_format['reset'] == YEARLY else 0)
+    prefix = number_format['prefix'].format(year=year, branch=branch_id or 0)
+    return number_format, key, prefix
+
+
+def format_number(number_format, prefix, value):
+    return f"{prefix}{value:0{number_format['padding']}d}"
+
+
+def parse_number(prefix, number):
+    """الرقم المتسلسل من رقم المستند إذا كان بصيغة العداد، وإلا None"""
+    if number and number.startswith(prefix):
+        value = number[len(prefix):]
+        if value.isdecimal():
+            return int(value)
+    return None
+
+
+def parse_legacy_number(number):
+    """
+    الرقم المتسلسل من أرقام المستندات قبل العدادات بصيغة X-123 (أو None)،
+    حيث كان الرقم التالي يؤخذ من الجزء بعد "-" في آخر مستند
+    """
+    if number and '-' in number:
+        value = number.split('-')[1]
+        if value.isdecimal():
+            return int(value)
+    return None
+
+
+def matches_format(number_format, number):
+    """هل الرقم بصيغة العداد لأي فرع أو سنة (مثل رقم مقترح لفرع آخر) وليس رقمًا يدويًا بصيغة أخرى"""
+    pattern = ''
+    for literal, field_name, _, _ in Formatter().parse(number_format['prefix']):
+        pattern += re.escape(literal)
+        if field_name is not None:
+            pattern += r'\d+'
+    return re.fullmatch(pattern + r'\d+', number) is not None
+
+
+def _get_used_numbers(number_format, prefix):
+    return apps.get_model(number_format['model']).objects.filter(number__startswith=prefix)
+
+
+def _get_last_used(number_format, prefix):
+    """
+    أكبر رقم بصيغة العداد في المستندات الموجودة (يستخدم مرة واحدة عند إنشاء العداد)
+
+    بدون بادئة يتم أيضًا احتساب الأرقام القديمة بصيغة X-123 حتى يستمر الترقيم بعدها.
+    """
+    values = []
+    for number in _get_used_numbers(number_format, prefix).values_list('number', flat=True):
+        value = parse_number(prefix, number)
+        if value is None and not number_format['prefix']:
+            value = parse_legacy_number(number)
+        if value is not None:
+            values.append(value)
+    return max(values, default=0)
+
+
+def _lock_sequence(number_format, key, prefix):
+    """صف العداد مقفلًا حتى نهاية المعاملة الحالية، مع إنشائه إذا لم يكن موجودًا"""
+    document_type, branch_id, year = key
+    lookup = {'document_type': document_type, 'branch_id': branch_id, 'year': year}
+
+    sequence = DocumentSequence.objects.select_for_update().filter(**lookup).first()
+    if sequence is None:
+        DocumentSequence.objects.get_or_create(**lookup, defaults={
+            'last_number': _get_last_used(number_format, prefix)
+        })
+        sequence = DocumentSequence.objects.select_for_update().get(**lookup)
+    return sequence
+
+
+def _increment(number_format, key, prefix, count=1):
+    """زيادة العداد وإرجاع آخر رقم محجوز"""
+    with transaction.atomic():
+        sequence = _lock_sequence(number_format, key, prefix)
+        sequence.last_number += count
+        sequence.save(update_fields=['last_number'])
+    return sequence.last_number
+
+
+def _allocate_from_block(number_format, key, prefix):
+    """رقم من مجموعة الأرقام المحجوزة لهذه العملية، مع حجز مجموعة جديدة عند انتهائها"""
+    with _blocks_lock:
+        block = _blocks.get(key)
+        if block is None or block[0] > block[1]:
+            last = _increment(number_format, key, prefix, number_format['block_size'])
+            block = _blocks[key] = [last - number_format['block_size'] + 1, last]
+        value = block[0]
+        block[0] += 1
+    return value
+
+
+def allocate(document_type, branch_id=None, date=None):
+    """
+    حجز الرقم التالي لنوع المستند وإرجاعه منسقًا
+
+    يجب استدعاؤها داخل معاملة حفظ المستند حتى يتم التراجع عن الحجز مع التراجع عن الحفظ.
+    """
+    number_format, key, prefix = _resolve(document_type, branch_id, date)
+    if number_format['block_size'] > 1 and not transaction.get_connection().in_atomic_block:
+        value = _allocate_from_block(number_format, key, prefix)
+    else:
+        value = _increment(number_format, key, prefix)
+    return format_number(number_format, prefix, value)
+
+
+def preview(document_type, branch_id=None, date=None):
+    """الرقم التالي المتوقع لعرضه في نموذج الإضافة، بدون حجزه"""
+    number_format, (document_type, branch_id, year), prefix = _resolve(document_type, branch_id, date)
+    last = DocumentSequence.objects.filter(
+        document_type=document_type, branch_id=branch_id, year=year
+    ).values_list('last_number', flat=True).first()
+    if last is None:
+        last = _get_last_used(number_format, prefix)
+    return format_number(number_format, prefix, last + 1)
+
+
+def claim(document_type, number=None, branch_id=None, date=None):
+    """
+    رقم المستند عند حفظه من نموذج يعرض الرقم المقترح (preview) ويسمح بتعديله
+
+    - بدون رقم: يتم حجز الرقم التالي.
+    - رقم بصيغة العداد بعد آخر رقم محجوز (الرقم المقترح أو رقم بعده): يستخدم ويتقدم العداد إليه.
+    - رقم بصيغة العداد تم حجزه بالفعل (رقم مقترح حصل عليه مستخدم آخر أولًا): يتم حجز الرقم التالي،
+      إلا إذا لم يكن مستخدمًا في أي مستند (رقم مستند محذوف) والترقيم بدون فجوات.
+    - رقم بصيغة العداد لفرع أو سنة أخرى (الرقم المقترح قبل اختيار مخزن أو خزنة من فرع آخر أو تغيير التاريخ):
+      يتم حجز الرقم التالي لفرع وسنة المستند.
+    - غير ذلك (رقم يدوي بصيغة أخرى): يستخدم كما هو.
+    يجب استدعاؤها داخل معاملة حفظ المستند.
+    """
+    if not number:
+        return allocate(document_type, branch_id, date)
+
+    number_format, key, prefix = _resolve(document_type, branch_id, date)
+    value = parse_number(prefix, number)
+    if value is None:
+        if matches_format(number_format, number):
+            return allocate(document_type, branch_id, date)
+        return number
+
+    with transaction.atomic():
+        sequence = _lock_sequence(number_format, key, prefix)
+        if value > sequence.last_number:
+            sequence.last_number = value
+        elif number_format['block_size'] <= 1 and not _get_used_numbers(number_format, prefix).filter(number=number).exists():
+            return number
+        else:
+            # الرقم مستخدم بالفعل أو قد يكون ضمن الأرقام المحجوزة لعملية أخرى
+            sequence.last_number += 1
+            number = format_number(number_format, prefix, sequence.last_number)
+        sequence.save(update_fields=['last_number'])
+    return number
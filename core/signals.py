@@ -0,0 +1,27 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import SystemSettings, Contact, Safe, Store
+from . import sqlite
+
+# إعدادات SQLite (WAL و busy_timeout ...) لكل اتصال جديد حسب SQLITE_PROFILE
+connection_created.connect(sqlite.configure_connection, dispatch_uid='core.sqlite.configure_connection')
+
+
+@receiver([post_save, post_delete], sender=SystemSettings)
+def handle_system_settings_change(sender, instance, **kwargs):
+    """إلغاء نسخة الإعدادات المحفوظة عند حفظها، ومرة أخرى بعد تأكيد المعاملة
+    حتى لا تحفظ عملية أخرى القيم القديمة التي قرأتها قبل التأكيد"""
+    SystemSettings.clear_cache()
+    transaction.on_commit(SystemSettings.clear_cache)
+
+
+@receiver([post_save, post_delete], sender=Contact)
+@receiver([post_save, post_delete], sender=Safe)
+@receiver([post_save, post_delete], sender=Store)
+def handle_settings_reference_change(sender, instance, **kwargs):
+    """إلغاء نسخة الإعدادات المحفوظة عند تعديل أو حذف العميل أو المورد أو الخزنة أو المخزن الافتراضي"""
+    if SystemSettings.references(instance):
+        SystemSettings.clear_cache()
+        transaction.on_commit(SystemSettings.clear_cache)
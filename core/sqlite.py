@@ -0,0 +1,56 @@
+"""
+إعدادات SQLite لكل اتصال جديد بقاعدة البيانات (PRAGMA)
+
+الإعدادات الافتراضية لـ SQLite (rollback journal) تجعل كل عملية كتابة (ترحيل) تمنع القراءة حتى تنتهي،
+وعند تشغيل أكثر من عامل (gunicorn worker) تفشل العمليات المتزامنة بخطأ "database is locked".
+ملف production يفعل WAL (القراءة لا تنتظر الكتابة)، وانتظار القفل بدلًا من الفشل (busy_timeout)،
+و synchronous=NORMAL (آمن مع WAL ويقلل مرات الكتابة على القرص)، مع ذاكرة أكبر للصفحات والجداول المؤقتة.
+
+يتم اختيار الملف من SQLITE_PROFILE في الإعدادات، ويمكن تعديل أي قيمة من SQLITE_PRAGMAS.
+مع ملف production يجب أيضًا بدء المعاملات بقفل الكتابة (transaction_mode: IMMEDIATE في DATABASES)،
+وإلا تفشل المعاملة التي قرأت ثم حاولت الكتابة بعد كتابة عملية أخرى بدون انتظار busy_timeout.
+"""
+from django.conf import settings
+
+PROFILES = {
+    'default': {},
+    'production': {
+        'journal_mode': 'WAL',
+        'busy_timeout': 20000,  # مللي ثانية
+        'synchronous': 'NORMAL',
+        'cache_size': -64000,  # القيمة السالبة بالكيلوبايت (64 ميجابايت لكل اتصال)
+        'mmap_size': 268435456,  # 256 ميجابايت
+        'temp_store': 'MEMORY',
+    },
+}
+
+
+def get_pragmas():
+    """إعدادات PRAGMA للملف المختار بعد دمج SQLITE_PRAGMAS"""
+    profile = getattr(settings, 'SQLITE_PROFILE', 'default')
+    if profile not in PROFILES:
+        raise ValueError(f"ملف إعدادات SQLite غير معروف: {profile}")
+    return {**PROFILES[profile], **getattr(settings, 'SQLITE_PRAGMAS', {})}
+
+
+def configure_connection(sender, connection, **kwargs):
+    """تطبيق إعدادات PRAGMA على كل اتصال SQLite جديد (إشارة connection_created)"""
+    if connection.vendor != 'sqlite':
+        return
+
+    pragmas = get_pragmas()
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def get_current_pragmas(connection):
+    """قيم الإعدادات الفعلية على الاتصال (للتحقق والقياس)"""
+    with connection.cursor() as cursor:
+        values = {}
+        for name in PROFILES['production']:
+            cursor.execute(f'PRAGMA {name}')
+            values[name] = cursor.fetchone()[0]
+    return values
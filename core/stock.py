@@ -0,0 +1,98 @@
+"""
+الأرصدة المخزنة للأصناف التي يتم تحديثها من الحركات فقط (مثل رصيد المطهرات)
+
+- StoredStockMixin: للصنف صاحب الرصيد. لا يتم الكتابة فوق الرصيد عند تعديل بيانات الصنف،
+  ويتم إضافة أثر الحركات إليه بتحديث ذري (F) بدون قراءة الرصيد.
+- StockMovementMixin: للحركة على الرصيد. يتم تعديل رصيد الصنف بأثر الحركة في نفس المعاملة
+  عند الإضافة أو التعديل (بفرق الأثر فقط) أو الحذف، فلا تضيع التحديثات عند تسجيل أكثر من حركة في نفس الوقت.
+"""
+from django.db import transaction
+from django.db.models import F
+
+
+class StoredStockMixin:
+    """صنف له رصيد مخزن (STOCK_FIELD) يتم تحديثه من الحركات فقط"""
+
+    STOCK_FIELD = 'current_stock'
+
+    def save(self, *args, **kwargs):
+        # الرصيد يتم تحديثه من الحركات فقط، فلا يتم الكتابة فوقه بقيمة قديمة عند تعديل بيانات الصنف
+        if not self._state.adding and not kwargs.get('update_fields') and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != self.STOCK_FIELD
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def apply_movement(cls, item_id, delta):
+        """إضافة أثر حركة إلى رصيد الصنف بتحديث ذري في قاعدة البيانات"""
+        if not delta:
+            return
+        cls.objects.filter(pk=item_id).update(**{cls.STOCK_FIELD: F(cls.STOCK_FIELD) + delta})
+
+
+class StockMovementMixin:
+    """
+    حركة على رصيد صنف
+
+    كل نموذج حركة يجب أن يحدد:
+    STOCK_ITEM_FIELD: حقل الصنف في الحركة (والصنف يستخدم StoredStockMixin)،
+    calculate_stock_effect(values): أثر الحركة على رصيد الصنف من قيم STOCK_EFFECT_FIELDS.
+    """
+
+    # حقول الحركة التي يعتمد عليها أثرها
+    STOCK_EFFECT_FIELDS = ('quantity',)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        missing = [name for name in ('STOCK_ITEM_FIELD', 'calculate_stock_effect') if not hasattr(cls, name)]
+        if missing:
+            raise TypeError(f"{cls.__name__} يجب أن يحدد {', '.join(missing)}")
+
+    def get_stock_effect(self):
+        return self.calculate_stock_effect({name: getattr(self, name) for name in self.STOCK_EFFECT_FIELDS})
+
+    def save(self, *args, **kwargs):
+        item_field = self._meta.get_field(self.STOCK_ITEM_FIELD)
+        item_model = item_field.related_model
+
+        with transaction.atomic():
+            # بيانات الحركة قبل التعديل لعكس أثرها على الرصيد (وليس إعادة تطبيق الحركة كاملة)
+            previous = None
+            if self.pk:
+                previous = type(self).objects.filter(pk=self.pk).values(
+                    item_field.attname, *self.STOCK_EFFECT_FIELDS
+                ).first()
+
+            super().save(*args, **kwargs)
+
+            # تحديث الرصيد بفرق الحركة فقط
+            item_id = getattr(self, item_field.attname)
+            effect = self.get_stock_effect()
+            if previous:
+                previous_effect = self.calculate_stock_effect(previous)
+                if previous[item_field.attname] == item_id:
+                    effect -= previous_effect
+                else:
+                    item_model.apply_movement(previous[item_field.attname], -previous_effect)
+            item_model.apply_movement(item_id, effect)
+
+        self.refresh_stock_item()
+
+    def delete(self, *args, **kwargs):
+        item_field = self._meta.get_field(self.STOCK_ITEM_FIELD)
+
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            item_field.related_model.apply_movement(getattr(self, item_field.attname), -self.get_stock_effect())
+
+        self.refresh_stock_item()
+        return result
+
+    def refresh_stock_item(self):
+        """تحديث رصيد الصنف المحمل مع الحركة بعد تعديله في قاعدة البيانات"""
+        item_field = self._meta.get_field(self.STOCK_ITEM_FIELD)
+        if item_field.is_cached(self):
+            item = getattr(self, self.STOCK_ITEM_FIELD)
+            item.refresh_from_db(fields=[item.STOCK_FIELD])
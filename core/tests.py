@@ -1,3 +1,12 @@
 from django.test import TestCase
 
-# Create your tests here.
+from core import query_plans
+
+
+class QueryPlanTests(TestCase):
+    """الاستعلامات الحرجة يجب أن تستخدم الفهارس وليس مسحًا كاملًا للجدول"""
+
+    def test_hot_queries_use_indexes(self):
+        for description, full_scans in query_plans.check_plans():
+            with self.subTest(description):
+                self.assertEqual(full_scans, [], f'مسح كامل: {description}')
@@ -1,12 +1,17 @@
+from datetime import datetime
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.db.models import Q
+from django.utils import timezone
 from .models import Company, Branch, Store, Safe, Contact, Representative, Driver, SystemSettings
 from .forms import CompanyForm, BranchForm, StoreForm, SafeForm, RepresentativeForm, DriverForm, ContactForm, SystemSettingsForm
 from products.models import Product, Category
 from invoices.models import Invoice
-from finances.models import ContactTransaction
+from finances import ledger
+from finances.models import ContactTransaction, BalanceCheckpoint
+from .pagination import paginate, get_querystring
 from users.decorators import can_create, can_edit, can_delete
 
 # Create your views here.
@@ -351,8 +356,12 @@ def contact_list(request, contact_type=None):
         title = 'جهات الاتصال'
         add_url = 'contact_add'
 
+    page = paginate(request, contacts.order_by('id'))
+
     return render(request, 'core/contact/list.html', {
-        'contacts': contacts,
+        'contacts': page,
+        'page_obj': page,
+        'page_querystring': get_querystring(request),
         'title': title,
         'add_url': add_url,
         'contact_type': contact_type
@@ -489,16 +498,26 @@ def contact_statement(request, pk):
     """عرض كشف حساب العميل/المورد"""
     contact = get_object_or_404(Contact, pk=pk)
 
-    # الحصول على جميع حركات الحساب لهذا العميل/المورد
-    transactions = ContactTransaction.objects.filter(contact=contact).order_by('date')
+    # الحصول على جميع حركات الحساب لهذا العميل/المورد مع أثر كل حركة على الرصيد
+    transactions = ContactTransaction.objects.filter(contact=contact).annotate(
+        balance_effect=ContactTransaction.get_balance_effect_expression(contact)
+    ).order_by('date', 'id')
 
     # البحث والتصفية
     date_from = request.GET.get('date_from', '')
     date_to = request.GET.get('date_to', '')
     transaction_type = request.GET.get('type', '')
 
+    # الرصيد الافتتاحي للكشف: رصيد الحساب قبل بداية الفترة من أقرب رصيد إقفال
+    opening_balance = contact.initial_balance
+
     # تطبيق التصفية حسب التاريخ
     if date_from:
+        try:
+            date_from_obj = timezone.make_aware(datetime.strptime(date_from, '%Y-%m-%d'))
+            opening_balance = BalanceCheckpoint.get_opening_balance(ledger.CONTACT, contact, date_from_obj)
+        except ValueError:
+            pass
         transactions = transactions.filter(date__gte=date_from)
     if date_to:
         transactions = transactions.filter(date__lte=date_to)
@@ -516,13 +535,13 @@ def contact_statement(request, pk):
             Q(invoice__number__icontains=query)
         )
 
-    # حساب الرصيد التراكمي لكل حركة
-    running_balance = contact.initial_balance
+    # حساب الرصيد التراكمي لكل حركة بدءًا من الرصيد الافتتاحي للفترة
+    running_balance = opening_balance
     transaction_list = []
 
     for transaction in transactions:
         # حساب الرصيد التراكمي
-        running_balance += transaction.amount
+        running_balance += transaction.balance_effect
 
         # تحديد المبلغ الدائن والمدين
         debit_amount = 0
@@ -545,6 +564,7 @@ def contact_statement(request, pk):
         'contact': contact,
         'transactions': transaction_list,
         'initial_balance': contact.initial_balance,
+        'opening_balance': opening_balance,
         'current_balance': contact.current_balance,
         'date_from': date_from,
         'date_to': date_to,
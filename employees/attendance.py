@@ -0,0 +1,238 @@
+"""
+ملخص الحضور الشهري للموظفين وتسجيل الحضور الجماعي
+
+يتم حساب عدد أيام الحضور والغياب والغياب بعذر لجميع الموظفين باستعلام تجميعي واحد (Count مع filter)
+بدلًا من ثلاثة استعلامات عدّ لكل موظف، ويتم بناء جدول الأيام من جلب واحد لسجلات الشهر.
+التصفية تتم على مدى تواريخ (من أول الشهر حتى أول الشهر التالي) ليستخدم فهرس التاريخ.
+
+التسجيل الجماعي (من شاشة الحضور الجماعي أو من ملفات CSV وتصدير أجهزة البصمة) يجلب السجلات الموجودة
+باستعلام واحد، ثم يحدّث المتغير منها بـ bulk_update وينشئ الجديد بـ bulk_create داخل معاملة واحدة.
+"""
+import calendar
+import csv
+from datetime import date, datetime
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import Employee, Attendance
+
+STATUS_COUNT_KEYS = {
+    Attendance.PRESENT: 'present_count',
+    Attendance.ABSENT: 'absent_count',
+    Attendance.EXCUSED: 'excused_count',
+}
+
+EMPTY_COUNTS = {key: 0 for key in STATUS_COUNT_KEYS.values()}
+
+
+def get_month_range(year, month):
+    """أول يوم في الشهر وأول يوم في الشهر التالي (للتصفية بـ date__gte و date__lt)"""
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+
+def get_month_records(year, month, employee_ids=None):
+    """سجلات حضور الشهر، ويمكن قصرها على موظفين محددين"""
+    start, end = get_month_range(year, month)
+    records = Attendance.objects.filter(date__gte=start, date__lt=end)
+    if employee_ids is not None:
+        records = records.filter(employee_id__in=employee_ids)
+    return records
+
+
+def get_status_counts(year, month, employee_ids=None):
+    """
+    عدد أيام كل حالة لكل موظف في الشهر باستعلام واحد
+
+    يرجع: {employee_id: {'present_count': .., 'absent_count': .., 'excused_count': ..}}
+    والموظف الذي ليس له سجلات في الشهر لا يظهر في القاموس.
+    """
+    rows = get_month_records(year, month, employee_ids).order_by().values('employee_id').annotate(**{
+        key: Count('id', filter=Q(status=status)) for status, key in STATUS_COUNT_KEYS.items()
+    })
+    return {
+        row['employee_id']: {key: row[key] for key in STATUS_COUNT_KEYS.values()}
+        for row in rows
+    }
+
+
+def get_employee_counts(employee, year, month):
+    """عدد أيام كل حالة لموظف واحد في الشهر"""
+    return get_status_counts(year, month, [employee.pk]).get(employee.pk, dict(EMPTY_COUNTS))
+
+
+def build_monthly_summary(employees, year, month, with_days=False):
+    """
+    بيانات الحضور الشهري لقائمة الموظفين بترتيبها
+
+    كل صف: {'employee', 'present_count', 'absent_count', 'excused_count', 'total_days'}
+    ومع with_days يضاف 'days': قائمة [{'day': رقم اليوم، 'attendance': سجل اليوم أو None}] لكل أيام الشهر.
+    """
+    employees = list(employees)
+    employee_ids = [employee.pk for employee in employees]
+    counts = get_status_counts(year, month, employee_ids)
+
+    attendance_dict = {}
+    days_in_month = calendar.monthrange(year, month)[1]
+    if with_days:
+        records = get_month_records(year, month, employee_ids).order_by().only(
+            'id', 'employee_id', 'date', 'status'
+        )
+        for record in records:
+            attendance_dict[(record.employee_id, record.date.day)] = record
+
+    summary = []
+    for employee in employees:
+        row = {'employee': employee}
+        row.update(counts.get(employee.pk, EMPTY_COUNTS))
+        row['total_days'] = row['present_count'] + row['absent_count'] + row['excused_count']
+        if with_days:
+            row['days'] = [
+                {'day': day, 'attendance': attendance_dict.get((employee.pk, day))}
+                for day in range(1, days_in_month + 1)
+            ]
+        summary.append(row)
+
+    return summary
+
+
+# الحقول التي يمكن تسجيلها أو تحديثها لكل سجل حضور
+UPSERT_FIELDS = ('status', 'check_in', 'check_out', 'notes')
+
+UPSERT_BATCH_SIZE = 500
+
+
+def bulk_upsert(entries, batch_size=UPSERT_BATCH_SIZE):
+    """
+    تسجيل أو تحديث سجلات حضور بشكل جماعي
+
+    entries: قائمة قواميس تحتوي employee_id و date وأي من الحقول status و check_in و check_out و notes.
+    الحقل غير الموجود في القاموس يحتفظ بقيمته الحالية (أو القيمة الافتراضية للسجل الجديد)،
+    وإذا تكرر نفس الموظف ونفس التاريخ يتم اعتماد آخر قيمة.
+
+    يرجع: (عدد السجلات الجديدة، عدد السجلات المحدثة)
+    """
+    pending = {}
+    for entry in entries:
+        values = pending.setdefault((entry['employee_id'], entry['date']), {})
+        values.update({field: entry[field] for field in UPSERT_FIELDS if field in entry})
+
+    if not pending:
+        return 0, 0
+
+    employee_ids = {employee_id for employee_id, _ in pending}
+    dates = [record_date for _, record_date in pending]
+
+    with transaction.atomic():
+        # جلب السجلات الموجودة لنفس الموظفين في نطاق التواريخ باستعلام واحد
+        existing = {
+            (record.employee_id, record.date): record
+            for record in Attendance.objects.filter(
+                employee_id__in=employee_ids, date__gte=min(dates), date__lte=max(dates)
+            )
+        }
+
+        to_create = []
+        to_update = []
+        for key, values in pending.items():
+            record = existing.get(key)
+            if record is None:
+                to_create.append(Attendance(employee_id=key[0], date=key[1], **values))
+                continue
+
+            changed = False
+            for field, value in values.items():
+                if getattr(record, field) != value:
+                    setattr(record, field, value)
+                    changed = True
+            if changed:
+                to_update.append(record)
+
+        if to_update:
+            Attendance.objects.bulk_update(to_update, UPSERT_FIELDS, batch_size=batch_size)
+        if to_create:
+            Attendance.objects.bulk_create(to_create, batch_size=batch_size)
+
+    return len(to_create), len(to_update)
+
+
+# أسماء الحالات المقبولة في ملفات الاستيراد (الرمز أو الاسم العربي)
+STATUS_ALIASES = {
+    **{status: status for status, _ in Attendance.STATUS_CHOICES},
+    **{str(label): status for status, label in Attendance.STATUS_CHOICES},
+}
+
+CSV_DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%Y/%m/%d')
+CSV_TIME_FORMATS = ('%H:%M', '%H:%M:%S', '%I:%M %p')
+
+
+def _parse_value(value, formats, convert):
+    for value_format in formats:
+        try:
+            return convert(datetime.strptime(value, value_format))
+        except ValueError:
+            continue
+    raise ValueError(value)
+
+
+def read_csv(csv_file):
+    """
+    قراءة سجلات الحضور من ملف CSV (أو تصدير جهاز البصمة)
+
+    الأعمدة: employee_id أو national_id لتحديد الموظف، و date، ثم الأعمدة الاختيارية
+    status و check_in و check_out و notes. إذا لم يوجد عمود status يعتبر الموظف حاضرًا.
+
+    يرجع: (قائمة السجلات الصالحة لـ bulk_upsert، قائمة رسائل الأخطاء لكل سطر غير صالح)
+    """
+    rows = list(csv.DictReader(csv_file))
+
+    # ربط الرقم القومي بالموظف باستعلام واحد بدلًا من استعلام لكل سطر
+    national_ids = {row['national_id'].strip() for row in rows if (row.get('national_id') or '').strip()}
+    employees_by_national_id = dict(
+        Employee.objects.filter(national_id__in=national_ids).values_list('national_id', 'id')
+    ) if national_ids else {}
+    employee_ids = set(Employee.objects.values_list('id', flat=True))
+
+    entries = []
+    errors = []
+    # السطر الأول هو عناوين الأعمدة
+    for line, row in enumerate(rows, start=2):
+        row = {key: (value or '').strip() for key, value in row.items() if key}
+        try:
+            if row.get('employee_id'):
+                employee_id = int(row['employee_id'])
+            else:
+                employee_id = employees_by_national_id.get(row.get('national_id'))
+            if employee_id not in employee_ids:
+                raise ValueError('الموظف غير موجود')
+
+            entry = {
+                'employee_id': employee_id,
+                'date': _parse_value(row.get('date', ''), CSV_DATE_FORMATS, datetime.date),
+                'status': STATUS_ALIASES[row['status']] if row.get('status') else Attendance.PRESENT,
+            }
+            for field in ('check_in', 'check_out'):
+                if row.get(field):
+                    entry[field] = _parse_value(row[field], CSV_TIME_FORMATS, datetime.time)
+            if row.get('notes'):
+                entry['notes'] = row['notes']
+        except (KeyError, ValueError) as e:
+            errors.append(f'السطر {line}: قيمة غير صالحة ({e})')
+            continue
+
+        entries.append(entry)
+
+    return entries, errors
+
+
+def import_csv(csv_file):
+    """
+    استيراد سجلات الحضور من ملف CSV
+
+    يرجع: (عدد السجلات الجديدة، عدد السجلات المحدثة، قائمة رسائل الأخطاء)
+    """
+    entries, errors = read_csv(csv_file)
+    created, updated = bulk_upsert(entries)
+    return created, updated, errors
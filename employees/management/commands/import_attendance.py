@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from employees import attendance
+
+
+class Command(BaseCommand):
+    help = 'استيراد سجلات الحضور من ملف CSV أو من تصدير جهاز البصمة (يتم تحديث السجلات الموجودة لنفس الموظف والتاريخ)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='مسار ملف CSV')
+        parser.add_argument('--encoding', default='utf-8-sig', help='ترميز الملف')
+        parser.add_argument('--strict', action='store_true',
+                            help='عدم استيراد أي سجل إذا كان في الملف سطر غير صالح')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], newline='', encoding=options['encoding']) as csv_file:
+                entries, errors = attendance.read_csv(csv_file)
+        except (OSError, UnicodeDecodeError) as e:
+            raise CommandError(f'تعذر قراءة الملف: {e}')
+
+        for error in errors:
+            self.stdout.write(self.style.WARNING(error))
+
+        if errors and options['strict']:
+            raise CommandError(f'{len(errors)} سطر غير صالح، لم يتم استيراد أي سجل')
+
+        created, updated = attendance.bulk_upsert(entries)
+        self.stdout.write(self.style.SUCCESS(
+            f'تم استيراد {len(entries)} سجل حضور: {created} جديد و {updated} محدث.'
+        ))
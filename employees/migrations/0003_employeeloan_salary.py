@@ -0,0 +1,39 @@
+# Generated by Django 5.2.1 on 2026-10-18 05:25
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def link_deducted_loans(apps, schema_editor):
+    """
+    ربط السلف المخصومة من الرواتب الموجودة (المسجلة في ملاحظات الراتب LOAN-<id>) برواتبها،
+    والسلف المخصومة من رواتب غير مرحلة تعود غير مسددة
+    """
+    Salary = apps.get_model('employees', 'Salary')
+    EmployeeLoan = apps.get_model('employees', 'EmployeeLoan')
+
+    for salary in Salary.objects.filter(notes__contains='LOAN-').only('id', 'employee_id', 'notes', 'is_posted'):
+        loan_ids = [int(loan_id) for loan_id in re.findall(r'LOAN-(\d+)', salary.notes)]
+        loans = EmployeeLoan.objects.filter(pk__in=loan_ids, employee_id=salary.employee_id, salary__isnull=True)
+        if salary.is_posted:
+            loans.update(salary=salary)
+        else:
+            loans.update(salary=salary, is_paid=False, payment_date=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0002_attendance_date_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employeeloan',
+            name='salary',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='settled_loans', to='employees.salary', verbose_name='الراتب المخصومة منه'),
+        ),
+        migrations.RunPython(link_deducted_loans, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,9 @@
+from decimal import Decimal
+
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
+from finances import ledger
 from finances.models import SafeTransaction
 from core.models import Safe
 
@@ -97,7 +100,11 @@ class Attendance(models.Model):
         verbose_name = _("سجل الحضور")
         verbose_name_plural = _("سجلات الحضور")
         ordering = ['-date']
-        unique_together = ['employee', 'date']  # لا يمكن تكرار سجل لنفس الموظف في نفس اليوم
+        unique_together = ['employee', 'date']  # لا يمكن تكرار سجل لنفس الموظف في نفس اليوم (ويعمل كفهرس للموظف والتاريخ)
+        indexes = [
+            # تقارير الحضور الشهرية لجميع الموظفين تصفي حسب التاريخ فقط
+            models.Index(fields=['date'], name='attendance_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.employee.name} - {self.date} - {self.get_status_display()}"
@@ -114,6 +121,9 @@ class EmployeeLoan(models.Model):
     safe = models.ForeignKey(Safe, on_delete=models.PROTECT, related_name='employee_loans', verbose_name=_("الخزنة"))
     is_posted = models.BooleanField(_("مرحل"), default=False)
     transaction = models.OneToOneField(SafeTransaction, on_delete=models.SET_NULL, null=True, blank=True, related_name='employee_loan', verbose_name=_("حركة الخزنة"))
+    # الراتب الذي تُخصم منه السلفة، وتعتبر مسددة عند ترحيله فقط
+    salary = models.ForeignKey('Salary', on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+                               related_name='settled_loans', verbose_name=_("الراتب المخصومة منه"))
 
     class Meta:
         verbose_name = _("سلفة موظف")
@@ -128,25 +138,27 @@ class EmployeeLoan(models.Model):
         if self.is_posted:
             return False
 
-        # إنشاء حركة خزنة للسلفة
-        current_balance = self.safe.current_balance
-        balance_after = current_balance - self.amount
-
-        transaction = SafeTransaction(
-            safe=self.safe,
-            amount=self.amount,
-            transaction_type=SafeTransaction.WITHDRAWAL,
-            description=f"سلفة للموظف: {self.employee.name}",
-            reference_number=f"LOAN-{self.id}",
-            balance_before=current_balance,
-            balance_after=balance_after
-        )
-        transaction.save()
-
-        # تحديث السلفة
-        self.transaction = transaction
-        self.is_posted = True
-        self.save(update_fields=['transaction', 'is_posted'])
+        # قفل الخزنة وقراءة رصيدها الحالي قبل إنشاء الحركة
+        with ledger.posting(safes=[self.safe]):
+            # إنشاء حركة خزنة للسلفة
+            current_balance = self.safe.current_balance
+            balance_after = current_balance - self.amount
+
+            transaction = SafeTransaction(
+                safe=self.safe,
+                amount=self.amount,
+                transaction_type=SafeTransaction.WITHDRAWAL,
+                description=f"سلفة للموظف: {self.employee.name}",
+                reference_number=f"LOAN-{self.id}",
+                balance_before=current_balance,
+                balance_after=balance_after
+            )
+            transaction.save()
+
+            # تحديث السلفة
+            self.transaction = transaction
+            self.is_posted = True
+            self.save(update_fields=['transaction', 'is_posted'])
 
         return True
 
@@ -191,39 +203,88 @@ class Salary(models.Model):
     def __str__(self):
         return f"{self.employee.name} - {self.month}/{self.year} - {self.net_salary}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # عند تعديل خصم السلف يتم فك ارتباط السلف التي لم تعد مخصومة من الراتب
+        if kwargs.get('update_fields') is None:
+            self.release_loans(self.loans_deduction)
+
+    def delete(self, *args, **kwargs):
+        """حذف الراتب مع إعادة السلف المخصومة منه إلى السلف غير المسددة"""
+        from django.db import transaction
+
+        with transaction.atomic():
+            self.release_loans(0)
+            return super().delete(*args, **kwargs)
+
+    def release_loans(self, kept_amount):
+        """
+        فك ارتباط السلف المخصومة من الراتب (من الأحدث للأقدم) حتى لا يتجاوز مجموع السلف المرتبطة kept_amount،
+        فتعود غير مسددة وتُخصم من راتب لاحق
+        """
+        if self.pk is None:
+            return
+        loans = list(self.settled_loans.order_by('date', 'id').only('id', 'amount'))
+        total = sum((loan.amount for loan in loans), Decimal('0'))
+        released = []
+        while loans and total > kept_amount:
+            loan = loans.pop()
+            total -= loan.amount
+            released.append(loan.pk)
+        if released:
+            EmployeeLoan.objects.filter(pk__in=released).update(salary=None, is_paid=False, payment_date=None)
+
     def calculate_net_salary(self):
         """حساب صافي الراتب"""
         self.net_salary = self.base_salary - self.deductions - self.loans_deduction
         return self.net_salary
 
+    @classmethod
+    def post_many(cls, salaries):
+        """
+        ترحيل مجموعة رواتب دفعة واحدة داخل معاملة واحدة:
+        إنشاء حركات الخزنة لجميع الرواتب بـ bulk_create وإعادة حساب رصيد كل خزنة متأثرة مرة واحدة فقط.
+        الرواتب المرحلة مسبقًا أو التي ليس لها خزنة يتم تجاهلها، ويرجع قائمة الرواتب التي تم ترحيلها.
+        """
+        if isinstance(salaries, models.QuerySet):
+            salaries = salaries.select_related('employee', 'safe')
+        salaries = [salary for salary in salaries if not salary.is_posted and salary.safe_id]
+        if not salaries:
+            return []
+
+        today = timezone.now().date()
+
+        with ledger.posting(safes=[salary.safe for salary in salaries]):
+            # الأرصدة الفعلية يتم حسابها مرة واحدة لكل خزنة (بعد قفلها) عند الخروج من deferred_ledger
+            safe_rows = [
+                SafeTransaction(
+                    safe=salary.safe,
+                    amount=salary.net_salary,
+                    transaction_type=SafeTransaction.WITHDRAWAL,
+                    description=f"راتب الموظف: {salary.employee.name} عن شهر {salary.month}/{salary.year}",
+                    reference_number=f"SALARY-{salary.id}",
+                    balance_before=salary.safe.current_balance,
+                    balance_after=salary.safe.current_balance - salary.net_salary
+                )
+                for salary in salaries
+            ]
+            ledger.bulk_insert(safe_rows=safe_rows)
+
+            for salary, safe_transaction in zip(salaries, safe_rows):
+                salary.transaction = safe_transaction
+                salary.is_posted = True
+                salary.is_paid = True
+                salary.payment_date = today
+            cls.objects.bulk_update(salaries, ['transaction', 'is_posted', 'is_paid', 'payment_date'], batch_size=500)
+
+            # السلف المخصومة من الرواتب تعتبر مسددة عند صرف الرواتب
+            EmployeeLoan.objects.filter(salary__in=salaries).update(is_paid=True, payment_date=today)
+
+        return salaries
+
     def post_salary(self):
         """ترحيل الراتب وإنشاء حركة خزنة"""
-        if self.is_posted or not self.safe:
-            return False
-
-        # إنشاء حركة خزنة للراتب
-        current_balance = self.safe.current_balance
-        balance_after = current_balance - self.net_salary
-
-        transaction = SafeTransaction(
-            safe=self.safe,
-            amount=self.net_salary,
-            transaction_type=SafeTransaction.WITHDRAWAL,
-            description=f"راتب الموظف: {self.employee.name} عن شهر {self.month}/{self.year}",
-            reference_number=f"SALARY-{self.id}",
-            balance_before=current_balance,
-            balance_after=balance_after
-        )
-        transaction.save()
-
-        # تحديث الراتب
-        self.transaction = transaction
-        self.is_posted = True
-        self.is_paid = True
-        self.payment_date = timezone.now().date()
-        self.save(update_fields=['transaction', 'is_posted', 'is_paid', 'payment_date'])
-
-        return True
+        return bool(Salary.post_many([self]))
 
     def unpost_salary(self):
         """إلغاء ترحيل الراتب وحذف حركة الخزنة"""
@@ -238,4 +299,7 @@ class Salary(models.Model):
         self.is_posted = False
         self.save(update_fields=['transaction', 'is_posted'])
 
+        # السلف المخصومة من الراتب تعود غير مسددة حتى يتم ترحيله مرة أخرى
+        self.settled_loans.update(is_paid=False, payment_date=None)
+
         return True
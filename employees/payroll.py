@@ -0,0 +1,110 @@
+"""
+إنشاء رواتب الشهر لجميع الموظفين دفعة واحدة
+
+يتم حساب رواتب جميع الموظفين مع خصم السلف المستحقة باستعلامين (الموظفين والسلف)،
+ثم إدراج الرواتب بـ bulk_create وربط السلف المخصومة برواتبها (EmployeeLoan.salary)،
+وتعتبر السلف مسددة عند ترحيل الراتب فقط. ومع الترحيل يتم إنشاء حركات الخزنة دفعة واحدة
+وإعادة حساب رصيد الخزنة مرة واحدة فقط (Salary.post_many).
+"""
+from decimal import Decimal
+
+from django.db import transaction
+
+from .attendance import get_month_range
+from .models import Employee, EmployeeLoan, Salary
+
+
+def get_outstanding_loans(employee_ids, year, month):
+    """
+    السلف المرحلة غير المسددة وغير المرتبطة براتب حتى نهاية الشهر لكل موظف، مرتبة من الأقدم
+
+    يرجع: {employee_id: [EmployeeLoan, ...]}
+    """
+    _, next_month = get_month_range(year, month)
+    loans = {}
+    for loan in EmployeeLoan.objects.filter(
+        employee_id__in=employee_ids, is_posted=True, is_paid=False, salary__isnull=True, date__lt=next_month
+    ).order_by('date', 'id').only('id', 'employee_id', 'amount', 'date'):
+        loans.setdefault(loan.employee_id, []).append(loan)
+    return loans
+
+
+def build_payroll(year, month, safe=None, employees=None):
+    """
+    حساب رواتب الشهر بدون حفظها (تستخدم للمعاينة وللإنشاء)
+
+    يتم خصم السلف المستحقة كاملة من الأقدم للأحدث طالما يكفي الراتب لخصمها،
+    وتحفظ السلف المخصومة من كل راتب في الخاصية deducted_loans.
+    """
+    if employees is None:
+        employees = Employee.objects.filter(status=Employee.ACTIVE).order_by('id')
+    employees = list(employees)
+    loans = get_outstanding_loans([employee.pk for employee in employees], year, month)
+
+    salaries = []
+    for employee in employees:
+        # لا توجد خصومات ثابتة في بيانات الموظف، ويمكن إضافتها بتعديل الراتب بعد إنشائه
+        deductions = Decimal('0')
+        available = employee.salary - deductions
+
+        deducted_loans = []
+        loans_deduction = Decimal('0')
+        for loan in loans.get(employee.pk, []):
+            if loans_deduction + loan.amount > available:
+                break
+            deducted_loans.append(loan)
+            loans_deduction += loan.amount
+
+        salary = Salary(
+            employee=employee,
+            month=month,
+            year=year,
+            base_salary=employee.salary,
+            deductions=deductions,
+            loans_deduction=loans_deduction,
+            safe=safe
+        )
+        salary.calculate_net_salary()
+        if deducted_loans:
+            salary.notes = 'خصم السلف: ' + '، '.join(f'LOAN-{loan.id}' for loan in deducted_loans)
+        salary.deducted_loans = deducted_loans
+        salaries.append(salary)
+
+    return salaries
+
+
+def get_totals(salaries):
+    """إجماليات الرواتب: الأساسي والخصومات وخصم السلف والصافي"""
+    return {
+        'total_base_salary': sum((salary.base_salary for salary in salaries), Decimal('0')),
+        'total_deductions': sum((salary.deductions for salary in salaries), Decimal('0')),
+        'total_loans_deduction': sum((salary.loans_deduction for salary in salaries), Decimal('0')),
+        'total_net_salary': sum((salary.net_salary for salary in salaries), Decimal('0')),
+    }
+
+
+def run_payroll(year, month, safe, auto_post=False, employees=None):
+    """
+    إنشاء رواتب الشهر وحفظها دفعة واحدة، وربط السلف المخصومة بها، وترحيلها إذا تم طلب ذلك
+    (السلف تعتبر مسددة عند ترحيل الراتب، وتعود غير مسددة عند إلغاء ترحيله أو حذفه)
+
+    يرجع قائمة الرواتب التي تم إنشاؤها.
+    """
+    salaries = build_payroll(year, month, safe, employees)
+    if not salaries:
+        return []
+
+    with transaction.atomic():
+        Salary.objects.bulk_create(salaries, batch_size=500)
+
+        loans = []
+        for salary in salaries:
+            for loan in salary.deducted_loans:
+                loan.salary = salary
+                loans.append(loan)
+        EmployeeLoan.objects.bulk_update(loans, ['salary'], batch_size=500)
+
+        if auto_post:
+            Salary.post_many(salaries)
+
+    return salaries
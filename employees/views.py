@@ -9,7 +9,10 @@ from django.http import HttpResponse
 from datetime import datetime, timedelta
 import calendar
 from .models import Employee, Attendance, EmployeeLoan, Salary
+from . import payroll
+from .attendance import build_monthly_summary, get_employee_counts, bulk_upsert as attendance_bulk_upsert
 from core.models import Safe
+from core.pagination import paginate, get_querystring
 from .forms import EmployeeForm, AttendanceForm, BulkAttendanceForm, EmployeeLoanForm, SalaryForm, SalaryGenerateForm
 
 # صفحات الموظفين
@@ -119,8 +122,27 @@ def employee_delete(request, pk):
 @login_required
 def attendance_list(request):
     """عرض قائمة سجلات الحضور"""
-    attendance_records = Attendance.objects.all().order_by('-date')
-    return render(request, 'employees/attendance/list.html', {'attendance_records': attendance_records})
+    attendance_records = Attendance.objects.all().order_by('-date', '-id')
+
+    # البحث باسم الموظف والتصفية حسب التاريخ
+    query = request.GET.get('q')
+    if query:
+        attendance_records = attendance_records.filter(employee__name__icontains=query)
+
+    date_from = request.GET.get('date_from')
+    if date_from:
+        attendance_records = attendance_records.filter(date__gte=date_from)
+
+    date_to = request.GET.get('date_to')
+    if date_to:
+        attendance_records = attendance_records.filter(date__lte=date_to)
+
+    page = paginate(request, attendance_records.select_related('employee'))
+    return render(request, 'employees/attendance/list.html', {
+        'attendance_records': page,
+        'page_obj': page,
+        'page_querystring': get_querystring(request),
+    })
 
 @login_required
 def attendance_daily(request):
@@ -184,37 +206,8 @@ def attendance_monthly(request):
     # الحصول على جميع الموظفين النشطين مرتبين حسب الـ ID
     active_employees = Employee.objects.filter(status=Employee.ACTIVE).order_by('id')
 
-    # الحصول على سجلات الحضور لهذا الشهر
-    attendance_records = Attendance.objects.filter(
-        date__year=year,
-        date__month=month
-    )
-
-    # إنشاء قاموس لتسهيل الوصول إلى سجلات الحضور
-    attendance_dict = {}
-    for record in attendance_records:
-        key = f"{record.employee_id}_{record.date.day}"
-        attendance_dict[key] = record
-
-    # إنشاء بيانات الجدول
-    employees_data = []
-    for employee in active_employees:
-        days_data = []
-        for day in range(1, days_in_month + 1):
-            key = f"{employee.id}_{day}"
-            attendance = attendance_dict.get(key)
-            days_data.append({
-                'day': day,
-                'attendance': attendance
-            })
-
-        employees_data.append({
-            'employee': employee,
-            'days': days_data,
-            'present_count': attendance_records.filter(employee=employee, status=Attendance.PRESENT).count(),
-            'absent_count': attendance_records.filter(employee=employee, status=Attendance.ABSENT).count(),
-            'excused_count': attendance_records.filter(employee=employee, status=Attendance.EXCUSED).count(),
-        })
+    # بيانات الجدول: أيام الشهر وإجماليات كل حالة لكل موظف
+    employees_data = build_monthly_summary(active_employees, year, month, with_days=True)
 
     context = {
         'year': year,
@@ -317,34 +310,19 @@ def attendance_bulk_add(request):
         if form.is_valid():
             date = form.cleaned_data['date']
 
-            # حفظ سجلات الحضور لكل موظف
-            for employee in active_employees:
-                status_field = f'status_{employee.id}'
-                check_in_field = f'check_in_{employee.id}'
-                check_out_field = f'check_out_{employee.id}'
-
-                if status_field in form.cleaned_data:
-                    status = form.cleaned_data[status_field]
-                    check_in = form.cleaned_data.get(check_in_field)
-                    check_out = form.cleaned_data.get(check_out_field)
-
-                    # التحقق من وجود سجل حضور سابق لهذا الموظف في هذا التاريخ
-                    try:
-                        attendance = Attendance.objects.get(employee=employee, date=date)
-                        # تحديث السجل الموجود
-                        attendance.status = status
-                        attendance.check_in = check_in
-                        attendance.check_out = check_out
-                        attendance.save()
-                    except Attendance.DoesNotExist:
-                        # إنشاء سجل جديد
-                        Attendance.objects.create(
-                            employee=employee,
-                            date=date,
-                            status=status,
-                            check_in=check_in,
-                            check_out=check_out
-                        )
+            # حفظ سجلات الحضور لكل الموظفين دفعة واحدة
+            entries = [
+                {
+                    'employee_id': employee.id,
+                    'date': date,
+                    'status': form.cleaned_data[f'status_{employee.id}'],
+                    'check_in': form.cleaned_data.get(f'check_in_{employee.id}'),
+                    'check_out': form.cleaned_data.get(f'check_out_{employee.id}'),
+                }
+                for employee in active_employees
+                if f'status_{employee.id}' in form.cleaned_data
+            ]
+            attendance_bulk_upsert(entries)
 
             messages.success(request, f'تم تسجيل الحضور الجماعي بنجاح ليوم {date.strftime("%Y-%m-%d")}')
             return redirect(f"{reverse('employees:attendance_daily')}?date={date.strftime('%Y-%m-%d')}")
@@ -726,7 +704,7 @@ def salary_generate_monthly(request):
     if request.method == 'POST':
         form = SalaryGenerateForm(request.POST)
         if form.is_valid():
-            month = form.cleaned_data['month']
+            month = int(form.cleaned_data['month'])
             year = form.cleaned_data['year']
             safe = form.cleaned_data['safe']
             auto_post = form.cleaned_data['auto_post']
@@ -737,41 +715,12 @@ def salary_generate_monthly(request):
                 messages.warning(request, _('يوجد رواتب بالفعل لهذا الشهر. يمكنك تعديلها من قائمة الرواتب.'))
                 return redirect('employees:salary_list')
 
-            # الحصول على جميع الموظفين النشطين
-            active_employees = Employee.objects.filter(status=Employee.ACTIVE)
-
-            # إنشاء رواتب لجميع الموظفين
-            created_salaries = []
-            for employee in active_employees:
-                # حساب خصم السلف
-                loans_deduction = 0  # يمكن تنفيذ حساب خصم السلف لاحقًا
-
-                # حساب صافي الراتب
-                net_salary = employee.salary - employee.deductions - loans_deduction
-
-                # إنشاء الراتب
-                salary = Salary(
-                    employee=employee,
-                    month=month,
-                    year=year,
-                    base_salary=employee.salary,
-                    deductions=employee.deductions,
-                    loans_deduction=loans_deduction,
-                    net_salary=net_salary,
-                    safe=safe
-                )
-
-                # حفظ الراتب
-                salary.save()
-                created_salaries.append(salary)
-
-                # ترحيل الراتب إذا تم اختيار ذلك
-                if auto_post:
-                    try:
-                        with transaction.atomic():
-                            salary.post_salary()
-                    except Exception as e:
-                        messages.error(request, f'{_("حدث خطأ أثناء ترحيل راتب الموظف")}: {employee.name} - {str(e)}')
+            # إنشاء رواتب جميع الموظفين النشطين مع خصم السلف وترحيلها دفعة واحدة
+            try:
+                created_salaries = payroll.run_payroll(year, month, safe, auto_post=auto_post)
+            except Exception as e:
+                messages.error(request, f'{_("حدث خطأ أثناء إنشاء الرواتب")}: {str(e)}')
+                return redirect('employees:salary_generate_monthly')
 
             messages.success(request, f'تم إنشاء {len(created_salaries)} راتب بنجاح')
             return redirect('employees:salary_list')
@@ -784,27 +733,22 @@ def salary_generate_monthly(request):
         })
 
         # إنشاء معاينة للرواتب
-        active_employees = Employee.objects.filter(status=Employee.ACTIVE)
-        for employee in active_employees:
-            # حساب خصم السلف
-            loans_deduction = 0  # يمكن تنفيذ حساب خصم السلف لاحقًا
-
-            # حساب صافي الراتب
-            net_salary = employee.salary - employee.deductions - loans_deduction
-
-            preview_data.append({
-                'employee': employee,
-                'base_salary': employee.salary,
-                'deductions': employee.deductions,
-                'loans_deduction': loans_deduction,
-                'net_salary': net_salary
-            })
-
-            # حساب الإجماليات
-            total_base_salary += employee.salary
-            total_deductions += employee.deductions
-            total_loans_deduction += loans_deduction
-            total_net_salary += net_salary
+        preview = payroll.build_payroll(today.year, today.month)
+        preview_data = [
+            {
+                'employee': salary.employee,
+                'base_salary': salary.base_salary,
+                'deductions': salary.deductions,
+                'loans_deduction': salary.loans_deduction,
+                'net_salary': salary.net_salary
+            }
+            for salary in preview
+        ]
+        totals = payroll.get_totals(preview)
+        total_base_salary = totals['total_base_salary']
+        total_deductions = totals['total_deductions']
+        total_loans_deduction = totals['total_loans_deduction']
+        total_net_salary = totals['total_net_salary']
 
     return render(request, 'employees/salary/generate_monthly.html', {
         'form': form,
@@ -881,20 +825,13 @@ def report_attendance_monthly(request):
     # الحصول على جميع الموظفين النشطين مرتبين حسب الـ ID
     active_employees = Employee.objects.filter(status=Employee.ACTIVE).order_by('id')
 
-    # إنشاء بيانات التقرير
-    report_data = []
-    for employee in active_employees:
-        present_count = employee.get_attendance_count(year, month)
-        absent_count = employee.get_absence_count(year, month)
-        excused_count = employee.get_excused_absence_count(year, month)
+    # التحقق مما إذا كان المستخدم يريد استخدام قالب الطباعة المخصص
+    print_mode = request.GET.get('print', False)
+    # التحقق مما إذا كان المستخدم يريد التقرير التفصيلي أو الملخص
+    detailed = print_mode and request.GET.get('detailed', False)
 
-        report_data.append({
-            'employee': employee,
-            'present_count': present_count,
-            'absent_count': absent_count,
-            'excused_count': excused_count,
-            'total_days': present_count + absent_count + excused_count
-        })
+    # إنشاء بيانات التقرير (مع جدول الأيام للتقرير التفصيلي)
+    report_data = build_monthly_summary(active_employees, year, month, with_days=bool(detailed))
 
     context = {
         'year': year,
@@ -904,53 +841,17 @@ def report_attendance_monthly(request):
         'now': timezone.now(),
     }
 
-    # التحقق مما إذا كان المستخدم يريد استخدام قالب الطباعة المخصص
-    print_mode = request.GET.get('print', False)
     if print_mode:
-        # التحقق مما إذا كان المستخدم يريد التقرير التفصيلي أو الملخص
-        detailed = request.GET.get('detailed', False)
         if detailed:
             # الحصول على عدد أيام الشهر
             _, days_in_month = calendar.monthrange(year, month)
 
-            # الحصول على سجلات الحضور لهذا الشهر
-            attendance_records = Attendance.objects.filter(
-                date__year=year,
-                date__month=month
-            )
-
-            # إنشاء قاموس لتسهيل الوصول إلى سجلات الحضور
-            attendance_dict = {}
-            for record in attendance_records:
-                key = f"{record.employee_id}_{record.date.day}"
-                attendance_dict[key] = record
-
-            # إنشاء بيانات الجدول
-            employees_data = []
-            for employee in active_employees:
-                days_data = []
-                for day in range(1, days_in_month + 1):
-                    key = f"{employee.id}_{day}"
-                    attendance = attendance_dict.get(key)
-                    days_data.append({
-                        'day': day,
-                        'attendance': attendance
-                    })
-
-                employees_data.append({
-                    'employee': employee,
-                    'days': days_data,
-                    'present_count': attendance_records.filter(employee=employee, status=Attendance.PRESENT).count(),
-                    'absent_count': attendance_records.filter(employee=employee, status=Attendance.ABSENT).count(),
-                    'excused_count': attendance_records.filter(employee=employee, status=Attendance.EXCUSED).count(),
-                })
-
             detailed_context = {
                 'year': year,
                 'month': month,
                 'month_name': calendar.month_name[month],
                 'days_in_month': days_in_month,
-                'employees_data': employees_data,
+                'employees_data': report_data,
                 'now': timezone.now(),
             }
 
@@ -985,11 +886,10 @@ def report_employee_attendance(request, pk):
         'month': month,
         'month_name': calendar.month_name[month],
         'attendance_records': attendance_records,
-        'present_count': employee.get_attendance_count(year, month),
-        'absent_count': employee.get_absence_count(year, month),
-        'excused_count': employee.get_excused_absence_count(year, month),
         'now': timezone.now(),
     }
+    # عدد أيام كل حالة باستعلام واحد
+    context.update(get_employee_counts(employee, year, month))
 
     # التحقق مما إذا كان المستخدم يريد استخدام قالب الطباعة المخصص
     print_mode = request.GET.get('print', False)
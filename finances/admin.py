@@ -9,6 +9,7 @@ from .models import (
     ExpenseCategory, IncomeCategory, Expense, Income, SafeDeposit, SafeWithdrawal,
     StorePermit, StorePermitItem
 )
+from .ledger import deferred_ledger
 
 @admin.register(SafeTransaction)
 class SafeTransactionAdmin(admin.ModelAdmin):
@@ -230,9 +231,11 @@ class ExpenseAdmin(admin.ModelAdmin):
     def post_multiple_expenses(self, request, queryset):
         """ترحيل مصروفات متعددة من خلال القائمة"""
         posted_count = 0
-        for expense in queryset:
-            if expense.post_expense():
-                posted_count += 1
+        # إعادة حساب أرصدة كل خزنة مرة واحدة بعد معالجة جميع المستندات
+        with deferred_ledger():
+            for expense in queryset:
+                if expense.post_expense():
+                    posted_count += 1
 
         if posted_count:
             messages.success(request, f'تم ترحيل {posted_count} مصروف بنجاح.')
@@ -244,9 +247,11 @@ class ExpenseAdmin(admin.ModelAdmin):
     def unpost_multiple_expenses(self, request, queryset):
         """إلغاء ترحيل مصروفات متعددة من خلال القائمة"""
         unposted_count = 0
-        for expense in queryset:
-            if expense.unpost_expense():
-                unposted_count += 1
+        # إعادة حساب أرصدة كل خزنة مرة واحدة بعد معالجة جميع المستندات
+        with deferred_ledger():
+            for expense in queryset:
+                if expense.unpost_expense():
+                    unposted_count += 1
 
         if unposted_count:
             messages.success(request, f'تم إلغاء ترحيل {unposted_count} مصروف بنجاح.')
@@ -330,9 +335,11 @@ class IncomeAdmin(admin.ModelAdmin):
     def post_multiple_incomes(self, request, queryset):
         """ترحيل إيرادات متعددة من خلال القائمة"""
         posted_count = 0
-        for income in queryset:
-            if income.post_income():
-                posted_count += 1
+        # إعادة حساب أرصدة كل خزنة مرة واحدة بعد معالجة جميع المستندات
+        with deferred_ledger():
+            for income in queryset:
+                if income.post_income():
+                    posted_count += 1
 
         if posted_count:
             messages.success(request, f'تم ترحيل {posted_count} إيراد بنجاح.')
@@ -344,9 +351,11 @@ class IncomeAdmin(admin.ModelAdmin):
     def unpost_multiple_incomes(self, request, queryset):
         """إلغاء ترحيل إيرادات متعددة من خلال القائمة"""
         unposted_count = 0
-        for income in queryset:
-            if income.unpost_income():
-                unposted_count += 1
+        # إعادة حساب أرصدة كل خزنة مرة واحدة بعد معالجة جميع المستندات
+        with deferred_ledger():
+            for income in queryset:
+                if income.unpost_income():
+                    unposted_count += 1
 
         if unposted_count:
             messages.success(request, f'تم إلغاء ترحيل {unposted_count} إيراد بنجاح.')
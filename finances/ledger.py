@@ -0,0 +1,217 @@
+"""
+تأجيل إعادة حساب أرصدة الخزن وجهات الاتصال والمنتجات أثناء عمليات الترحيل الجماعية
+
+داخل deferred_ledger لا تعيد نماذج الحركات حساب الأرصدة مع كل حفظ أو حذف، بل تسجل
+الحسابات المتأثرة فقط (مع أقدم موضع متأثر لكل حساب)، وعند الخروج يعاد حساب كل حساب مرة واحدة.
+
+عمليات الترحيل تستخدم posting لقفل صفوف الحسابات التي ستؤثر عليها (select_for_update) قبل قراءة
+أرصدتها، بترتيب ثابت (الخزن ثم جهات الاتصال ثم المنتجات، وكل منها حسب المعرف) حتى لا يحدث
+deadlock بين عمليتين، فيمكن لأكثر من عامل (worker) الترحيل في نفس الوقت بدون أرصدة متضاربة.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+
+from core import instrumentation
+
+SAFE = 'safe'
+CONTACT = 'contact'
+PRODUCT = 'product'
+
+_state = threading.local()
+
+
+def _get_pending():
+    return getattr(_state, 'pending', None)
+
+
+def is_deferred():
+    """هل إعادة حساب الأرصدة مؤجلة حاليًا"""
+    return _get_pending() is not None
+
+
+def defer_recalculation(kind, account, from_date=None, from_id=None):
+    """
+    تسجيل حساب متأثر بدلًا من إعادة حساب أرصدته فورًا.
+    تعيد False إذا لم يكن التأجيل مفعلًا ليقوم المستدعي بإعادة الحساب بنفسه.
+    بدون from_date تتم إعادة حساب الحساب بالكامل عند الخروج.
+    """
+    pending = _get_pending()
+    if pending is None:
+        return False
+
+    key = (kind, account.pk)
+    position = (from_date, from_id or 0) if from_date is not None else None
+
+    # الاحتفاظ بأقدم موضع متأثر للحساب
+    if key in pending:
+        recorded_account, recorded_position = pending[key]
+        if recorded_position is None or position is None:
+            position = None
+        else:
+            position = min(position, recorded_position)
+        account = recorded_account
+
+    pending[key] = (account, position)
+    return True
+
+
+def _recalculate(pending, locked=frozenset()):
+    """
+    إعادة حساب كل حساب متأثر مرة واحدة، بعد قفل الحسابات بالترتيب الثابت
+    (إذا لم يتم قفلها من قبل بـ posting) حتى تشمل إعادة الحساب حركات العمليات الأخرى
+    """
+    from .models import SafeTransaction, ContactTransaction, ProductTransaction
+
+    ordered = sorted(pending.items(), key=lambda entry: (LOCK_ORDER.index(entry[0][0]), entry[0][1]))
+    accounts = {kind: [] for kind in LOCK_ORDER}
+    for (kind, pk), (account, position) in ordered:
+        if (kind, pk) not in locked:
+            accounts[kind].append(account)
+    lock_accounts(accounts[SAFE], accounts[CONTACT], accounts[PRODUCT])
+
+    for (kind, _), (account, position) in ordered:
+        if kind == PRODUCT:
+            # أرصدة المنتج يعاد حسابها بالكامل، والموضع يحدد أرصدة الإقفال المتأثرة فقط
+            ProductTransaction.recalculate_balances(account, from_date=position[0] if position else None)
+            continue
+
+        recalculate = SafeTransaction.recalculate_balances if kind == SAFE else ContactTransaction.recalculate_balances
+        if position is None:
+            recalculate(account)
+        else:
+            recalculate(account, from_date=position[0], from_id=position[1])
+
+
+# ترتيب قفل الحسابات، وهو نفس الترتيب في كل العمليات حتى لا تنتظر عمليتان بعضهما (deadlock)
+LOCK_ORDER = (SAFE, CONTACT, PRODUCT)
+
+
+def _get_account_model(kind):
+    from core.models import Safe, Contact
+    from products.models import Product
+
+    return {SAFE: Safe, CONTACT: Contact, PRODUCT: Product}[kind]
+
+
+def lock_accounts(safes=(), contacts=(), products=()):
+    """
+    قفل صفوف الخزن وجهات الاتصال والمنتجات المتأثرة بالترحيل (select_for_update) حتى نهاية المعاملة،
+    وتحديث الرصيد الحالي في الكائنات الممررة من الصفوف المقفلة بدلًا من القيم المحملة قبل القفل.
+
+    يتم القفل دائمًا بنفس الترتيب (الخزن ثم جهات الاتصال ثم المنتجات، وكل منها حسب المعرف)،
+    فتنتظر العمليات التي ترحل على نفس الحسابات بعضها بدون تعارض، وتعمل العمليات على حسابات مختلفة
+    بالتوازي. يجب استدعاؤها داخل معاملة.
+    """
+    for kind, accounts in zip(LOCK_ORDER, (safes, contacts, products)):
+        instances = {}
+        for account in accounts:
+            if account is not None:
+                instances.setdefault(account.pk, []).append(account)
+        if not instances:
+            continue
+
+        balances = _get_account_model(kind).objects.select_for_update().filter(
+            pk__in=instances
+        ).order_by('pk').values_list('pk', 'current_balance')
+        for pk, balance in balances:
+            for account in instances[pk]:
+                account.current_balance = balance
+
+        locked = getattr(_state, 'locked', None)
+        if locked is not None:
+            locked.update((kind, pk) for pk in instances)
+
+        instrumentation.count('accounts_locked', len(instances))
+
+
+@contextmanager
+def posting(safes=(), contacts=(), products=()):
+    """
+    ترحيل مستند على حسابات محددة: قفل الحسابات أولًا ثم تنفيذ الترحيل داخل deferred_ledger،
+    فيتم حساب الأرصدة من الأرصدة المقفلة، ولا تضيع حركات عملية أخرى ترحل على نفس الحسابات.
+    للترحيل الجماعي يتم تمرير حسابات كل المستندات مرة واحدة.
+    """
+    with deferred_ledger():
+        lock_accounts(safes, contacts, products)
+        yield
+
+
+@contextmanager
+def deferred_ledger():
+    """
+    تنفيذ مجموعة عمليات ترحيل داخل معاملة واحدة مع إعادة حساب أرصدة كل حساب متأثر مرة واحدة في النهاية.
+    يمكن استخدامه كـ with أو كمزخرف، والاستدعاء المتداخل يندمج مع الاستدعاء الخارجي.
+    """
+    if is_deferred():
+        yield
+        return
+
+    _state.pending = {}
+    _state.locked = set()
+    try:
+        with transaction.atomic():
+            yield
+            pending, locked = _state.pending, _state.locked
+            _state.pending = _state.locked = None
+            _recalculate(pending, locked)
+    finally:
+        _state.pending = _state.locked = None
+
+
+def bulk_insert(contact_rows=(), safe_rows=(), product_rows=()):
+    """
+    إدراج حركات جاهزة في الذاكرة باستعلامات bulk_create بدلًا من حفظ كل حركة على حدة.
+    يتم تطبيق فرق أرصدة المخازن مرة واحدة لكل (منتج، مخزن)، وتسجيل أقدم تاريخ متأثر لكل حساب
+    لإعادة حساب أرصدته مرة واحدة عند الخروج من deferred_ledger.
+    """
+    from .models import SafeTransaction, ContactTransaction, ProductTransaction, StockBalance
+
+    with deferred_ledger():
+        # ما تقوم به دوال save للحركات قبل الحفظ
+        for row in [*safe_rows, *contact_rows, *product_rows]:
+            if row.invoice_id and not row.transaction_type:
+                row.set_transaction_type_from_invoice()
+        for row in product_rows:
+            row.base_quantity = row.quantity * row.product_unit.conversion_factor
+
+        instrumentation.count('ledger_rows_inserted', len(safe_rows) + len(contact_rows) + len(product_rows))
+        SafeTransaction.objects.bulk_create(safe_rows, batch_size=SafeTransaction.BULK_BATCH_SIZE)
+        ContactTransaction.objects.bulk_create(contact_rows, batch_size=ContactTransaction.BULK_BATCH_SIZE)
+        ProductTransaction.objects.bulk_create(product_rows, batch_size=ProductTransaction.BULK_BATCH_SIZE)
+
+        for row in safe_rows:
+            defer_recalculation(SAFE, row.safe, row.date)
+        for row in contact_rows:
+            defer_recalculation(CONTACT, row.contact, row.date)
+
+        # تجميع أثر حركات المنتجات لكل (منتج، مخزن) قبل تحديث جدول أرصدة المخازن
+        stock_deltas = {}
+        for row in product_rows:
+            defer_recalculation(PRODUCT, row.product, row.date)
+            key = (row.product_id, row.store_id)
+            stock_deltas[key] = stock_deltas.get(key, 0) + row.get_balance_effect()
+        for (product_id, store_id), delta in stock_deltas.items():
+            StockBalance.apply_movement(product_id, store_id, delta)
+
+
+def bulk_delete(*querysets):
+    """
+    حذف حركات بالجملة مع تسجيل أقدم تاريخ متأثر لكل حساب لإعادة حساب أرصدته مرة واحدة
+    (أرصدة المخازن يتم عكسها من خلال إشارة post_delete لحركات المنتجات)
+    """
+    from .models import SafeTransaction, ContactTransaction, ProductTransaction
+
+    accounts = {
+        SafeTransaction: (SAFE, 'safe'),
+        ContactTransaction: (CONTACT, 'contact'),
+        ProductTransaction: (PRODUCT, 'product'),
+    }
+
+    with deferred_ledger():
+        for queryset in querysets:
+            kind, field = accounts[queryset.model]
+            for row in queryset.select_related(field):
+                defer_recalculation(kind, getattr(row, field), row.date)
+            queryset.delete()
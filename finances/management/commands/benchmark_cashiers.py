@@ -0,0 +1,161 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections, transaction
+
+from core import sqlite
+from core.models import Company, Branch, Store, Safe, Contact
+from finances.models import SafeTransaction, ContactTransaction, ProductTransaction, BalanceCheckpoint
+from finances import ledger
+from invoices.models import Invoice, InvoiceItem
+from products.models import Unit, Product, ProductUnit
+
+
+class Command(BaseCommand):
+    help = ('قياس ترحيل الفواتير من عدة كاشير في نفس الوقت على نفس الخزنة والمنتجات '
+            '(لمقارنة ملفات إعدادات SQLite، ويتم حذف جميع بيانات القياس في النهاية)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cashiers', type=int, default=4, help='عدد الكاشير (عمليات متزامنة)')
+        parser.add_argument('--invoices', type=int, default=25, help='عدد الفواتير لكل كاشير')
+        parser.add_argument('--items', type=int, default=3, help='عدد البنود في كل فاتورة')
+        parser.add_argument('--keep', action='store_true', help='عدم حذف بيانات القياس')
+
+    def create_accounts(self, items_count):
+        """الخزنة والمخزن والعميل والمنتجات المشتركة بين جميع الكاشير"""
+        with transaction.atomic():
+            company = Company.objects.create(name='benchmark')
+            branch = Branch.objects.create(company=company, name='benchmark')
+            store = Store.objects.create(branch=branch, name='benchmark')
+            safe = Safe.objects.create(branch=branch, name='benchmark', initial_balance=0, current_balance=0)
+            contact = Contact.objects.create(name='benchmark', contact_type=Contact.CUSTOMER)
+            unit = Unit.objects.create(name='benchmark', symbol='b')
+            product_units = []
+            for i in range(items_count):
+                product = Product.objects.create(name=f'benchmark {i + 1}', initial_balance=0, current_balance=0)
+                product_units.append(ProductUnit.objects.create(
+                    product=product, unit=unit, conversion_factor=1, selling_price=10, is_default_sale=True
+                ))
+        return company, store, safe, contact, unit, product_units
+
+    def post_invoice(self, number, store, safe, contact, product_units):
+        """إنشاء فاتورة بيع نقدية وترحيلها داخل معاملة واحدة (كما في شاشة إنشاء الفاتورة)"""
+        with transaction.atomic():
+            invoice = Invoice.objects.create(
+                number=number, invoice_type=Invoice.SALE, payment_type=Invoice.CASH,
+                contact=contact, store=store, safe=safe, is_posted=False,
+            )
+            for product_unit in product_units:
+                InvoiceItem.objects.create(
+                    invoice=invoice, product_id=product_unit.product_id, product_unit=product_unit,
+                    quantity=1, unit_price=product_unit.selling_price, net_price=product_unit.selling_price,
+                )
+            invoice.calculate_totals()
+            invoice.save()
+            Invoice.post_many([invoice])
+
+    def run_cashier(self, cashier, options, accounts, barrier, latencies, errors):
+        _, store, safe, contact, _, product_units = accounts
+        try:
+            barrier.wait()
+            for i in range(options['invoices']):
+                started = time.perf_counter()
+                try:
+                    self.post_invoice(f'BENCH-{cashier}-{i + 1}', store, safe, contact, product_units)
+                except OperationalError as error:
+                    errors.append(str(error))
+                else:
+                    latencies.append(time.perf_counter() - started)
+        finally:
+            connections.close_all()
+
+    def check_balances(self, safe, contact, product_units, posted):
+        """
+        مقارنة الأرصدة المسجلة بعد الترحيل المتزامن بالأرصدة المحسوبة من الحركات،
+        وبالقيم المتوقعة من عدد الفواتير المرحلة للخزنة والمنتجات
+        """
+        expected_amount = posted * sum(product_unit.selling_price for product_unit in product_units)
+        results = []
+
+        safe.refresh_from_db()
+        stored = safe.current_balance
+        results.append(('الخزنة', stored, SafeTransaction.recalculate_balances(safe), expected_amount))
+
+        contact.refresh_from_db()
+        stored = contact.current_balance
+        results.append(('العميل', stored, ContactTransaction.recalculate_balances(contact), None))
+
+        for product_unit in product_units:
+            product = Product.objects.get(pk=product_unit.product_id)
+            stored = product.current_balance
+            results.append((product.name, stored, ProductTransaction.recalculate_balances(product), Decimal(-posted)))
+        return results
+
+    def delete_accounts(self, accounts):
+        """حذف بيانات القياس (الحركات والفواتير يتم حذفها مع الحسابات)"""
+        company, _, safe, contact, unit, product_units = accounts
+        product_ids = [product_unit.product_id for product_unit in product_units]
+        with transaction.atomic():
+            BalanceCheckpoint.objects.filter(kind=ledger.SAFE, account_id=safe.pk).delete()
+            BalanceCheckpoint.objects.filter(kind=ledger.CONTACT, account_id=contact.pk).delete()
+            BalanceCheckpoint.objects.filter(kind=ledger.PRODUCT, account_id__in=product_ids).delete()
+            Product.objects.filter(pk__in=product_ids).delete()
+            company.delete()
+            contact.delete()
+            unit.delete()
+
+    def handle(self, *args, **options):
+        cashiers = options['cashiers']
+
+        self.stdout.write(f"قاعدة البيانات: {connection.vendor} - ملف الإعدادات: {getattr(settings, 'SQLITE_PROFILE', 'default')}")
+        if connection.vendor == 'sqlite':
+            self.stdout.write(f'إعدادات الاتصال: {sqlite.get_current_pragmas(connection)}')
+
+        accounts = self.create_accounts(options['items'])
+        _, _, safe, contact, _, product_units = accounts
+        latencies, errors = [], []
+        barrier = threading.Barrier(cashiers)
+
+        try:
+            threads = [
+                threading.Thread(target=self.run_cashier, args=(cashier + 1, options, accounts, barrier, latencies, errors))
+                for cashier in range(cashiers)
+            ]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+            latencies.sort()
+            posted = len(latencies)
+            self.stdout.write(
+                f'الكاشير: {cashiers} - الفواتير المرحلة: {posted} - الفاشلة: {len(errors)} '
+                f'- الزمن: {elapsed:.2f} ثانية - المعدل: {posted / elapsed:.1f} فاتورة/ثانية'
+            )
+            if latencies:
+                self.stdout.write(
+                    f'زمن الفاتورة (مللي ثانية): الوسيط {latencies[posted // 2] * 1000:.1f} '
+                    f'- 95% {latencies[min(posted - 1, int(posted * 0.95))] * 1000:.1f} - الأقصى {latencies[-1] * 1000:.1f}'
+                )
+            if errors:
+                self.stdout.write(self.style.WARNING(f'أول خطأ: {errors[0]}'))
+
+            mismatches = 0
+            for name, stored, actual, expected in self.check_balances(safe, contact, product_units, posted):
+                if stored != actual or (expected is not None and actual != expected):
+                    mismatches += 1
+                    self.stdout.write(self.style.ERROR(
+                        f'{name}: الرصيد المسجل {stored} - المحسوب من الحركات {actual} - المتوقع {expected}'
+                    ))
+            if mismatches:
+                self.stdout.write(self.style.ERROR(f'يوجد فرق في رصيد {mismatches} حساب بعد الترحيل المتزامن.'))
+            else:
+                self.stdout.write(self.style.SUCCESS('جميع الأرصدة مطابقة للحركات بعد الترحيل المتزامن.'))
+        finally:
+            if not options['keep']:
+                self.delete_accounts(accounts)
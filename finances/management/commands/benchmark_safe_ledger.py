@@ -0,0 +1,90 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core.models import Company, Branch, Safe
+from finances.models import SafeTransaction
+
+
+class Command(BaseCommand):
+    help = 'قياس تكلفة ترحيل حركة خزنة جديدة مع نمو عدد حركات الخزنة (يتم التراجع عن جميع البيانات في النهاية)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help='أحجام سجل الخزنة التي يتم القياس عندها')
+        parser.add_argument('--samples', type=int, default=20,
+                            help='عدد الحركات التي يتم ترحيلها عند كل حجم')
+
+    def handle(self, *args, **options):
+        sizes = sorted(options['sizes'])
+        samples = options['samples']
+        results = []
+
+        with transaction.atomic():
+            company = Company.objects.create(name='benchmark')
+            branch = Branch.objects.create(company=company, name='benchmark')
+            safe = Safe.objects.create(branch=branch, name='benchmark', initial_balance=0, current_balance=0)
+
+            start_date = timezone.now() - timedelta(days=365)
+            balance = Decimal('0')
+            rows = 0
+
+            for size in sizes:
+                # تعبئة سجل الخزنة حتى الحجم المطلوب بأرصدة صحيحة
+                batch = []
+                while rows < size:
+                    rows += 1
+                    balance_before = balance
+                    balance += Decimal('10')
+                    batch.append(SafeTransaction(
+                        safe=safe,
+                        date=start_date + timedelta(seconds=rows),
+                        amount=Decimal('10'),
+                        transaction_type=SafeTransaction.DEPOSIT,
+                        balance_before=balance_before,
+                        balance_after=balance,
+                    ))
+                SafeTransaction.objects.bulk_create(batch, batch_size=SafeTransaction.BULK_BATCH_SIZE)
+                safe.current_balance = balance
+                safe.save(update_fields=['current_balance'])
+
+                # ترحيل حركات جديدة في نهاية السجل وقياس الزمن وعدد الاستعلامات
+                elapsed = 0
+                with CaptureQueriesContext(connection) as queries:
+                    for i in range(samples):
+                        balance_before = safe.current_balance
+                        posted = SafeTransaction(
+                            safe=safe,
+                            date=timezone.now(),
+                            amount=Decimal('1'),
+                            transaction_type=SafeTransaction.INCOME,
+                            balance_before=balance_before,
+                            balance_after=balance_before + Decimal('1'),
+                        )
+                        started = time.perf_counter()
+                        posted.save()
+                        elapsed += time.perf_counter() - started
+                rows += samples
+                balance = safe.current_balance
+
+                average_ms = elapsed * 1000 / samples
+                average_queries = len(queries) / samples
+                results.append((size, average_ms, average_queries))
+                self.stdout.write(
+                    f'حجم السجل: {size} - متوسط زمن الترحيل: {average_ms:.2f} مللي ثانية '
+                    f'- متوسط عدد الاستعلامات: {average_queries:.1f}'
+                )
+
+            # التراجع عن جميع بيانات القياس
+            transaction.set_rollback(True)
+
+        if len(results) > 1:
+            ratio = results[-1][1] / results[0][1] if results[0][1] else 0
+            self.stdout.write(self.style.SUCCESS(
+                f'نسبة زمن الترحيل بين أكبر وأصغر حجم ({results[-1][0]} / {results[0][0]}): {ratio:.2f}'
+            ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from finances import ledger
+from finances.models import BalanceCheckpoint
+
+
+class Command(BaseCommand):
+    help = 'إعادة بناء أرصدة الإقفال الدورية للخزن وجهات الاتصال والمنتجات من أرصدة الحركات'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=[ledger.SAFE, ledger.CONTACT, ledger.PRODUCT],
+                            help='إعادة بناء أرصدة نوع واحد من الحسابات فقط')
+
+    def handle(self, *args, **options):
+        accounts = BalanceCheckpoint.rebuild(options['kind'])
+        self.stdout.write(self.style.SUCCESS(
+            f'تم إعادة بناء {BalanceCheckpoint.objects.count()} رصيد إقفال '
+            f'({BalanceCheckpoint.get_period()}) لعدد {accounts} حساب.'
+        ))
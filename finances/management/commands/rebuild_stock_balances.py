@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from finances.models import StockBalance
+
+
+class Command(BaseCommand):
+    help = 'إعادة بناء أرصدة المنتجات في المخازن من حركات المنتجات'
+
+    def handle(self, *args, **options):
+        StockBalance.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'تم إعادة بناء {StockBalance.objects.count()} رصيد مخزن.'))
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 04:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_systemsettings_show_driver_in_permit_report_and_more'),
+        ('finances', '0014_alter_storepermit_options_and_more'),
+        ('invoices', '0005_alter_invoice_date_alter_payment_date'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='safetransaction',
+            index=models.Index(fields=['safe', 'date', 'id'], name='safetrans_safe_date_idx'),
+        ),
+    ]
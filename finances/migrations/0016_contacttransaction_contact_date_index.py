@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 04:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_systemsettings_show_driver_in_permit_report_and_more'),
+        ('finances', '0015_safetransaction_safe_date_index'),
+        ('invoices', '0005_alter_invoice_date_alter_payment_date'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contacttransaction',
+            index=models.Index(fields=['contact', 'date', 'id'], name='contacttrans_contact_date_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.1 on 2026-10-18 04:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_stock_balances(apps, schema_editor):
+    """
+    بناء أرصدة المخازن من حركات المنتجات الموجودة
+    """
+    ProductTransaction = apps.get_model('finances', 'ProductTransaction')
+    StockBalance = apps.get_model('finances', 'StockBalance')
+
+    # حركات البيع ومرتجع البيع تنقص المخزون وباقي الحركات تزيده
+    effect = models.Case(
+        models.When(transaction_type__in=['sale', 'sale_return'], then=-models.F('base_quantity')),
+        default=models.F('base_quantity'),
+        output_field=models.DecimalField(max_digits=15, decimal_places=3),
+    )
+    totals = ProductTransaction.objects.order_by().values('product_id', 'store_id').annotate(
+        quantity=models.Sum(effect)
+    )
+    StockBalance.objects.bulk_create([
+        StockBalance(product_id=row['product_id'], store_id=row['store_id'], quantity=row['quantity'])
+        for row in totals
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_systemsettings_show_driver_in_permit_report_and_more'),
+        ('finances', '0016_contacttransaction_contact_date_index'),
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=3, default=0, max_digits=15, verbose_name='الرصيد')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_balances', to='products.product', verbose_name='المنتج')),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_balances', to='core.store', verbose_name='المخزن')),
+            ],
+            options={
+                'verbose_name': 'رصيد مخزن',
+                'verbose_name_plural': 'أرصدة المخازن',
+                'unique_together': {('product', 'store')},
+            },
+        ),
+        migrations.RunPython(build_stock_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-18 04:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0017_stockbalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('safe', 'خزنة'), ('contact', 'جهة اتصال'), ('product', 'منتج')], max_length=10, verbose_name='نوع الحساب')),
+                ('account_id', models.PositiveIntegerField(verbose_name='معرف الحساب')),
+                ('period', models.CharField(choices=[('day', 'يومي'), ('month', 'شهري')], max_length=10, verbose_name='الفترة')),
+                ('period_end', models.DateField(verbose_name='نهاية الفترة')),
+                ('balance', models.DecimalField(decimal_places=3, max_digits=15, verbose_name='رصيد الإقفال')),
+                ('last_date', models.DateTimeField(verbose_name='تاريخ آخر حركة')),
+                ('last_transaction_id', models.PositiveIntegerField(verbose_name='معرف آخر حركة')),
+            ],
+            options={
+                'verbose_name': 'رصيد إقفال دوري',
+                'verbose_name_plural': 'أرصدة الإقفال الدورية',
+                'unique_together': {('kind', 'account_id', 'period', 'period_end')},
+            },
+        ),
+    ]
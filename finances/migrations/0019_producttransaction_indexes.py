@@ -0,0 +1,24 @@
+# Generated by Django 5.2.1 on 2026-10-18 04:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_systemsettings_show_driver_in_permit_report_and_more'),
+        ('finances', '0018_balancecheckpoint'),
+        ('invoices', '0005_alter_invoice_date_alter_payment_date'),
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='producttransaction',
+            index=models.Index(fields=['product', 'date', 'id'], name='prodtrans_product_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producttransaction',
+            index=models.Index(fields=['product', 'store', 'date'], name='prodtrans_prod_store_date_idx'),
+        ),
+    ]
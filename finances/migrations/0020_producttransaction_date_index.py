@@ -0,0 +1,20 @@
+# Generated by Django 5.2.1 on 2026-10-18 04:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_systemsettings_show_driver_in_permit_report_and_more'),
+        ('finances', '0019_producttransaction_indexes'),
+        ('invoices', '0006_invoice_indexes'),
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='producttransaction',
+            index=models.Index(fields=['date', 'id'], name='prodtrans_date_idx'),
+        ),
+    ]
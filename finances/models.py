@@ -1,8 +1,28 @@
+import logging
+from decimal import Decimal
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from core.models import Safe, Contact, Store, Representative, Driver
 from products.models import Product, ProductUnit
+from core import instrumentation
+from . import ledger
+
+logger = logging.getLogger(__name__)
+
+
+def split_ledger_at(transactions, from_date, from_id=None):
+    """
+    تقسيم حركات دفتر (خزنة أو حساب) عند موضع معين حسب (التاريخ، المعرف)
+    وإرجاع الحركات السابقة للموضع والحركات الواقعة فيه أو بعده.
+    الشروط مكتوبة كنطاق على التاريخ ليستخدم الاستعلام فهرس الحساب والتاريخ.
+    """
+    if from_id is None:
+        return transactions.filter(date__lt=from_date), transactions.filter(date__gte=from_date)
+    previous = transactions.filter(date__lte=from_date).exclude(date=from_date, id__gte=from_id)
+    following = transactions.filter(date__gte=from_date).exclude(date=from_date, id__lt=from_id)
+    return previous, following
+
 
 class ExpenseCategory(models.Model):
     """أقسام المصروفات في النظام"""
@@ -75,6 +95,13 @@ class SafeTransaction(models.Model):
         verbose_name = _("حركة الخزنة")
         verbose_name_plural = _("حركات الخزنة")
         ordering = ['date']  # ترتيب الحركات حسب التاريخ تصاعديًا للحصول على تسلسل صحيح
+        indexes = [
+            # يستخدم لإيجاد آخر رصيد سابق وللحركات التالية عند إعادة حساب الأرصدة
+            models.Index(fields=['safe', 'date', 'id'], name='safetrans_safe_date_idx'),
+        ]
+
+    # عدد الحركات في كل دفعة عند كتابة الأرصدة المعاد حسابها
+    BULK_BATCH_SIZE = 500
 
     def __str__(self):
         return f"{self.get_transaction_type_display()} - {self.safe.name} - {self.amount}"
@@ -91,70 +118,83 @@ class SafeTransaction(models.Model):
             elif self.invoice.invoice_type == 'purchase_return':
                 self.transaction_type = self.PURCHASE_RETURN_INVOICE
 
+    # أنواع العمليات التي تزيد رصيد الخزنة والتي تنقصه
+    INCREASING_TYPES = [SALE_INVOICE, COLLECTION, DEPOSIT, INCOME, PURCHASE_RETURN_INVOICE]
+    DECREASING_TYPES = [PURCHASE_INVOICE, PAYMENT, WITHDRAWAL, EXPENSE, SALE_RETURN_INVOICE]
+
+    def get_balance_effect(self):
+        """صافي تأثير العملية على رصيد الخزنة (موجب يزيد الرصيد وسالب ينقصه)"""
+        if self.transaction_type in self.INCREASING_TYPES:
+            return self.amount
+        if self.transaction_type in self.DECREASING_TYPES:
+            return -self.amount
+        return 0
+
     @staticmethod
-    def recalculate_balances(safe):
+    def get_balance_effect_expression(safe=None):
+        """تعبير قاعدة البيانات لصافي تأثير كل حركة على رصيد الخزنة حسب نوعها"""
+        from django.db.models import Case, When, Value, F, DecimalField
+
+        return Case(
+            When(transaction_type__in=SafeTransaction.INCREASING_TYPES, then=F('amount')),
+            When(transaction_type__in=SafeTransaction.DECREASING_TYPES, then=-F('amount')),
+            default=Value(Decimal('0')),
+            output_field=DecimalField(max_digits=15, decimal_places=2),
+        )
+
+    @staticmethod
+    @instrumentation.timer('recalculate_safe')
+    def recalculate_balances(safe, from_date=None, from_id=None):
         """
-        إعادة حساب أرصدة جميع حركات الخزنة لخزنة معينة من البداية
+        إعادة حساب أرصدة حركات الخزنة لخزنة معينة
+
+        إذا تم تحديد from_date يتم إعادة حساب الحركات الواقعة في هذا الموضع أو بعده فقط
+        (الترتيب حسب التاريخ ثم المعرف)، بدءًا من رصيد آخر حركة سابقة لم تتأثر بالتغيير،
+        ثم تُكتب الأرصدة المتغيرة دفعة واحدة. بدون from_date تتم إعادة الحساب من البداية.
         """
         from django.db import transaction
 
         with transaction.atomic():
-            # الحصول على جميع حركات الخزنة مرتبة حسب التاريخ
-            transactions = SafeTransaction.objects.filter(safe=safe).order_by('date')
-
-            # إعادة تعيين رصيد الخزنة إلى الرصيد الافتتاحي
-            current_balance = safe.initial_balance
-
-            # طباعة معلومات تصحيح الأخطاء
-            print(f"إعادة حساب أرصدة الخزنة {safe.name} - الرصيد الافتتاحي: {current_balance}")
-
-            # إعادة حساب الأرصدة لكل حركة
-            for trans in transactions:
-                # تحديث الرصيد قبل العملية
-                old_balance_before = trans.balance_before
-                old_balance_after = trans.balance_after
-
-                trans.balance_before = current_balance
-
-                # إعادة حساب الرصيد بعد العملية بناءً على نوع العملية
-                if trans.transaction_type in [SafeTransaction.SALE_INVOICE, SafeTransaction.COLLECTION, SafeTransaction.DEPOSIT, SafeTransaction.INCOME]:
-                    # عمليات تزيد رصيد الخزنة
-                    trans.balance_after = trans.balance_before + trans.amount
-                elif trans.transaction_type in [SafeTransaction.PURCHASE_INVOICE, SafeTransaction.PAYMENT, SafeTransaction.WITHDRAWAL, SafeTransaction.EXPENSE]:
-                    # عمليات تنقص رصيد الخزنة
-                    trans.balance_after = trans.balance_before - trans.amount
-                elif trans.transaction_type == SafeTransaction.SALE_RETURN_INVOICE:
-                    # مرتجع بيع ينقص الخزنة
-                    trans.balance_after = trans.balance_before - trans.amount
-                elif trans.transaction_type == SafeTransaction.PURCHASE_RETURN_INVOICE:
-                    # مرتجع شراء يزيد الخزنة
-                    trans.balance_after = trans.balance_before + trans.amount
-
-                # طباعة معلومات تصحيح الأخطاء
-                print(f"العملية: {trans.get_transaction_type_display()} - المبلغ: {trans.amount}")
-                print(f"الرصيد قبل (قديم): {old_balance_before} - الرصيد بعد (قديم): {old_balance_after}")
-                print(f"الرصيد قبل (جديد): {trans.balance_before} - الرصيد بعد (جديد): {trans.balance_after}")
-                print("---")
-
-                # تحديث الرصيد الحالي للحركة التالية
-                current_balance = trans.balance_after
+            transactions = SafeTransaction.objects.filter(safe=safe)
 
-                # حفظ التغييرات بدون استدعاء دالة save المخصصة
-                SafeTransaction.objects.filter(pk=trans.pk).update(
-                    balance_before=trans.balance_before,
-                    balance_after=trans.balance_after
+            if from_date is None:
+                # إعادة الحساب الكاملة تبدأ من الرصيد الافتتاحي
+                current_balance = safe.initial_balance
+            else:
+                # الحركات التي تسبق الموضع المتغير لا تتأثر، ونبدأ من رصيد آخرها
+                previous, transactions = split_ledger_at(transactions, from_date, from_id)
+                checkpoint = previous.order_by('-date', '-id').values_list('balance_after', flat=True).first()
+                current_balance = safe.initial_balance if checkpoint is None else checkpoint
+
+            logger.debug("إعادة حساب أرصدة الخزنة %s - رصيد البداية: %s", safe.name, current_balance)
+
+            changed = []
+            for trans in transactions.order_by('date', 'id').only(
+                'id', 'amount', 'transaction_type', 'balance_before', 'balance_after'
+            ):
+                balance_after = current_balance + trans.get_balance_effect()
+
+                # لا نعيد كتابة الحركات التي لم تتغير أرصدتها
+                if trans.balance_before != current_balance or trans.balance_after != balance_after:
+                    trans.balance_before = current_balance
+                    trans.balance_after = balance_after
+                    changed.append(trans)
+
+                current_balance = balance_after
+
+            # حفظ التغييرات دفعة واحدة بدون استدعاء دالة save المخصصة
+            if changed:
+                SafeTransaction.objects.bulk_update(
+                    changed, ['balance_before', 'balance_after'], batch_size=SafeTransaction.BULK_BATCH_SIZE
                 )
 
             # تحديث رصيد الخزنة النهائي
-            if transactions.exists():
-                safe.current_balance = transactions.last().balance_after
-            else:
-                safe.current_balance = safe.initial_balance
-
+            safe.current_balance = current_balance
             safe.save(update_fields=['current_balance'])
+            BalanceCheckpoint.refresh(ledger.SAFE, safe, from_date)
 
-            # طباعة معلومات تصحيح الأخطاء
-            print(f"الرصيد النهائي للخزنة {safe.name}: {safe.current_balance}")
+            instrumentation.count('safe_rows_updated', len(changed))
+            logger.debug("الرصيد النهائي للخزنة %s: %s - الحركات المعدلة: %s", safe.name, safe.current_balance, len(changed))
 
             return safe.current_balance
 
@@ -163,11 +203,26 @@ class SafeTransaction(models.Model):
         if self.invoice and not self.transaction_type:
             self.set_transaction_type_from_invoice()
 
+        # الموضع السابق للحركة عند التعديل، لأن تغيير التاريخ أو الخزنة يؤثر على الحركات منذ الموضع الأقدم
+        previous = None
+        if self.pk:
+            previous = SafeTransaction.objects.filter(pk=self.pk).values('safe_id', 'date').first()
+
         # حفظ الحركة أولاً
         super().save(*args, **kwargs)
 
-        # إعادة حساب جميع الأرصدة من البداية
-        SafeTransaction.recalculate_balances(self.safe)
+        # إعادة حساب الأرصدة من موضع الحركة فقط (أو تأجيلها داخل deferred_ledger)
+        from_date = self.date
+        if previous and previous['safe_id'] == self.safe_id and previous['date'] < from_date:
+            from_date = previous['date']
+        if not ledger.defer_recalculation(ledger.SAFE, self.safe, from_date, self.pk):
+            SafeTransaction.recalculate_balances(self.safe, from_date=from_date, from_id=self.pk)
+
+        # عند نقل الحركة إلى خزنة أخرى يجب تصحيح أرصدة الخزنة القديمة أيضًا
+        if previous and previous['safe_id'] != self.safe_id:
+            old_safe = Safe.objects.get(pk=previous['safe_id'])
+            if not ledger.defer_recalculation(ledger.SAFE, old_safe, previous['date'], self.pk):
+                SafeTransaction.recalculate_balances(old_safe, from_date=previous['date'], from_id=self.pk)
 
     def delete(self, *args, **kwargs):
         """
@@ -178,12 +233,16 @@ class SafeTransaction(models.Model):
         with transaction.atomic():
             # حفظ المعلومات المطلوبة قبل الحذف
             safe = self.safe
+            from_date, from_id = self.date, self.pk
 
             # حذف العملية الحالية
-            super().delete(*args, **kwargs)
+            result = super().delete(*args, **kwargs)
+
+            # إعادة حساب الأرصدة للحركات التالية للحركة المحذوفة فقط
+            if not ledger.defer_recalculation(ledger.SAFE, safe, from_date, from_id):
+                SafeTransaction.recalculate_balances(safe, from_date=from_date, from_id=from_id)
 
-            # إعادة حساب جميع الأرصدة من البداية
-            SafeTransaction.recalculate_balances(safe)
+            return result
 
 class ContactTransaction(models.Model):
     # أنواع العمليات المتعلقة بحسابات العملاء والموردين
@@ -218,6 +277,13 @@ class ContactTransaction(models.Model):
         verbose_name = _("حركة حساب")
         verbose_name_plural = _("حركات الحسابات")
         ordering = ['date']  # ترتيب الحركات حسب التاريخ تصاعديًا للحصول على تسلسل صحيح
+        indexes = [
+            # يستخدم لإيجاد آخر رصيد سابق وللحركات التالية عند إعادة حساب الأرصدة
+            models.Index(fields=['contact', 'date', 'id'], name='contacttrans_contact_date_idx'),
+        ]
+
+    # عدد الحركات في كل دفعة عند كتابة الأرصدة المعاد حسابها
+    BULK_BATCH_SIZE = 500
 
     def __str__(self):
         return f"{self.get_transaction_type_display()} - {self.contact.name} - {self.amount}"
@@ -235,85 +301,113 @@ class ContactTransaction(models.Model):
                 self.transaction_type = self.PURCHASE_RETURN_INVOICE
 
     @staticmethod
-    def recalculate_balances(contact):
+    def get_balance_effect_expression(contact):
+        """تعبير قاعدة البيانات لصافي تأثير كل حركة على رصيد جهة الاتصال حسب نوعها"""
+        from django.db.models import Case, When, Value, F, DecimalField
+
+        if contact.contact_type == Contact.CUSTOMER:
+            # فاتورة البيع تزيد مديونية العميل، والمرتجع والتحصيل ينقصانها
+            increasing = [ContactTransaction.SALE_INVOICE]
+            decreasing = [ContactTransaction.SALE_RETURN_INVOICE, ContactTransaction.COLLECTION]
+        else:
+            # فاتورة الشراء تزيد الالتزام تجاه المورد، والمرتجع والدفع ينقصانه
+            increasing = [ContactTransaction.PURCHASE_INVOICE]
+            decreasing = [ContactTransaction.PURCHASE_RETURN_INVOICE, ContactTransaction.PAYMENT]
+
+        # أي عملية أخرى لا تؤثر على الرصيد
+        return Case(
+            When(transaction_type__in=increasing, then=F('amount')),
+            When(transaction_type__in=decreasing, then=-F('amount')),
+            default=Value(Decimal('0')),
+            output_field=DecimalField(max_digits=15, decimal_places=2),
+        )
+
+    @staticmethod
+    @instrumentation.timer('recalculate_contact')
+    def recalculate_balances(contact, from_date=None, from_id=None):
         """
-        إعادة حساب أرصدة جميع حركات الحساب لجهة اتصال معينة من البداية
+        إعادة حساب أرصدة حركات الحساب لجهة اتصال معينة
+
+        يتم اشتقاق الأرصدة داخل قاعدة البيانات من رصيد البداية مضافًا إليه المجموع التراكمي
+        لتأثير الحركات مرتبة حسب (التاريخ، المعرف)، ثم تُكتب في جملة واحدة على PostgreSQL
+        أو على دفعات على باقي قواعد البيانات. إذا تم تحديد from_date تتم إعادة حساب الحركات
+        الواقعة في هذا الموضع أو بعده فقط بدءًا من رصيد آخر حركة سابقة.
         """
-        from django.db import transaction
+        from django.db import transaction, connection
+        from django.db.models import F, Sum, Value, Window, ExpressionWrapper, DecimalField
+        from django.db.models.expressions import RowRange
 
         with transaction.atomic():
-            # الحصول على جميع حركات الحساب لجهة الاتصال مرتبة حسب التاريخ
-            transactions = ContactTransaction.objects.filter(contact=contact).order_by('date')
-
-            # إعادة تعيين رصيد جهة الاتصال إلى الرصيد الافتتاحي
-            current_balance = contact.initial_balance
-
-            # طباعة معلومات تصحيح الأخطاء
-            print(f"إعادة حساب أرصدة {contact.name} - الرصيد الافتتاحي: {current_balance}")
+            transactions = ContactTransaction.objects.filter(contact=contact)
 
-            # إعادة حساب الأرصدة لكل حركة
-            for trans in transactions:
-                # تحديث الرصيد قبل العملية
-                old_balance_before = trans.balance_before
-                old_balance_after = trans.balance_after
-
-                trans.balance_before = current_balance
-
-                # إعادة حساب الرصيد بعد العملية بناءً على نوع العملية
-                if contact.contact_type == Contact.CUSTOMER:
-                    # العمليات المتعلقة بالعملاء
-                    if trans.transaction_type == ContactTransaction.SALE_INVOICE:
-                        # فاتورة بيع تزيد مديونية العميل
-                        trans.balance_after = trans.balance_before + trans.amount
-                    elif trans.transaction_type == ContactTransaction.SALE_RETURN_INVOICE:
-                        # مرتجع بيع ينقص مديونية العميل
-                        trans.balance_after = trans.balance_before - trans.amount
-                    elif trans.transaction_type == ContactTransaction.COLLECTION:
-                        # تحصيل من العميل ينقص مديونيته
-                        trans.balance_after = trans.balance_before - trans.amount
-                    else:
-                        # أي عملية أخرى لا تؤثر على الرصيد
-                        trans.balance_after = trans.balance_before
-                else:
-                    # العمليات المتعلقة بالموردين
-                    if trans.transaction_type == ContactTransaction.PURCHASE_INVOICE:
-                        # فاتورة شراء تزيد الالتزام تجاه المورد
-                        trans.balance_after = trans.balance_before + trans.amount
-                    elif trans.transaction_type == ContactTransaction.PURCHASE_RETURN_INVOICE:
-                        # مرتجع شراء ينقص الالتزام تجاه المورد
-                        trans.balance_after = trans.balance_before - trans.amount
-                    elif trans.transaction_type == ContactTransaction.PAYMENT:
-                        # دفع للمورد ينقص الالتزام تجاهه
-                        trans.balance_after = trans.balance_before - trans.amount
-                    else:
-                        # أي عملية أخرى لا تؤثر على الرصيد
-                        trans.balance_after = trans.balance_before
-
-                # طباعة معلومات تصحيح الأخطاء
-                print(f"العملية: {trans.get_transaction_type_display()} - المبلغ: {trans.amount}")
-                print(f"الرصيد قبل (قديم): {old_balance_before} - الرصيد بعد (قديم): {old_balance_after}")
-                print(f"الرصيد قبل (جديد): {trans.balance_before} - الرصيد بعد (جديد): {trans.balance_after}")
-                print("---")
-
-                # تحديث الرصيد الحالي للحركة التالية
-                current_balance = trans.balance_after
-
-                # حفظ التغييرات بدون استدعاء دالة save المخصصة
-                ContactTransaction.objects.filter(pk=trans.pk).update(
-                    balance_before=trans.balance_before,
-                    balance_after=trans.balance_after
-                )
-
-            # تحديث رصيد جهة الاتصال النهائي
-            if transactions.exists():
-                contact.current_balance = transactions.last().balance_after
+            if from_date is None:
+                # إعادة الحساب الكاملة تبدأ من الرصيد الافتتاحي
+                start_balance = contact.initial_balance
             else:
-                contact.current_balance = contact.initial_balance
+                # الحركات التي تسبق الموضع المتغير لا تتأثر، ونبدأ من رصيد آخرها
+                previous, transactions = split_ledger_at(transactions, from_date, from_id)
+                checkpoint = previous.order_by('-date', '-id').values_list('balance_after', flat=True).first()
+                start_balance = contact.initial_balance if checkpoint is None else checkpoint
+
+            logger.debug("إعادة حساب أرصدة %s - رصيد البداية: %s", contact.name, start_balance)
+
+            # الرصيد بعد كل حركة = رصيد البداية + المجموع التراكمي للتأثير حتى هذه الحركة
+            effect = ContactTransaction.get_balance_effect_expression(contact)
+            balance_field = DecimalField(max_digits=15, decimal_places=2)
+            running = transactions.annotate(
+                new_balance_after=ExpressionWrapper(
+                    Value(start_balance, output_field=balance_field) + Window(
+                        Sum(effect),
+                        order_by=[F('date').asc(), F('id').asc()],
+                        frame=RowRange(start=None, end=0),
+                    ),
+                    output_field=balance_field,
+                ),
+            ).annotate(
+                new_balance_before=ExpressionWrapper(F('new_balance_after') - effect, output_field=balance_field),
+            ).order_by('date', 'id')
+
+            if connection.vendor == 'postgresql':
+                # جملة تحديث واحدة تعتمد على الاستعلام التراكمي
+                sql, params = running.values('id', 'new_balance_before', 'new_balance_after').query.sql_with_params()
+                table = connection.ops.quote_name(ContactTransaction._meta.db_table)
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"UPDATE {table} AS t SET balance_before = r.new_balance_before, "
+                        f"balance_after = r.new_balance_after FROM ({sql}) AS r "
+                        f"WHERE t.id = r.id AND (t.balance_before <> r.new_balance_before "
+                        f"OR t.balance_after <> r.new_balance_after)",
+                        params,
+                    )
+                    updated = cursor.rowcount
+                total = transactions.aggregate(total=Sum(effect))['total'] or 0
+                final_balance = start_balance + total
+            else:
+                # قراءة الأرصدة المحسوبة في استعلام واحد ثم كتابة المتغير منها على دفعات
+                changed = []
+                final_balance = start_balance
+                for row in running.values_list('id', 'balance_before', 'balance_after',
+                                               'new_balance_before', 'new_balance_after'):
+                    trans_id, balance_before, balance_after, new_balance_before, new_balance_after = row
+                    if balance_before != new_balance_before or balance_after != new_balance_after:
+                        changed.append(ContactTransaction(
+                            id=trans_id, balance_before=new_balance_before, balance_after=new_balance_after
+                        ))
+                    final_balance = new_balance_after
+
+                if changed:
+                    ContactTransaction.objects.bulk_update(
+                        changed, ['balance_before', 'balance_after'], batch_size=ContactTransaction.BULK_BATCH_SIZE
+                    )
+                updated = len(changed)
 
+            # تحديث رصيد جهة الاتصال النهائي
+            contact.current_balance = final_balance
             contact.save(update_fields=['current_balance'])
+            BalanceCheckpoint.refresh(ledger.CONTACT, contact, from_date)
 
-            # طباعة معلومات تصحيح الأخطاء
-            print(f"الرصيد النهائي لـ {contact.name}: {contact.current_balance}")
+            instrumentation.count('contact_rows_updated', updated)
+            logger.debug("الرصيد النهائي لـ %s: %s - الحركات المعدلة: %s", contact.name, contact.current_balance, updated)
 
             return contact.current_balance
 
@@ -322,11 +416,26 @@ class ContactTransaction(models.Model):
         if self.invoice and not self.transaction_type:
             self.set_transaction_type_from_invoice()
 
+        # الموضع السابق للحركة عند التعديل، لأن تغيير التاريخ أو جهة الاتصال يؤثر على الحركات منذ الموضع الأقدم
+        previous = None
+        if self.pk:
+            previous = ContactTransaction.objects.filter(pk=self.pk).values('contact_id', 'date').first()
+
         # حفظ الحركة أولاً
         super().save(*args, **kwargs)
 
-        # إعادة حساب جميع الأرصدة من البداية
-        ContactTransaction.recalculate_balances(self.contact)
+        # إعادة حساب الأرصدة من موضع الحركة فقط (أو تأجيلها داخل deferred_ledger)
+        from_date = self.date
+        if previous and previous['contact_id'] == self.contact_id and previous['date'] < from_date:
+            from_date = previous['date']
+        if not ledger.defer_recalculation(ledger.CONTACT, self.contact, from_date, self.pk):
+            ContactTransaction.recalculate_balances(self.contact, from_date=from_date, from_id=self.pk)
+
+        # عند نقل الحركة إلى جهة اتصال أخرى يجب تصحيح أرصدة جهة الاتصال القديمة أيضًا
+        if previous and previous['contact_id'] != self.contact_id:
+            old_contact = Contact.objects.get(pk=previous['contact_id'])
+            if not ledger.defer_recalculation(ledger.CONTACT, old_contact, previous['date'], self.pk):
+                ContactTransaction.recalculate_balances(old_contact, from_date=previous['date'], from_id=self.pk)
 
     def delete(self, *args, **kwargs):
         """
@@ -337,12 +446,16 @@ class ContactTransaction(models.Model):
         with transaction.atomic():
             # حفظ المعلومات المطلوبة قبل الحذف
             contact = self.contact
+            from_date, from_id = self.date, self.pk
 
             # حذف العملية الحالية
-            super().delete(*args, **kwargs)
+            result = super().delete(*args, **kwargs)
+
+            # إعادة حساب الأرصدة للحركات التالية للحركة المحذوفة فقط
+            if not ledger.defer_recalculation(ledger.CONTACT, contact, from_date, from_id):
+                ContactTransaction.recalculate_balances(contact, from_date=from_date, from_id=from_id)
 
-            # إعادة حساب جميع الأرصدة من البداية
-            ContactTransaction.recalculate_balances(contact)
+            return result
 
 class ProductTransaction(models.Model):
     # أنواع حركات المنتجات
@@ -461,6 +574,17 @@ class ProductTransaction(models.Model):
         verbose_name = _("حركة منتج")
         verbose_name_plural = _("حركات المنتجات")
         ordering = ['date']  # ترتيب الحركات حسب التاريخ تصاعديًا للحصول على تسلسل صحيح
+        indexes = [
+            # يستخدم لقراءة حركات المنتج مرتبة عند إعادة حساب الأرصدة
+            models.Index(fields=['product', 'date', 'id'], name='prodtrans_product_date_idx'),
+            # يستخدم لحركات المنتج في مخزن معين خلال فترة
+            models.Index(fields=['product', 'store', 'date'], name='prodtrans_prod_store_date_idx'),
+            # قائمة حركات المخزون مقسمة إلى صفحات بالمؤشر على (-date, -id)
+            models.Index(fields=['date', 'id'], name='prodtrans_date_idx'),
+        ]
+
+    # عدد الحركات في كل دفعة عند الكتابة الجماعية
+    BULK_BATCH_SIZE = 500
 
     def __str__(self):
         return f"{self.get_transaction_type_display()} - {self.product.name} - {self.quantity}"
@@ -470,22 +594,54 @@ class ProductTransaction(models.Model):
         if self.invoice:
             self.transaction_type = self.invoice.invoice_type
 
+    # أنواع الحركات التي تنقص المخزون (باقي الأنواع تزيده)
+    DECREASING_TYPES = [SALE, SALE_RETURN]
+
     @staticmethod
-    def recalculate_balances(product):
+    def calculate_effect(transaction_type, base_quantity):
+        """صافي تأثير حركة على رصيد المنتج بالوحدة الأساسية"""
+        if transaction_type in ProductTransaction.DECREASING_TYPES:
+            return -base_quantity
+        return base_quantity
+
+    def get_balance_effect(self):
+        """صافي تأثير الحركة على رصيد المنتج بالوحدة الأساسية"""
+        return ProductTransaction.calculate_effect(self.transaction_type, self.base_quantity)
+
+    @staticmethod
+    def get_balance_effect_expression(product=None):
+        """تعبير قاعدة البيانات لصافي تأثير كل حركة على رصيد المنتج بالوحدة الأساسية"""
+        from django.db.models import Case, When, F, DecimalField
+
+        return Case(
+            When(transaction_type__in=ProductTransaction.DECREASING_TYPES, then=-F('base_quantity')),
+            default=F('base_quantity'),
+            output_field=DecimalField(max_digits=15, decimal_places=3),
+        )
+
+    @staticmethod
+    @instrumentation.timer('recalculate_product')
+    def recalculate_balances(product, from_date=None):
         """
         إعادة حساب أرصدة جميع حركات المنتج لمنتج معين من البداية
+        (from_date يحدد أقدم فترة تتأثر أرصدة إقفالها فقط)
         """
         from django.db import transaction
 
         with transaction.atomic():
             # الحصول على جميع حركات المنتج مرتبة حسب التاريخ
-            transactions = ProductTransaction.objects.filter(product=product).order_by('date')
+            transactions = ProductTransaction.objects.filter(product=product).order_by('date', 'id')
+            changed = []
+
+            # تفاصيل كل حركة تُسجل فقط عند تفعيل مستوى DEBUG
+            debug = logger.isEnabledFor(logging.DEBUG)
+            if debug:
+                transactions = transactions.select_related('product_unit__unit')
 
             # إعادة تعيين رصيد المنتج إلى الرصيد الافتتاحي
             current_balance = product.initial_balance
 
-            # طباعة معلومات تصحيح الأخطاء
-            print(f"إعادة حساب أرصدة المنتج {product.name} - الرصيد الافتتاحي: {current_balance}")
+            logger.debug("إعادة حساب أرصدة المنتج %s - الرصيد الافتتاحي: %s", product.name, current_balance)
 
             # إعادة حساب الأرصدة لكل حركة
             for trans in transactions:
@@ -496,38 +652,36 @@ class ProductTransaction(models.Model):
                 trans.balance_before = current_balance
 
                 # إعادة حساب الرصيد بعد العملية بناءً على نوع العملية
-                if trans.transaction_type in [ProductTransaction.SALE, ProductTransaction.SALE_RETURN]:
-                    # عمليات تنقص المخزون
-                    trans.balance_after = trans.balance_before - trans.base_quantity
-                else:
-                    # عمليات تزيد المخزون
-                    trans.balance_after = trans.balance_before + trans.base_quantity
-
-                # طباعة معلومات تصحيح الأخطاء
-                print(f"العملية: {trans.get_transaction_type_display()} - الكمية: {trans.quantity} {trans.product_unit.unit.name} - الكمية الأساسية: {trans.base_quantity}")
-                print(f"الرصيد قبل (قديم): {old_balance_before} - الرصيد بعد (قديم): {old_balance_after}")
-                print(f"الرصيد قبل (جديد): {trans.balance_before} - الرصيد بعد (جديد): {trans.balance_after}")
-                print("---")
+                trans.balance_after = trans.balance_before + trans.get_balance_effect()
+
+                if debug:
+                    logger.debug(
+                        "العملية: %s - الكمية: %s %s - الكمية الأساسية: %s - الرصيد قبل/بعد (قديم): %s/%s - (جديد): %s/%s",
+                        trans.get_transaction_type_display(), trans.quantity, trans.product_unit.unit.name,
+                        trans.base_quantity, old_balance_before, old_balance_after,
+                        trans.balance_before, trans.balance_after,
+                    )
 
                 # تحديث الرصيد الحالي للحركة التالية
                 current_balance = trans.balance_after
 
-                # حفظ التغييرات بدون استدعاء دالة save المخصصة
-                ProductTransaction.objects.filter(pk=trans.pk).update(
-                    balance_before=trans.balance_before,
-                    balance_after=trans.balance_after
-                )
+                # حفظ الحركات التي تغيرت أرصدتها فقط
+                if trans.balance_before != old_balance_before or trans.balance_after != old_balance_after:
+                    changed.append(trans)
 
-            # تحديث رصيد المنتج النهائي
-            if transactions.exists():
-                product.current_balance = transactions.last().balance_after
-            else:
-                product.current_balance = product.initial_balance
+            # حفظ التغييرات دفعة واحدة بدون استدعاء دالة save المخصصة
+            ProductTransaction.objects.bulk_update(
+                changed, ['balance_before', 'balance_after'], batch_size=ProductTransaction.BULK_BATCH_SIZE
+            )
+
+            # تحديث رصيد المنتج النهائي (رصيد آخر حركة أو الرصيد الافتتاحي إذا لم توجد حركات)
+            product.current_balance = current_balance
 
             product.save(update_fields=['current_balance'])
+            BalanceCheckpoint.refresh(ledger.PRODUCT, product, from_date)
 
-            # طباعة معلومات تصحيح الأخطاء
-            print(f"الرصيد النهائي للمنتج {product.name}: {product.current_balance}")
+            instrumentation.count('product_rows_updated', len(changed))
+            logger.debug("الرصيد النهائي للمنتج %s: %s - الحركات المعدلة: %s", product.name, product.current_balance, len(changed))
 
             return product.current_balance
 
@@ -539,11 +693,36 @@ class ProductTransaction(models.Model):
         # تحويل الكمية إلى الوحدة الأساسية
         self.base_quantity = self.quantity * self.product_unit.conversion_factor
 
+        # بيانات الحركة قبل التعديل لعكس أثرها على رصيد المخزن
+        previous = None
+        if self.pk:
+            previous = ProductTransaction.objects.filter(pk=self.pk).values(
+                'product_id', 'store_id', 'transaction_type', 'base_quantity', 'date'
+            ).first()
+
         # حفظ الحركة أولاً
         super().save(*args, **kwargs)
 
-        # إعادة حساب جميع الأرصدة من البداية
-        ProductTransaction.recalculate_balances(self.product)
+        # تحديث رصيد المنتج في المخزن بفرق الحركة فقط
+        if previous:
+            StockBalance.apply_movement(
+                previous['product_id'], previous['store_id'],
+                -ProductTransaction.calculate_effect(previous['transaction_type'], previous['base_quantity'])
+            )
+        StockBalance.apply_movement(self.product_id, self.store_id, self.get_balance_effect())
+
+        # إعادة حساب جميع الأرصدة من البداية (أو تأجيلها داخل deferred_ledger)
+        from_date = self.date
+        if previous and previous['product_id'] == self.product_id and previous['date'] < from_date:
+            from_date = previous['date']
+        if not ledger.defer_recalculation(ledger.PRODUCT, self.product, from_date):
+            ProductTransaction.recalculate_balances(self.product, from_date=from_date)
+
+        # عند نقل الحركة إلى منتج آخر يجب تصحيح أرصدة المنتج القديم أيضًا
+        if previous and previous['product_id'] != self.product_id:
+            old_product = Product.objects.get(pk=previous['product_id'])
+            if not ledger.defer_recalculation(ledger.PRODUCT, old_product, previous['date']):
+                ProductTransaction.recalculate_balances(old_product, from_date=previous['date'])
 
     def delete(self, *args, **kwargs):
         """
@@ -554,12 +733,276 @@ class ProductTransaction(models.Model):
         with transaction.atomic():
             # حفظ المعلومات المطلوبة قبل الحذف
             product = self.product
+            from_date = self.date
 
             # حذف العملية الحالية
             super().delete(*args, **kwargs)
 
-            # إعادة حساب جميع الأرصدة من البداية
-            ProductTransaction.recalculate_balances(product)
+            # إعادة حساب جميع الأرصدة من البداية (أو تأجيلها داخل deferred_ledger)
+            if not ledger.defer_recalculation(ledger.PRODUCT, product, from_date):
+                ProductTransaction.recalculate_balances(product, from_date=from_date)
+
+
+class StockBalance(models.Model):
+    """
+    رصيد المنتج في كل مخزن بالوحدة الأساسية
+
+    يتم تحديثه مع كل إضافة أو تعديل أو حذف لحركة منتج، ويمثل صافي حركات المنتج في المخزن
+    (الرصيد الافتتاحي للمنتج غير مرتبط بمخزن ولا يدخل فيه).
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_balances', verbose_name=_("المنتج"))
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='stock_balances', verbose_name=_("المخزن"))
+    quantity = models.DecimalField(_("الرصيد"), max_digits=15, decimal_places=3, default=0)
+
+    class Meta:
+        verbose_name = _("رصيد مخزن")
+        verbose_name_plural = _("أرصدة المخازن")
+        unique_together = [['product', 'store']]
+
+    def __str__(self):
+        return f"{self.product.name} - {self.store.name} - {self.quantity}"
+
+    @staticmethod
+    def apply_movement(product_id, store_id, delta, create=True):
+        """إضافة أثر حركة إلى رصيد المنتج في المخزن بتحديث ذري في قاعدة البيانات"""
+        from django.db.models import F
+
+        if not delta:
+            return
+        updated = StockBalance.objects.filter(product_id=product_id, store_id=store_id).update(
+            quantity=F('quantity') + delta
+        )
+        if not updated and create:
+            balance, created = StockBalance.objects.get_or_create(
+                product_id=product_id, store_id=store_id, defaults={'quantity': delta}
+            )
+            if not created:
+                StockBalance.objects.filter(pk=balance.pk).update(quantity=F('quantity') + delta)
+
+    @staticmethod
+    def get_quantity(product, store):
+        """الرصيد الحالي للمنتج في المخزن"""
+        quantity = StockBalance.objects.filter(product=product, store=store).values_list('quantity', flat=True).first()
+        return quantity if quantity is not None else Decimal('0')
+
+    @staticmethod
+    def get_quantities(store, product_ids):
+        """أرصدة مجموعة من المنتجات في مخزن واحد في استعلام واحد"""
+        balances = dict(StockBalance.objects.filter(store=store, product_id__in=set(product_ids)).values_list(
+            'product_id', 'quantity'
+        ))
+        return {product_id: balances.get(product_id, Decimal('0')) for product_id in product_ids}
+
+    @staticmethod
+    def get_shortages(store, items):
+        """
+        البنود (فاتورة أو إذن) التي تتجاوز كميتها بالوحدة الأساسية رصيد المنتج في المخزن،
+        مع تجميع كميات المنتج المكرر في أكثر من بند
+        """
+        required = {}
+        products = {}
+        for item in items:
+            base_quantity = item.quantity * item.product_unit.conversion_factor
+            required[item.product_id] = required.get(item.product_id, 0) + base_quantity
+            products[item.product_id] = item.product
+
+        available = StockBalance.get_quantities(store, required.keys())
+        return [
+            {'product': products[product_id], 'required': quantity, 'available': available[product_id]}
+            for product_id, quantity in required.items()
+            if quantity > available[product_id]
+        ]
+
+    @staticmethod
+    def rebuild(product=None):
+        """إعادة بناء أرصدة المخازن من حركات المنتجات"""
+        from django.db import transaction
+        from django.db.models import Sum
+
+        transactions = ProductTransaction.objects.all()
+        balances = StockBalance.objects.all()
+        if product is not None:
+            transactions = transactions.filter(product=product)
+            balances = balances.filter(product=product)
+
+        effect = ProductTransaction.get_balance_effect_expression()
+        totals = transactions.order_by().values('product_id', 'store_id').annotate(quantity=Sum(effect))
+
+        with transaction.atomic():
+            balances.delete()
+            StockBalance.objects.bulk_create([
+                StockBalance(product_id=row['product_id'], store_id=row['store_id'], quantity=row['quantity'])
+                for row in totals
+            ], batch_size=ProductTransaction.BULK_BATCH_SIZE)
+
+
+class BalanceCheckpoint(models.Model):
+    """
+    رصيد إقفال دوري (يومي أو شهري حسب LEDGER_CHECKPOINT_PERIOD) لكل خزنة وجهة اتصال ومنتج
+
+    يمثل رصيد الحساب بعد آخر حركة في الفترة، ويتم تحديثه عند إعادة حساب أرصدة الحساب
+    بدءًا من الفترة المتأثرة فقط. الرصيد الافتتاحي في أي تاريخ = أقرب رصيد إقفال سابق
+    (قراءة واحدة من الفهرس) + مجموع أثر الحركات بعده حتى هذا التاريخ (حركات فترة واحدة على الأكثر).
+    """
+    KIND_CHOICES = [
+        (ledger.SAFE, _("خزنة")),
+        (ledger.CONTACT, _("جهة اتصال")),
+        (ledger.PRODUCT, _("منتج")),
+    ]
+
+    DAY = 'day'
+    MONTH = 'month'
+
+    PERIOD_CHOICES = [
+        (DAY, _("يومي")),
+        (MONTH, _("شهري")),
+    ]
+
+    kind = models.CharField(_("نوع الحساب"), max_length=10, choices=KIND_CHOICES)
+    account_id = models.PositiveIntegerField(_("معرف الحساب"))
+    period = models.CharField(_("الفترة"), max_length=10, choices=PERIOD_CHOICES)
+    period_end = models.DateField(_("نهاية الفترة"))
+    balance = models.DecimalField(_("رصيد الإقفال"), max_digits=15, decimal_places=3)
+    last_date = models.DateTimeField(_("تاريخ آخر حركة"))
+    last_transaction_id = models.PositiveIntegerField(_("معرف آخر حركة"))
+
+    class Meta:
+        verbose_name = _("رصيد إقفال دوري")
+        verbose_name_plural = _("أرصدة الإقفال الدورية")
+        unique_together = [['kind', 'account_id', 'period', 'period_end']]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.account_id} - {self.period_end} - {self.balance}"
+
+    @staticmethod
+    def get_period():
+        """الفترة المستخدمة حاليًا من الإعدادات (شهري افتراضيًا)"""
+        from django.conf import settings
+
+        return getattr(settings, 'LEDGER_CHECKPOINT_PERIOD', BalanceCheckpoint.MONTH)
+
+    @staticmethod
+    def get_ledger(kind):
+        """نموذج حركات الحساب واسم حقل الحساب فيه"""
+        return {
+            ledger.SAFE: (SafeTransaction, 'safe'),
+            ledger.CONTACT: (ContactTransaction, 'contact'),
+            ledger.PRODUCT: (ProductTransaction, 'product'),
+        }[kind]
+
+    @staticmethod
+    def get_period_end(date, period):
+        """آخر يوم في الفترة التي يقع فيها التاريخ (بالتوقيت المحلي)"""
+        import calendar
+        from datetime import datetime
+
+        if isinstance(date, datetime):
+            date = timezone.localtime(date).date() if timezone.is_aware(date) else date.date()
+        if period == BalanceCheckpoint.DAY:
+            return date
+        return date.replace(day=calendar.monthrange(date.year, date.month)[1])
+
+    @staticmethod
+    def get_period_start(period_end, period):
+        """بداية الفترة كتاريخ ووقت بالتوقيت المحلي"""
+        from datetime import datetime, time
+
+        start = period_end if period == BalanceCheckpoint.DAY else period_end.replace(day=1)
+        return timezone.make_aware(datetime.combine(start, time.min))
+
+    @staticmethod
+    def refresh(kind, account, from_date=None):
+        """
+        تحديث أرصدة الإقفال للحساب من الفترة التي يقع فيها from_date وما بعدها
+        (بدون from_date يعاد بناء جميع أرصدة الإقفال للحساب).
+        تعتمد على أرصدة balance_after المحسوبة للحركات، لذلك تستدعى بعد إعادة حساب الأرصدة.
+        """
+        model, field = BalanceCheckpoint.get_ledger(kind)
+        period = BalanceCheckpoint.get_period()
+        checkpoints = BalanceCheckpoint.objects.filter(kind=kind, account_id=account.pk, period=period)
+        transactions = model.objects.filter(**{field: account})
+
+        first_end = None
+        if from_date is not None:
+            first_end = BalanceCheckpoint.get_period_end(from_date, period)
+            checkpoints = checkpoints.filter(period_end__gte=first_end)
+        checkpoints.delete()
+
+        last = transactions.order_by('-date', '-id').values('id', 'date', 'balance_after').first()
+        if last is None:
+            return
+
+        # الحالة الشائعة (إضافة حركة في الفترة الأخيرة): رصيد إقفال واحد من آخر حركة
+        last_end = BalanceCheckpoint.get_period_end(last['date'], period)
+        if first_end == last_end:
+            BalanceCheckpoint.objects.create(
+                kind=kind, account_id=account.pk, period=period, period_end=last_end,
+                balance=last['balance_after'], last_date=last['date'], last_transaction_id=last['id'],
+            )
+            return
+
+        # تغيير يمتد لعدة فترات: قراءة حركات الفترات المتأثرة مرة واحدة والاحتفاظ بآخر حركة في كل فترة
+        if first_end is not None:
+            transactions = transactions.filter(date__gte=BalanceCheckpoint.get_period_start(first_end, period))
+
+        closing = {}
+        for trans_id, date, balance_after in transactions.order_by('date', 'id').values_list(
+            'id', 'date', 'balance_after'
+        ).iterator(chunk_size=2000):
+            closing[BalanceCheckpoint.get_period_end(date, period)] = (trans_id, date, balance_after)
+
+        BalanceCheckpoint.objects.bulk_create([
+            BalanceCheckpoint(
+                kind=kind, account_id=account.pk, period=period, period_end=period_end,
+                balance=balance_after, last_date=date, last_transaction_id=trans_id,
+            )
+            for period_end, (trans_id, date, balance_after) in closing.items()
+        ], batch_size=ProductTransaction.BULK_BATCH_SIZE)
+
+    @staticmethod
+    def get_opening_balance(kind, account, at):
+        """
+        رصيد الحساب قبل لحظة معينة: أقرب رصيد إقفال سابق ثم مجموع أثر الحركات بعده فقط.
+        إذا لم توجد أرصدة إقفال يتم الجمع من الرصيد الافتتاحي للحساب.
+        """
+        from django.db.models import Sum
+
+        model, field = BalanceCheckpoint.get_ledger(kind)
+        period = BalanceCheckpoint.get_period()
+
+        checkpoint = BalanceCheckpoint.objects.filter(
+            kind=kind, account_id=account.pk, period=period,
+            period_end__lt=BalanceCheckpoint.get_period_end(at, BalanceCheckpoint.DAY),
+        ).order_by('-period_end').first()
+
+        transactions = model.objects.filter(**{field: account}, date__lt=at)
+        if checkpoint is None:
+            balance = account.initial_balance
+        else:
+            balance = checkpoint.balance
+            transactions = transactions.filter(date__gte=checkpoint.last_date).exclude(
+                date=checkpoint.last_date, id__lte=checkpoint.last_transaction_id
+            )
+
+        total = transactions.aggregate(total=Sum(model.get_balance_effect_expression(account)))['total']
+        return balance + (total or 0)
+
+    @staticmethod
+    def rebuild(kind=None):
+        """إعادة بناء أرصدة الإقفال لجميع الحسابات (أو لنوع واحد) من أرصدة الحركات"""
+        from django.db import transaction
+
+        kinds = [kind] if kind else [choice[0] for choice in BalanceCheckpoint.KIND_CHOICES]
+        accounts = {ledger.SAFE: Safe, ledger.CONTACT: Contact, ledger.PRODUCT: Product}
+
+        count = 0
+        with transaction.atomic():
+            for current_kind in kinds:
+                BalanceCheckpoint.objects.filter(kind=current_kind).delete()
+                for account in accounts[current_kind].objects.all():
+                    BalanceCheckpoint.refresh(current_kind, account)
+                    count += 1
+        return count
 
 
 # تم نقل نموذج StorePermit إلى نهاية الملف
@@ -705,28 +1148,30 @@ class Expense(models.Model):
         if self.is_posted and self.created_transaction:
             return False
 
-        # إنشاء حركة الخزنة
-        current_balance = self.safe.current_balance
-        # المصروفات تنقص رصيد الخزنة
-        balance_after = current_balance - self.amount
-
-        safe_transaction = SafeTransaction(
-            safe=self.safe,
-            date=self.date,  # استخدام تاريخ المصروف
-            amount=self.amount,
-            transaction_type=SafeTransaction.EXPENSE,
-            description=f"مصروف: {self.category.name} - {self.payee}",
-            reference_number=self.number,
-            balance_before=current_balance,  # تعيين الرصيد قبل العملية
-            balance_after=balance_after  # تعيين الرصيد بعد العملية
-        )
-
-        safe_transaction.save()
-        self.created_transaction = safe_transaction
+        # قفل الخزنة وقراءة رصيدها الحالي قبل إنشاء الحركة
+        with ledger.posting(safes=[self.safe]):
+            # إنشاء حركة الخزنة
+            current_balance = self.safe.current_balance
+            # المصروفات تنقص رصيد الخزنة
+            balance_after = current_balance - self.amount
+
+            safe_transaction = SafeTransaction(
+                safe=self.safe,
+                date=self.date,  # استخدام تاريخ المصروف
+                amount=self.amount,
+                transaction_type=SafeTransaction.EXPENSE,
+                description=f"مصروف: {self.category.name} - {self.payee}",
+                reference_number=self.number,
+                balance_before=current_balance,  # تعيين الرصيد قبل العملية
+                balance_after=balance_after  # تعيين الرصيد بعد العملية
+            )
+
+            safe_transaction.save()
+            self.created_transaction = safe_transaction
 
-        # تحديث حالة الترحيل
-        self.is_posted = True
-        self.save(update_fields=['is_posted', 'created_transaction'])
+            # تحديث حالة الترحيل
+            self.is_posted = True
+            self.save(update_fields=['is_posted', 'created_transaction'])
 
         return True
 
@@ -787,28 +1232,30 @@ class Income(models.Model):
         if self.is_posted and self.created_transaction:
             return False
 
-        # إنشاء حركة الخزنة
-        current_balance = self.safe.current_balance
-        # الإيرادات تزيد رصيد الخزنة
-        balance_after = current_balance + self.amount
-
-        safe_transaction = SafeTransaction(
-            safe=self.safe,
-            date=self.date,  # استخدام تاريخ الإيراد
-            amount=self.amount,
-            transaction_type=SafeTransaction.INCOME,
-            description=f"إيراد: {self.category.name} - {self.payer}",
-            reference_number=self.number,
-            balance_before=current_balance,  # تعيين الرصيد قبل العملية
-            balance_after=balance_after  # تعيين الرصيد بعد العملية
-        )
+        # قفل الخزنة وقراءة رصيدها الحالي قبل إنشاء الحركة
+        with ledger.posting(safes=[self.safe]):
+            # إنشاء حركة الخزنة
+            current_balance = self.safe.current_balance
+            # الإيرادات تزيد رصيد الخزنة
+            balance_after = current_balance + self.amount
+
+            safe_transaction = SafeTransaction(
+                safe=self.safe,
+                date=self.date,  # استخدام تاريخ الإيراد
+                amount=self.amount,
+                transaction_type=SafeTransaction.INCOME,
+                description=f"إيراد: {self.category.name} - {self.payer}",
+                reference_number=self.number,
+                balance_before=current_balance,  # تعيين الرصيد قبل العملية
+                balance_after=balance_after  # تعيين الرصيد بعد العملية
+            )
+
+            safe_transaction.save()
+            self.created_transaction = safe_transaction
 
-        safe_transaction.save()
-        self.created_transaction = safe_transaction
-
-        # تحديث حالة الترحيل
-        self.is_posted = True
-        self.save(update_fields=['is_posted', 'created_transaction'])
+            # تحديث حالة الترحيل
+            self.is_posted = True
+            self.save(update_fields=['is_posted', 'created_transaction'])
 
         return True
 
@@ -867,28 +1314,30 @@ class SafeDeposit(models.Model):
         if self.is_posted and self.created_transaction:
             return False
 
-        # إنشاء حركة الخزنة
-        current_balance = self.safe.current_balance
-        # الإيداعات تزيد رصيد الخزنة
-        balance_after = current_balance + self.amount
-
-        safe_transaction = SafeTransaction(
-            safe=self.safe,
-            date=self.date,  # استخدام تاريخ الإيداع
-            amount=self.amount,
-            transaction_type=SafeTransaction.DEPOSIT,
-            description=f"إيداع في الخزنة: {self.source}",
-            reference_number=self.number,
-            balance_before=current_balance,  # تعيين الرصيد قبل العملية
-            balance_after=balance_after  # تعيين الرصيد بعد العملية
-        )
-
-        safe_transaction.save()
-        self.created_transaction = safe_transaction
+        # قفل الخزنة وقراءة رصيدها الحالي قبل إنشاء الحركة
+        with ledger.posting(safes=[self.safe]):
+            # إنشاء حركة الخزنة
+            current_balance = self.safe.current_balance
+            # الإيداعات تزيد رصيد الخزنة
+            balance_after = current_balance + self.amount
+
+            safe_transaction = SafeTransaction(
+                safe=self.safe,
+                date=self.date,  # استخدام تاريخ الإيداع
+                amount=self.amount,
+                transaction_type=SafeTransaction.DEPOSIT,
+                description=f"إيداع في الخزنة: {self.source}",
+                reference_number=self.number,
+                balance_before=current_balance,  # تعيين الرصيد قبل العملية
+                balance_after=balance_after  # تعيين الرصيد بعد العملية
+            )
+
+            safe_transaction.save()
+            self.created_transaction = safe_transaction
 
-        # تحديث حالة الترحيل
-        self.is_posted = True
-        self.save(update_fields=['is_posted', 'created_transaction'])
+            # تحديث حالة الترحيل
+            self.is_posted = True
+            self.save(update_fields=['is_posted', 'created_transaction'])
 
         return True
 
@@ -947,28 +1396,30 @@ class SafeWithdrawal(models.Model):
         if self.is_posted and self.created_transaction:
             return False
 
-        # إنشاء حركة الخزنة
-        current_balance = self.safe.current_balance
-        # السحوبات تنقص رصيد الخزنة
-        balance_after = current_balance - self.amount
-
-        safe_transaction = SafeTransaction(
-            safe=self.safe,
-            date=self.date,  # استخدام تاريخ السحب
-            amount=self.amount,
-            transaction_type=SafeTransaction.WITHDRAWAL,
-            description=f"سحب من الخزنة: {self.destination}",
-            reference_number=self.number,
-            balance_before=current_balance,  # تعيين الرصيد قبل العملية
-            balance_after=balance_after  # تعيين الرصيد بعد العملية
-        )
-
-        safe_transaction.save()
-        self.created_transaction = safe_transaction
+        # قفل الخزنة وقراءة رصيدها الحالي قبل إنشاء الحركة
+        with ledger.posting(safes=[self.safe]):
+            # إنشاء حركة الخزنة
+            current_balance = self.safe.current_balance
+            # السحوبات تنقص رصيد الخزنة
+            balance_after = current_balance - self.amount
+
+            safe_transaction = SafeTransaction(
+                safe=self.safe,
+                date=self.date,  # استخدام تاريخ السحب
+                amount=self.amount,
+                transaction_type=SafeTransaction.WITHDRAWAL,
+                description=f"سحب من الخزنة: {self.destination}",
+                reference_number=self.number,
+                balance_before=current_balance,  # تعيين الرصيد قبل العملية
+                balance_after=balance_after  # تعيين الرصيد بعد العملية
+            )
+
+            safe_transaction.save()
+            self.created_transaction = safe_transaction
 
-        # تحديث حالة الترحيل
-        self.is_posted = True
-        self.save(update_fields=['is_posted', 'created_transaction'])
+            # تحديث حالة الترحيل
+            self.is_posted = True
+            self.save(update_fields=['is_posted', 'created_transaction'])
 
         return True
 
@@ -1020,16 +1471,23 @@ class StorePermit(models.Model):
     def __str__(self):
         return f"{self.get_permit_type_display()} - {self.number}"
 
+    def get_stock_shortages(self):
+        """بنود إذن الصرف التي تتجاوز كميتها رصيد المنتج في المخزن، بقراءة واحدة من جدول أرصدة المخازن"""
+        if self.permit_type != self.ISSUE:
+            return []
+        return StockBalance.get_shortages(self.store_id, self.items.select_related('product', 'product_unit'))
+
     def post_permit(self):
         """ترحيل الإذن وإنشاء حركات المنتجات المرتبطة"""
         if self.is_posted:
             return False
 
-        from django.db import transaction
+        items = list(self.items.select_related('product', 'product_unit'))
 
-        with transaction.atomic():
+        # قفل منتجات الإذن وقراءة أرصدتها الحالية، وإعادة حساب أرصدة كل منتج مرة واحدة بعد إنشاء جميع الحركات
+        with ledger.posting(products=[item.product for item in items]):
             # إنشاء حركات المنتجات لكل بند في الإذن
-            for item in self.items.all():
+            for item in items:
                 # حساب الكمية بالوحدة الأساسية
                 base_quantity = item.quantity * item.product_unit.conversion_factor
 
@@ -1073,10 +1531,6 @@ class StorePermit(models.Model):
                 item.created_transaction = product_transaction
                 item.save(update_fields=['created_transaction'])
 
-                # تحديث رصيد المنتج
-                item.product.current_balance = balance_after
-                item.product.save(update_fields=['current_balance'])
-
             # تحديث حالة الترحيل
             self.is_posted = True
             self.save(update_fields=['is_posted'])
@@ -1088,23 +1542,16 @@ class StorePermit(models.Model):
         if not self.is_posted:
             return False
 
-        from django.db import transaction
-
-        with transaction.atomic():
+        # إعادة حساب أرصدة كل منتج مرة واحدة بعد حذف جميع الحركات
+        with ledger.deferred_ledger():
             # حذف حركات المنتجات لكل بند في الإذن
-            for item in self.items.all():
+            for item in self.items.select_related('created_transaction__product'):
                 if item.created_transaction:
-                    # حفظ المنتج قبل حذف الحركة
-                    product = item.created_transaction.product
-
                     # حذف حركة المنتج
                     item.created_transaction.delete()
                     item.created_transaction = None
                     item.save(update_fields=['created_transaction'])
 
-                    # إعادة حساب أرصدة المنتج
-                    ProductTransaction.recalculate_balances(product)
-
             # تحديث حالة الترحيل
             self.is_posted = False
             self.save(update_fields=['is_posted'])
@@ -0,0 +1,9 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .models import ProductTransaction, StockBalance
+
+@receiver(post_delete, sender=ProductTransaction)
+def handle_product_transaction_delete(sender, instance, **kwargs):
+    """عكس أثر حركة المنتج المحذوفة على رصيد المخزن (يشمل الحذف الجماعي من الاستعلامات)"""
+    # لا ننشئ رصيدًا جديدًا إذا كان المنتج أو المخزن نفسه قيد الحذف
+    StockBalance.apply_movement(instance.product_id, instance.store_id, -instance.get_balance_effect(), create=False)
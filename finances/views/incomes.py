@@ -8,6 +8,7 @@ from django.utils import timezone
 from ..models import Income, IncomeCategory
 from ..forms import IncomeForm
 from core.models import Safe
+from core import sequences
 
 @login_required
 def income_list(request):
@@ -58,17 +59,13 @@ def income_list(request):
 @login_required
 def income_add(request):
     """إضافة إيراد جديد"""
-    # إنشاء رقم مستند جديد
-    last_income = Income.objects.order_by('-id').first()
-    new_number = f"INC-{1:04d}" if not last_income else f"INC-{int(last_income.number.split('-')[1]) + 1:04d}"
-
     if request.method == 'POST':
         form = IncomeForm(request.POST)
         if form.is_valid():
             with transaction.atomic():
                 income = form.save(commit=False)
                 # دائماً قم بتعيين رقم مستند جديد
-                income.number = new_number
+                income.number = sequences.allocate('income', branch_id=income.safe.branch_id, date=income.date)
                 income.save()
                 messages.success(request, 'تم إضافة الإيراد بنجاح')
                 return redirect('income_list')
@@ -1,19 +1,23 @@
+from decimal import Decimal
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.db import transaction
-from django.db.models import Q, Sum
+from django.db.models import Q, Sum, OuterRef, Subquery, Value, DecimalField
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
-from ..models import ProductTransaction
+from ..models import ProductTransaction, StockBalance
 from ..forms import ProductTransactionForm
 from core.models import Store
+from core.pagination import keyset_paginate, get_querystring
 from products.models import Product, ProductUnit, Category
 
 @login_required
 def product_transaction_list(request):
     """عرض قائمة حركات المنتجات"""
-    transactions = ProductTransaction.objects.all().order_by('-date')
+    transactions = ProductTransaction.objects.all().order_by('-date', '-id')
 
     # تصفية حسب المنتج
     product_id = request.GET.get('product')
@@ -64,8 +68,13 @@ def product_transaction_list(request):
     products = Product.objects.all()
     stores = Store.objects.all()
 
+    # ترقيم بالمؤشر على (التاريخ، المعرف) مع الاحتفاظ بالفلاتر الحالية
+    page = keyset_paginate(request, transactions.select_related('product', 'product_unit__unit'))
+
     return render(request, 'finances/product_transaction/list.html', {
-        'transactions': transactions,
+        'transactions': page,
+        'page_obj': page,
+        'page_querystring': get_querystring(request),
         'products': products,
         'stores': stores,
         'transaction_types': ProductTransaction.TRANSACTION_TYPE_CHOICES,
@@ -301,26 +310,17 @@ def product_inventory(request):
             Q(barcode__icontains=search_query)
         )
 
-    # الحصول على حركات المنتجات حسب المخزن إذا تم تحديده
-    product_movements = {}
+    # رصيد كل منتج في المخزن المحدد من جدول أرصدة المخازن في نفس الاستعلام
     if store_id:
-        for product in products:
-            # الحصول على آخر حركة للمنتج في المخزن المحدد
-            last_movement = ProductTransaction.objects.filter(
-                product=product,
-                store_id=store_id
-            ).order_by('-date').first()
-
-            if last_movement:
-                product_movements[product.id] = {
-                    'store_balance': last_movement.balance_after,
-                    'last_movement_date': last_movement.date
-                }
-            else:
-                product_movements[product.id] = {
-                    'store_balance': 0,
-                    'last_movement_date': None
-                }
+        products = products.annotate(
+            store_balance=Coalesce(
+                Subquery(
+                    StockBalance.objects.filter(product=OuterRef('pk'), store_id=store_id).values('quantity')[:1]
+                ),
+                Value(Decimal('0')),
+                output_field=DecimalField(max_digits=15, decimal_places=3),
+            )
+        )
 
     # قوائم للتصفية
     categories = Category.objects.all()
@@ -332,6 +332,5 @@ def product_inventory(request):
         'stores': stores,
         'selected_category': category_id,
         'selected_store': store_id,
-        'search_query': search_query,
-        'product_movements': product_movements
+        'search_query': search_query
     })
@@ -3,10 +3,21 @@ from django.contrib.auth.decorators import login_required
 from django.db.models import Q, Sum
 from django.utils import timezone
 from datetime import datetime, timedelta
+from decimal import Decimal
 
-from ...models import SafeTransaction
+from ... import ledger
+from ...models import SafeTransaction, BalanceCheckpoint
 from core.models import Safe
 
+
+def get_previous_balance(safe, from_date):
+    """رصيد الخزنة (أو مجموع أرصدة جميع الخزن) قبل التاريخ من أقرب رصيد إقفال"""
+    safes = [safe] if safe else Safe.objects.all()
+    return sum(
+        (BalanceCheckpoint.get_opening_balance(ledger.SAFE, item, from_date) for item in safes),
+        Decimal('0')
+    )
+
 @login_required
 def financial_transactions_report(request):
     """تقرير الحركات المالية"""
@@ -52,35 +63,22 @@ def financial_transactions_report(request):
     transactions = SafeTransaction.objects.filter(
         date__gte=from_date_obj,
         date__lte=to_date_obj
-    ).order_by('date')
+    ).order_by('date', 'id')
 
     # تصفية حسب الخزنة
     if safe:
         transactions = transactions.filter(safe=safe)
 
-    # الحصول على الرصيد السابق
-    previous_transactions = SafeTransaction.objects.filter(date__lt=from_date_obj)
-    if safe:
-        previous_transactions = previous_transactions.filter(safe=safe)
-
-    # حساب الإيرادات والمصروفات السابقة
-    previous_in = previous_transactions.filter(
-        transaction_type__in=['deposit', 'income', 'receipt', 'sale_invoice', 'purchase_return_invoice']
-    ).aggregate(Sum('amount'))['amount__sum'] or 0
-
-    previous_out = previous_transactions.filter(
-        transaction_type__in=['withdrawal', 'expense', 'payment', 'purchase_invoice', 'sale_return_invoice']
-    ).aggregate(Sum('amount'))['amount__sum'] or 0
-
-    previous_balance = previous_in - previous_out
+    # الحصول على الرصيد السابق من أقرب رصيد إقفال
+    previous_balance = get_previous_balance(safe, from_date_obj)
 
     # حساب الإيرادات والمصروفات الحالية
     current_in = transactions.filter(
-        transaction_type__in=['deposit', 'income', 'receipt', 'sale_invoice', 'purchase_return_invoice']
+        transaction_type__in=SafeTransaction.INCREASING_TYPES
     ).aggregate(Sum('amount'))['amount__sum'] or 0
 
     current_out = transactions.filter(
-        transaction_type__in=['withdrawal', 'expense', 'payment', 'purchase_invoice', 'sale_return_invoice']
+        transaction_type__in=SafeTransaction.DECREASING_TYPES
     ).aggregate(Sum('amount'))['amount__sum'] or 0
 
     # حساب صافي الحركة والرصيد النهائي
@@ -90,18 +88,8 @@ def financial_transactions_report(request):
     # الحصول على الرصيد الحالي للخزنة
     current_safe_balance = None
     if safe:
-        # حساب الرصيد الحالي للخزنة
-        safe_in = SafeTransaction.objects.filter(
-            safe=safe,
-            transaction_type__in=['deposit', 'income', 'receipt', 'sale_invoice', 'purchase_return_invoice']
-        ).aggregate(Sum('amount'))['amount__sum'] or 0
-
-        safe_out = SafeTransaction.objects.filter(
-            safe=safe,
-            transaction_type__in=['withdrawal', 'expense', 'payment', 'purchase_invoice', 'sale_return_invoice']
-        ).aggregate(Sum('amount'))['amount__sum'] or 0
-
-        current_safe_balance = safe.initial_balance + safe_in - safe_out
+        # الرصيد الحالي للخزنة محدث مع كل حركة
+        current_safe_balance = safe.current_balance
 
     # إعداد قائمة الحركات مع الرصيد المتراكم
     transactions_with_balance = []
@@ -109,7 +97,7 @@ def financial_transactions_report(request):
 
     for transaction in transactions:
         # حساب الرصيد المتراكم بناءً على نوع العملية
-        if transaction.transaction_type in ['deposit', 'income', 'receipt', 'sale_invoice', 'purchase_return_invoice']:
+        if transaction.transaction_type in SafeTransaction.INCREASING_TYPES:
             # عمليات تزيد الرصيد
             running_balance += transaction.amount
         else:
@@ -206,35 +194,22 @@ def financial_transactions_print(request):
     transactions = SafeTransaction.objects.filter(
         date__gte=from_date_obj,
         date__lte=to_date_obj
-    ).order_by('date')
+    ).order_by('date', 'id')
 
     # تصفية حسب الخزنة
     if safe:
         transactions = transactions.filter(safe=safe)
 
-    # الحصول على الرصيد السابق
-    previous_transactions = SafeTransaction.objects.filter(date__lt=from_date_obj)
-    if safe:
-        previous_transactions = previous_transactions.filter(safe=safe)
-
-    # حساب الإيرادات والمصروفات السابقة
-    previous_in = previous_transactions.filter(
-        transaction_type__in=['deposit', 'income', 'receipt', 'sale_invoice', 'purchase_return_invoice']
-    ).aggregate(Sum('amount'))['amount__sum'] or 0
-
-    previous_out = previous_transactions.filter(
-        transaction_type__in=['withdrawal', 'expense', 'payment', 'purchase_invoice', 'sale_return_invoice']
-    ).aggregate(Sum('amount'))['amount__sum'] or 0
-
-    previous_balance = previous_in - previous_out
+    # الحصول على الرصيد السابق من أقرب رصيد إقفال
+    previous_balance = get_previous_balance(safe, from_date_obj)
 
     # حساب الإيرادات والمصروفات الحالية
     current_in = transactions.filter(
-        transaction_type__in=['deposit', 'income', 'receipt', 'sale_invoice', 'purchase_return_invoice']
+        transaction_type__in=SafeTransaction.INCREASING_TYPES
     ).aggregate(Sum('amount'))['amount__sum'] or 0
 
     current_out = transactions.filter(
-        transaction_type__in=['withdrawal', 'expense', 'payment', 'purchase_invoice', 'sale_return_invoice']
+        transaction_type__in=SafeTransaction.DECREASING_TYPES
     ).aggregate(Sum('amount'))['amount__sum'] or 0
 
     # حساب صافي الحركة والرصيد النهائي
@@ -247,7 +222,7 @@ def financial_transactions_print(request):
 
     for transaction in transactions:
         # حساب الرصيد المتراكم بناءً على نوع العملية
-        if transaction.transaction_type in ['deposit', 'income', 'receipt', 'sale_invoice', 'purchase_return_invoice']:
+        if transaction.transaction_type in SafeTransaction.INCREASING_TYPES:
             # عمليات تزيد الرصيد
             running_balance += transaction.amount
         else:
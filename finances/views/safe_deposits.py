@@ -8,6 +8,7 @@ from django.utils import timezone
 from ..models import SafeDeposit
 from ..forms import SafeDepositForm
 from core.models import Safe
+from core import sequences
 
 @login_required
 def safe_deposit_list(request):
@@ -50,17 +51,13 @@ def safe_deposit_list(request):
 @login_required
 def safe_deposit_add(request):
     """إضافة إيداع جديد في الخزنة"""
-    # إنشاء رقم مستند جديد
-    last_deposit = SafeDeposit.objects.order_by('-id').first()
-    new_number = f"DEP-{1:04d}" if not last_deposit else f"DEP-{int(last_deposit.number.split('-')[1]) + 1:04d}"
-
     if request.method == 'POST':
         form = SafeDepositForm(request.POST)
         if form.is_valid():
             with transaction.atomic():
                 deposit = form.save(commit=False)
                 # دائماً قم بتعيين رقم مستند جديد
-                deposit.number = new_number
+                deposit.number = sequences.allocate('safe_deposit', branch_id=deposit.safe.branch_id, date=deposit.date)
                 deposit.save()
                 messages.success(request, 'تم إضافة الإيداع بنجاح')
                 return redirect('safe_deposit_list')
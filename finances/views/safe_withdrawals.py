@@ -8,6 +8,7 @@ from django.utils import timezone
 from ..models import SafeWithdrawal
 from ..forms import SafeWithdrawalForm
 from core.models import Safe
+from core import sequences
 
 @login_required
 def safe_withdrawal_list(request):
@@ -50,17 +51,13 @@ def safe_withdrawal_list(request):
 @login_required
 def safe_withdrawal_add(request):
     """إضافة سحب جديد من الخزنة"""
-    # إنشاء رقم مستند جديد
-    last_withdrawal = SafeWithdrawal.objects.order_by('-id').first()
-    new_number = f"WDR-{1:04d}" if not last_withdrawal else f"WDR-{int(last_withdrawal.number.split('-')[1]) + 1:04d}"
-
     if request.method == 'POST':
         form = SafeWithdrawalForm(request.POST)
         if form.is_valid():
             with transaction.atomic():
                 withdrawal = form.save(commit=False)
                 # دائماً قم بتعيين رقم مستند جديد
-                withdrawal.number = new_number
+                withdrawal.number = sequences.allocate('safe_withdrawal', branch_id=withdrawal.safe.branch_id, date=withdrawal.date)
                 withdrawal.save()
                 messages.success(request, 'تم إضافة السحب بنجاح')
                 return redirect('safe_withdrawal_list')
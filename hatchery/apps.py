@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class HatcheryConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "hatchery"
+
+    def ready(self):
+        import hatchery.signals
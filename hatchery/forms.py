@@ -143,19 +143,30 @@ class DisinfectantCategoryForm(forms.ModelForm):
 
 
 class DisinfectantInventoryForm(forms.ModelForm):
+    # المخزون يتم تحديثه من الحركات فقط، والرصيد الافتتاحي عند الإضافة يتم تسجيله كحركة استلام
+    opening_stock = forms.DecimalField(
+        max_digits=10, decimal_places=2, min_value=0, required=False, label="الرصيد الافتتاحي",
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'})
+    )
+
     class Meta:
         model = DisinfectantInventory
-        fields = ['category', 'name', 'supplier', 'unit', 'current_stock', 'minimum_stock', 'notes']
+        fields = ['category', 'name', 'supplier', 'unit', 'minimum_stock', 'notes']
         widgets = {
             'category': forms.Select(attrs={'class': 'form-select'}),
             'name': forms.TextInput(attrs={'class': 'form-control'}),
             'supplier': forms.TextInput(attrs={'class': 'form-control'}),
             'unit': forms.TextInput(attrs={'class': 'form-control'}),
-            'current_stock': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
             'minimum_stock': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
             'notes': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # بعد الإضافة يتم تعديل المخزون من حركات الاستلام والصرف
+        if self.instance.pk:
+            del self.fields['opening_stock']
+
 
 class DisinfectantTransactionForm(forms.ModelForm):
     class Meta:
@@ -190,8 +201,12 @@ class DisinfectantTransactionForm(forms.ModelForm):
 
         if disinfectant and transaction_type == 'dispense' and quantity:
             # التحقق من أن كمية الصرف لا تتجاوز المخزون الحالي
-            if quantity > disinfectant.current_stock:
-                self.add_error('quantity', f'الكمية المتاحة للصرف هي {disinfectant.current_stock} {disinfectant.unit} فقط.')
+            available = disinfectant.current_stock
+            # عند التعديل على نفس المطهر يتم استبعاد أثر الحركة القديمة لأنه سيتم عكسه عند الحفظ
+            if self.instance.pk and self.instance.disinfectant_id == disinfectant.pk:
+                available -= DisinfectantTransaction.calculate_effect(self.instance.transaction_type, self.instance.quantity)
+            if quantity > available:
+                self.add_error('quantity', f'الكمية المتاحة للصرف هي {available} {disinfectant.unit} فقط.')
 
         return cleaned_data
 
@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hatchery.models import BatchDailyKPI
+
+
+class Command(BaseCommand):
+    help = 'إعادة بناء المؤشرات اليومية للمعمل من الدفعات الواردة والتسكين والخروج والتوزيعات ومبيعات الفرزة'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date-from', help='إعادة بناء المؤشرات من هذا التاريخ فقط (YYYY-MM-DD)')
+        parser.add_argument('--date-to', help='إعادة بناء المؤشرات حتى هذا التاريخ فقط (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        if not options['date_from'] and not options['date_to']:
+            BatchDailyKPI.rebuild()
+            self.stdout.write(self.style.SUCCESS(f'تم إعادة بناء {BatchDailyKPI.objects.count()} سجل مؤشرات.'))
+            return
+
+        if not options['date_from'] or not options['date_to']:
+            raise CommandError('يجب تحديد --date-from و --date-to معًا')
+        try:
+            date_from = datetime.strptime(options['date_from'], '%Y-%m-%d').date()
+            date_to = datetime.strptime(options['date_to'], '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError('صيغة التاريخ غير صحيحة، استخدم YYYY-MM-DD')
+        if date_from > date_to:
+            raise CommandError('تاريخ البداية بعد تاريخ النهاية')
+
+        dates = [date_from + timedelta(days=i) for i in range((date_to - date_from).days + 1)]
+        BatchDailyKPI.refresh(dates)
+        self.stdout.write(self.style.SUCCESS(
+            f'تم إعادة بناء مؤشرات {len(dates)} يوم '
+            f'({BatchDailyKPI.objects.filter(date__gte=date_from, date__lte=date_to).count()} سجل).'
+        ))
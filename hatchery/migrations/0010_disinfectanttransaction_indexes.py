@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-18 04:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hatchery', '0009_batchdistribution_is_merged_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='disinfectanttransaction',
+            index=models.Index(fields=['transaction_date', 'id'], name='disinfect_trans_date_idx'),
+        ),
+    ]
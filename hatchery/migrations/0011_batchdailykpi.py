@@ -0,0 +1,42 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hatchery', '0010_disinfectanttransaction_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchDailyKPI',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='التاريخ')),
+                ('entered_count', models.PositiveIntegerField(default=0, verbose_name='الوارد')),
+                ('incubated_count', models.PositiveIntegerField(default=0, verbose_name='المسكن')),
+                ('damaged_count', models.PositiveIntegerField(default=0, verbose_name='المعدم عند التسكين')),
+                ('hatched_eggs', models.PositiveIntegerField(default=0, verbose_name='البيض المسكن للدفعات الخارجة')),
+                ('fertile_eggs', models.PositiveIntegerField(default=0, verbose_name='البيض المخصب للدفعات الخارجة')),
+                ('fertility_total', models.DecimalField(decimal_places=2, default=0, max_digits=15, verbose_name='مجموع نسب الإخصاب المرجحة بعدد التسكين')),
+                ('chicks_count', models.PositiveIntegerField(default=0, verbose_name='الكتاكيت')),
+                ('culled_count', models.PositiveIntegerField(default=0, verbose_name='الفرزة')),
+                ('dead_count', models.PositiveIntegerField(default=0, verbose_name='الفاطس')),
+                ('distributed_count', models.PositiveIntegerField(default=0, verbose_name='الكتاكيت الموزعة')),
+                ('distribution_amount', models.DecimalField(decimal_places=2, default=0, max_digits=15, verbose_name='قيمة التوزيعات')),
+                ('distribution_paid', models.DecimalField(decimal_places=2, default=0, max_digits=15, verbose_name='المحصل من التوزيعات')),
+                ('culled_sold_count', models.PositiveIntegerField(default=0, verbose_name='الفرزة المباعة')),
+                ('culled_sales_amount', models.DecimalField(decimal_places=2, default=0, max_digits=15, verbose_name='قيمة مبيعات الفرزة')),
+                ('batch_name', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_kpis', to='hatchery.batchname', verbose_name='اسم الدفعة')),
+            ],
+            options={
+                'verbose_name': 'مؤشرات يومية',
+                'verbose_name_plural': 'المؤشرات اليومية',
+                'ordering': ['date'],
+                'unique_together': {('date', 'batch_name')},
+            },
+        ),
+    ]
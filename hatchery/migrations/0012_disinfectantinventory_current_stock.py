@@ -0,0 +1,49 @@
+# Generated by Django 5.2.1 on 2026-10-18 05:27
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+
+def record_opening_stock(apps, schema_editor):
+    """
+    تسجيل الفرق بين المخزون الحالي للمطهر ومجموع حركاته كحركة رصيد افتتاحي (أو تسوية إذا كان الفرق بالسالب)،
+    لأن المخزون كان يتم إدخاله يدويًا من شاشة المطهر (لا يتم تعديل المخزون نفسه)
+    """
+    DisinfectantInventory = apps.get_model('hatchery', 'DisinfectantInventory')
+    DisinfectantTransaction = apps.get_model('hatchery', 'DisinfectantTransaction')
+
+    inventory_items = DisinfectantInventory.objects.annotate(
+        received=Sum('transactions__quantity', filter=Q(transactions__transaction_type='receive')),
+        dispensed=Sum('transactions__quantity', filter=Q(transactions__transaction_type='dispense')),
+    )
+    opening_transactions = []
+    for inventory_item in inventory_items:
+        difference = inventory_item.current_stock - (inventory_item.received or Decimal('0')) + (inventory_item.dispensed or Decimal('0'))
+        if difference:
+            opening_transactions.append(DisinfectantTransaction(
+                disinfectant_id=inventory_item.pk,
+                transaction_type='receive' if difference > 0 else 'dispense',
+                transaction_date=timezone.localdate(inventory_item.created_at),
+                quantity=abs(difference),
+                notes='رصيد افتتاحي' if difference > 0 else 'تسوية المخزون',
+            ))
+    DisinfectantTransaction.objects.bulk_create(opening_transactions)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hatchery', '0011_batchdailykpi'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='disinfectantinventory',
+            name='current_stock',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='المخزون الحالي'),
+        ),
+        migrations.RunPython(record_opening_stock, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,9 @@
 from django.db import models
 from django.utils import timezone
 from datetime import timedelta
+from decimal import Decimal
+
+from core.stock import StoredStockMixin, StockMovementMixin
 
 # Create your models here.
 
@@ -229,7 +232,7 @@ class DisinfectantCategory(models.Model):
         return self.name
 
 
-class DisinfectantInventory(models.Model):
+class DisinfectantInventory(StoredStockMixin, models.Model):
     """نموذج لمخزون المطهرات"""
 
     category = models.ForeignKey(
@@ -241,7 +244,10 @@ class DisinfectantInventory(models.Model):
     name = models.CharField(max_length=100, verbose_name="اسم المطهر")
     supplier = models.CharField(max_length=100, blank=True, null=True, verbose_name="المورد")
     unit = models.CharField(max_length=50, verbose_name="وحدة القياس")
-    current_stock = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name="المخزون الحالي")
+    # المخزون = الاستلام - الصرف (بما فيه الرصيد الافتتاحي)، ويتم تحديثه من الحركات فقط
+    current_stock = models.DecimalField(
+        max_digits=10, decimal_places=2, default=0, editable=False, verbose_name="المخزون الحالي"
+    )
     minimum_stock = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name="الحد الأدنى للمخزون")
     notes = models.TextField(blank=True, null=True, verbose_name="ملاحظات")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاريخ الإنشاء")
@@ -261,7 +267,7 @@ class DisinfectantInventory(models.Model):
         return self.current_stock <= self.minimum_stock
 
 
-class DisinfectantTransaction(models.Model):
+class DisinfectantTransaction(StockMovementMixin, models.Model):
     """نموذج لحركات المطهرات (استلام أو صرف)"""
 
     TRANSACTION_TYPES = (
@@ -269,6 +275,10 @@ class DisinfectantTransaction(models.Model):
         ('dispense', 'صرف'),
     )
 
+    # أثر الحركة على المخزون يعتمد على نوعها وكميتها
+    STOCK_ITEM_FIELD = 'disinfectant'
+    STOCK_EFFECT_FIELDS = ('transaction_type', 'quantity')
+
     disinfectant = models.ForeignKey(
         DisinfectantInventory,
         on_delete=models.PROTECT,
@@ -286,20 +296,69 @@ class DisinfectantTransaction(models.Model):
         verbose_name = "حركة مطهر"
         verbose_name_plural = "حركات المطهرات"
         ordering = ['-transaction_date', '-created_at']
+        indexes = [
+            # قائمة حركات المطهرات مقسمة إلى صفحات بالمؤشر على (-transaction_date, -id)
+            models.Index(fields=['transaction_date', 'id'], name='disinfect_trans_date_idx'),
+        ]
 
     def __str__(self):
         transaction_type_display = dict(self.TRANSACTION_TYPES)[self.transaction_type]
         return f"{self.disinfectant} - {transaction_type_display} - {self.transaction_date}"
 
-    def save(self, *args, **kwargs):
-        # تحديث المخزون الحالي للمطهر
-        if self.transaction_type == 'receive':
-            self.disinfectant.current_stock += self.quantity
-        else:  # صرف
-            self.disinfectant.current_stock -= self.quantity
-
-        self.disinfectant.save()
-        super().save(*args, **kwargs)
+    @staticmethod
+    def calculate_effect(transaction_type, quantity):
+        """أثر الحركة على مخزون المطهر: الاستلام يزيده والصرف ينقصه"""
+        return quantity if transaction_type == 'receive' else -quantity
+
+    @classmethod
+    def calculate_stock_effect(cls, values):
+        return cls.calculate_effect(values['transaction_type'], values['quantity'])
+
+
+class BatchDistributionQuerySet(models.QuerySet):
+    """استعلامات توزيعات الدفعات"""
+
+    def with_totals(self):
+        """
+        إضافة إجماليات التوزيع لكل صف في نفس الاستعلام (استعلامات فرعية)
+        مع جلب أسماء الدفعات، لعرض قوائم التوزيعات بعدد ثابت من الاستعلامات
+        """
+        from django.db.models import Case, OuterRef, Prefetch, Subquery, Sum, Value, When
+        from django.db.models.functions import Coalesce
+
+        items = BatchDistributionItem.objects.filter(
+            distribution=OuterRef('pk')
+        ).order_by().values('distribution')
+        merged = MergedBatchDistribution.objects.filter(
+            distribution=OuterRef('pk')
+        ).order_by().values('distribution')
+
+        return self.select_related(
+            'hatching__incubation__batch_entry__batch_name'
+        ).prefetch_related(
+            Prefetch(
+                'merged_hatchings',
+                queryset=BatchHatching.objects.select_related('incubation__batch_entry__batch_name')
+            )
+        ).annotate(
+            distributed_count_total=Coalesce(
+                Subquery(items.annotate(total=Sum('chicks_count')).values('total')),
+                0
+            ),
+            paid_amount_total=Coalesce(
+                Subquery(items.annotate(total=Sum('paid_amount')).values('total')),
+                Value(Decimal('0')),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2)
+            ),
+            available_chicks_total=Case(
+                When(is_merged=True, then=Coalesce(
+                    Subquery(merged.annotate(total=Sum('hatching__chicks_count')).values('total')),
+                    0
+                )),
+                default=Coalesce('hatching__chicks_count', 0),
+                output_field=models.IntegerField()
+            ),
+        )
 
 
 class BatchDistribution(models.Model):
@@ -330,6 +389,8 @@ class BatchDistribution(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاريخ الإنشاء")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="تاريخ التحديث")
 
+    objects = BatchDistributionQuerySet.as_manager()
+
     class Meta:
         verbose_name = "توزيع دفعة"
         verbose_name_plural = "توزيعات الدفعات"
@@ -347,16 +408,23 @@ class BatchDistribution(models.Model):
     @property
     def total_distributed_count(self):
         """حساب إجمالي عدد الكتاكيت الموزعة"""
+        if hasattr(self, 'distributed_count_total'):
+            return self.distributed_count_total
         return sum(item.chicks_count for item in self.distribution_items.all())
 
     @property
     def total_paid_amount(self):
         """حساب إجمالي المبلغ المدفوع"""
+        if hasattr(self, 'paid_amount_total'):
+            # بعض قواعد البيانات (SQLite) لا تحافظ على الخانات العشرية في المجاميع
+            return Decimal(self.paid_amount_total).quantize(Decimal('0.01'))
         return sum(item.paid_amount for item in self.distribution_items.all())
 
     @property
     def total_available_chicks(self):
         """حساب إجمالي الكتاكيت المتاحة للتوزيع"""
+        if hasattr(self, 'available_chicks_total'):
+            return self.available_chicks_total
         if self.is_merged:
             return sum(h.chicks_count for h in self.merged_hatchings.all())
         elif self.hatching:
@@ -444,3 +512,159 @@ class BatchDistributionItem(models.Model):
     def remaining_amount(self):
         """حساب المبلغ المتبقي"""
         return self.total_amount - self.paid_amount
+
+
+class BatchDailyKPI(models.Model):
+    """
+    مؤشرات أداء المعمل المجمعة لكل (يوم، اسم دفعة)
+
+    يتم حسابها من الدفعات الواردة والتسكين والخروج والتوزيعات ومبيعات الفرزة، وتحديثها تلقائيًا
+    للأيام المتأثرة عند إضافة أو تعديل أو حذف أي منها (hatchery/signals.py)، ويمكن إعادة بنائها
+    بالكامل بأمر rebuild_hatchery_kpis. تقارير الفترات تقرأ من هذا الجدول بدلًا من السجلات الأصلية.
+    التوزيعات المدمجة (من أكثر من دفعة) تسجل بدون اسم دفعة.
+    """
+
+    date = models.DateField(verbose_name="التاريخ")
+    batch_name = models.ForeignKey(
+        BatchName,
+        on_delete=models.CASCADE,
+        related_name='daily_kpis',
+        verbose_name="اسم الدفعة",
+        null=True,
+        blank=True
+    )
+    entered_count = models.PositiveIntegerField(default=0, verbose_name="الوارد")
+    incubated_count = models.PositiveIntegerField(default=0, verbose_name="المسكن")
+    damaged_count = models.PositiveIntegerField(default=0, verbose_name="المعدم عند التسكين")
+    hatched_eggs = models.PositiveIntegerField(default=0, verbose_name="البيض المسكن للدفعات الخارجة")
+    fertile_eggs = models.PositiveIntegerField(default=0, verbose_name="البيض المخصب للدفعات الخارجة")
+    fertility_total = models.DecimalField(
+        max_digits=15, decimal_places=2, default=0,
+        verbose_name="مجموع نسب الإخصاب المرجحة بعدد التسكين"
+    )
+    chicks_count = models.PositiveIntegerField(default=0, verbose_name="الكتاكيت")
+    culled_count = models.PositiveIntegerField(default=0, verbose_name="الفرزة")
+    dead_count = models.PositiveIntegerField(default=0, verbose_name="الفاطس")
+    distributed_count = models.PositiveIntegerField(default=0, verbose_name="الكتاكيت الموزعة")
+    distribution_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0, verbose_name="قيمة التوزيعات")
+    distribution_paid = models.DecimalField(max_digits=15, decimal_places=2, default=0, verbose_name="المحصل من التوزيعات")
+    culled_sold_count = models.PositiveIntegerField(default=0, verbose_name="الفرزة المباعة")
+    culled_sales_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0, verbose_name="قيمة مبيعات الفرزة")
+
+    class Meta:
+        verbose_name = "مؤشرات يومية"
+        verbose_name_plural = "المؤشرات اليومية"
+        ordering = ['date']
+        unique_together = ['date', 'batch_name']  # يعمل أيضًا كفهرس لتقارير الفترات
+
+    # الحقول التي يتم جمعها في تقارير الفترات
+    TOTAL_FIELDS = [
+        'entered_count', 'incubated_count', 'damaged_count', 'hatched_eggs', 'fertile_eggs', 'fertility_total',
+        'chicks_count', 'culled_count', 'dead_count', 'distributed_count', 'distribution_amount',
+        'distribution_paid', 'culled_sold_count', 'culled_sales_amount',
+    ]
+
+    PERIODS = ('day', 'week', 'month')
+
+    def __str__(self):
+        return f"{self.batch_name or 'توزيع مدمج'} - {self.date}"
+
+    @staticmethod
+    def compute(dates=None):
+        """
+        حساب المؤشرات من السجلات الأصلية لأيام محددة (أو لكل الأيام) باستعلام مجمع واحد لكل مصدر
+
+        يرجع قائمة BatchDailyKPI غير محفوظة، صف لكل (يوم، اسم دفعة) له بيانات
+        """
+        from django.db.models import DecimalField, F, Sum
+
+        amount = DecimalField(max_digits=15, decimal_places=2)
+        batch = 'batch_entry__batch_name'
+        hatching_batch = f'incubation__{batch}'
+        kpis = {}
+
+        def collect(queryset, date_field, batch_field, **totals):
+            if dates is not None:
+                queryset = queryset.filter(**{f'{date_field}__in': dates})
+            rows = queryset.order_by().values(day=F(date_field), batch=F(batch_field)).annotate(**totals)
+            for row in rows:
+                kpi = kpis.get((row['day'], row['batch']))
+                if kpi is None:
+                    kpi = kpis[(row['day'], row['batch'])] = BatchDailyKPI(date=row['day'], batch_name_id=row['batch'])
+                for field in totals:
+                    setattr(kpi, field, row[field] or 0)
+
+        collect(BatchEntry.objects.all(), 'date', 'batch_name', entered_count=Sum('quantity'))
+        collect(BatchIncubation.objects.all(), 'incubation_date', batch,
+                incubated_count=Sum('incubation_quantity'), damaged_count=Sum('damaged_quantity'))
+        collect(BatchHatching.objects.all(), 'hatch_date', hatching_batch,
+                hatched_eggs=Sum('incubation__incubation_quantity'),
+                fertile_eggs=Sum(F('incubation__incubation_quantity') - F('incubation__damaged_quantity')),
+                fertility_total=Sum(F('fertility_rate') * F('incubation__incubation_quantity'), output_field=amount),
+                chicks_count=Sum('chicks_count'), culled_count=Sum('culled_count'), dead_count=Sum('dead_count'))
+        collect(BatchDistributionItem.objects.all(), 'distribution__distribution_date', f'distribution__hatching__{hatching_batch}',
+                distributed_count=Sum('chicks_count'),
+                distribution_amount=Sum(F('chicks_count') * F('price_per_unit'), output_field=amount),
+                distribution_paid=Sum('paid_amount'))
+        collect(CulledSale.objects.all(), 'invoice_date', f'hatching__{hatching_batch}',
+                culled_sold_count=Sum('quantity'),
+                culled_sales_amount=Sum(F('quantity') * F('price_per_unit'), output_field=amount))
+
+        return list(kpis.values())
+
+    @staticmethod
+    def refresh(dates):
+        """إعادة حساب مؤشرات أيام محددة"""
+        from django.db import transaction
+
+        dates = sorted(set(dates))
+        if not dates:
+            return
+        with transaction.atomic():
+            BatchDailyKPI.objects.filter(date__in=dates).delete()
+            BatchDailyKPI.objects.bulk_create(BatchDailyKPI.compute(dates), batch_size=500)
+
+    @staticmethod
+    def rebuild():
+        """إعادة بناء جميع المؤشرات من السجلات الأصلية"""
+        from django.db import transaction
+
+        with transaction.atomic():
+            BatchDailyKPI.objects.all().delete()
+            BatchDailyKPI.objects.bulk_create(BatchDailyKPI.compute(), batch_size=500)
+
+    @staticmethod
+    def get_trend(date_from, date_to, period='day', batch_name=None):
+        """
+        مؤشرات الفترة مجمعة حسب اليوم أو الأسبوع أو الشهر باستعلام واحد
+
+        يرجع قائمة قواميس مرتبة بالفترة تحتوي الإجماليات والنسب المحسوبة منها
+        """
+        from django.db.models import Sum
+        from django.db.models.functions import TruncMonth, TruncWeek
+
+        kpis = BatchDailyKPI.objects.filter(date__gte=date_from, date__lte=date_to)
+        if batch_name is not None:
+            kpis = kpis.filter(batch_name=batch_name)
+
+        if period == 'week':
+            period_expression = TruncWeek('date')
+        elif period == 'month':
+            period_expression = TruncMonth('date')
+        else:
+            period_expression = models.F('date')
+
+        rows = kpis.order_by().values(period=period_expression).annotate(
+            **{field: Sum(field) for field in BatchDailyKPI.TOTAL_FIELDS}
+        ).order_by('period')
+
+        trend = []
+        for row in rows:
+            hatched_eggs = row['hatched_eggs'] or 0
+            fertile_eggs = row['fertile_eggs'] or 0
+            row['fertility_rate'] = round(row['fertility_total'] / hatched_eggs, 2) if hatched_eggs else None
+            row['hatch_rate'] = round(Decimal(row['chicks_count'] * 100) / fertile_eggs, 2) if fertile_eggs else None
+            row['wasted_count'] = fertile_eggs - row['chicks_count'] - row['culled_count'] - row['dead_count']
+            row['revenue'] = row['distribution_amount'] + row['culled_sales_amount']
+            trend.append(row)
+        return trend
@@ -0,0 +1,97 @@
+"""
+بيانات التقرير اليومي للمعمل
+
+يتم تجميع كل أقسام التقرير بعدد ثابت وصغير من الاستعلامات مهما كان عدد السجلات:
+جلب الصفوف مع العلاقات المعروضة (select_related / prefetch_related)، وحساب الإجماليات
+في قاعدة البيانات بـ Sum و F بدلًا من المرور على الصفوف واستدعاء الخصائص لكل صف.
+نفس البيانات تستخدم في العرض والطباعة وتصدير Excel.
+"""
+from django.db.models import F, Prefetch, Sum
+
+from .models import (
+    BatchEntry, BatchIncubation, BatchHatching, BatchDistribution, BatchDistributionItem,
+    CulledSale, DisinfectantTransaction,
+)
+
+# سلسلة العلاقات اللازمة لعرض اسم الدفعة من دفعة الخروج
+HATCHING_BATCH_NAME = 'incubation__batch_entry__batch_name'
+
+
+def build_daily_report(report_date, show_created_today=True):
+    """
+    بيانات التقرير اليومي (سياق القوالب وتصدير Excel)
+
+    show_created_today: عرض الدفعات الواردة التي تم تسجيلها في يوم التقرير بدلًا من التي تاريخ دخولها يوم التقرير
+    """
+    # الدفعات الواردة
+    if show_created_today:
+        entries = BatchEntry.objects.filter(created_at__date=report_date)
+    else:
+        entries = BatchEntry.objects.filter(date=report_date)
+    entries = entries.select_related('batch_name').order_by('-date')
+
+    # الدفعات التي تم تسكينها
+    incubations = BatchIncubation.objects.filter(
+        incubation_date=report_date
+    ).select_related('batch_entry__batch_name').order_by('-incubation_date')
+
+    # الدفعات التي خرجت
+    hatchings = BatchHatching.objects.filter(
+        hatch_date=report_date
+    ).select_related(HATCHING_BATCH_NAME).order_by('-hatch_date')
+
+    # توزيعات الدفعات مع العملاء والدفعات المدمجة
+    distributions = BatchDistribution.objects.filter(
+        distribution_date=report_date
+    ).select_related(f'hatching__{HATCHING_BATCH_NAME}').prefetch_related(
+        Prefetch('distribution_items', queryset=BatchDistributionItem.objects.select_related('customer')),
+        Prefetch('merged_hatchings', queryset=BatchHatching.objects.select_related(HATCHING_BATCH_NAME)),
+    ).order_by('-distribution_date')
+
+    # حركات المطهرات (الوارد والمنصرف من نفس الاستعلام)
+    disinfectant_transactions = list(DisinfectantTransaction.objects.filter(
+        transaction_date=report_date
+    ).select_related('disinfectant__category').order_by('-transaction_date'))
+
+    # مبيعات الكتاكيت الفرزة
+    culled_sales = CulledSale.objects.filter(
+        invoice_date=report_date
+    ).select_related('customer', f'hatching__{HATCHING_BATCH_NAME}').order_by('-invoice_date')
+
+    # الإجماليات في قاعدة البيانات
+    hatchings_totals = hatchings.order_by().aggregate(
+        total_chicks=Sum('chicks_count'),
+        total_culled=Sum('culled_count'),
+        total_dead=Sum('dead_count'),
+        # المعدم = المسكن - الفاقد عند التسكين - (الكتاكيت + الفرزة + الفاطس)
+        total_wasted=Sum(
+            F('incubation__incubation_quantity') - F('incubation__damaged_quantity')
+            - F('chicks_count') - F('culled_count') - F('dead_count')
+        ),
+    )
+    distribution_totals = BatchDistributionItem.objects.filter(
+        distribution__distribution_date=report_date
+    ).aggregate(count=Sum('chicks_count'), paid=Sum('paid_amount'))
+    culled_sales_totals = culled_sales.order_by().aggregate(count=Sum('quantity'), paid=Sum('paid_amount'))
+
+    hatchings_totals['total_wasted'] = hatchings_totals['total_wasted'] or 0
+    total_culled_sales_paid = culled_sales_totals['paid'] or 0
+
+    return {
+        'report_date': report_date,
+        'today_entries': list(entries),
+        'today_incubations': list(incubations),
+        'today_hatchings': list(hatchings),
+        'today_distributions': list(distributions),
+        'today_received_disinfectants': [t for t in disinfectant_transactions if t.transaction_type == 'receive'],
+        'today_dispensed_disinfectants': [t for t in disinfectant_transactions if t.transaction_type == 'dispense'],
+        'today_culled_sales': list(culled_sales),
+        'total_entries_count': entries.order_by().aggregate(total=Sum('quantity'))['total'] or 0,
+        'total_incubations_count': incubations.order_by().aggregate(total=Sum('incubation_quantity'))['total'] or 0,
+        'total_hatchings_count': hatchings_totals,
+        'total_distributed_count': distribution_totals['count'] or 0,
+        'total_distributions_amount': distribution_totals['paid'] or 0,
+        'total_culled_sales_count': culled_sales_totals['count'] or 0,
+        'total_culled_sales_amount': total_culled_sales_paid,
+        'total_culled_sales_paid': total_culled_sales_paid,
+    }
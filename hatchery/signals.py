@@ -0,0 +1,122 @@
+"""
+تحديث المؤشرات اليومية (BatchDailyKPI) عند تغيير بيانات المعمل
+
+يتم تجميع الأيام المتأثرة طوال المعاملة وإعادة حساب مؤشراتها مرة واحدة بعد تأكيدها،
+مع الأيام القديمة عند تغيير التاريخ أو الدفعة. تعديل الدفعة الواردة أو التسكين أو الخروج
+ينقل السجلات التالية لها إلى دفعة أخرى، لذلك تدخل أيامها أيضًا.
+"""
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import (
+    BatchEntry, BatchIncubation, BatchHatching, BatchDistribution, BatchDistributionItem,
+    CulledSale, BatchDailyKPI,
+)
+
+
+def _hatchings_dates(hatchings):
+    """أيام الخروج والتوزيع وبيع الفرزة لمجموعة دفعات خروج"""
+    dates = set(hatchings.values_list('hatch_date', flat=True))
+    dates.update(BatchDistribution.objects.filter(hatching__in=hatchings).values_list('distribution_date', flat=True))
+    dates.update(CulledSale.objects.filter(hatching__in=hatchings).values_list('invoice_date', flat=True))
+    return dates
+
+
+def get_affected_dates(instance, with_dependents=True):
+    """أيام المؤشرات التي يؤثر عليها السجل (مع أيام السجلات التالية له إذا تغيرت دفعته)"""
+    if isinstance(instance, BatchEntry):
+        dates = {instance.date}
+        if with_dependents:
+            dates.update(instance.incubations.values_list('incubation_date', flat=True))
+            dates.update(_hatchings_dates(BatchHatching.objects.filter(incubation__batch_entry=instance)))
+        return dates
+    if isinstance(instance, BatchIncubation):
+        dates = {instance.incubation_date}
+        if with_dependents:
+            dates.update(_hatchings_dates(BatchHatching.objects.filter(incubation=instance)))
+        return dates
+    if isinstance(instance, BatchHatching):
+        dates = {instance.hatch_date}
+        if with_dependents:
+            dates.update(_hatchings_dates(BatchHatching.objects.filter(pk=instance.pk)))
+        return dates
+    if isinstance(instance, BatchDistribution):
+        return {instance.distribution_date}
+    if isinstance(instance, BatchDistributionItem):
+        return set(BatchDistribution.objects.filter(pk=instance.distribution_id).values_list('distribution_date', flat=True))
+    if isinstance(instance, CulledSale):
+        return {instance.invoice_date}
+    return set()
+
+
+class _PendingRefresh:
+    """الأيام المتأثرة في المعاملة الحالية، ويتم استدعاؤها مرة واحدة بعد تأكيد المعاملة"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.dates = set()
+
+    def __call__(self):
+        self.connection.hatchery_kpi_pending = None
+        BatchDailyKPI.refresh(self.dates)
+
+
+def schedule_refresh(dates):
+    """إعادة حساب مؤشرات الأيام بعد تأكيد المعاملة الحالية (أو فورًا خارج المعاملات)"""
+    dates = {date for date in dates if date}
+    if not dates:
+        return
+
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        BatchDailyKPI.refresh(dates)
+        return
+
+    # دالة واحدة لكل معاملة، وإذا تم التراجع عن الجزء الذي سجلها يتم تسجيل دالة جديدة
+    pending = getattr(connection, 'hatchery_kpi_pending', None)
+    if pending is None or not any(entry[1] is pending for entry in connection.run_on_commit):
+        pending = _PendingRefresh(connection)
+        connection.hatchery_kpi_pending = pending
+        transaction.on_commit(pending)
+    pending.dates.update(dates)
+
+
+@receiver(pre_save, sender=BatchEntry)
+@receiver(pre_save, sender=BatchIncubation)
+@receiver(pre_save, sender=BatchHatching)
+@receiver(pre_save, sender=BatchDistribution)
+@receiver(pre_save, sender=BatchDistributionItem)
+@receiver(pre_save, sender=CulledSale)
+def remember_kpi_dates(sender, instance, raw=False, **kwargs):
+    """حفظ الأيام المتأثرة قبل التعديل لإعادة حسابها بعد نقل السجل إلى يوم أو دفعة أخرى"""
+    if raw or not instance.pk:
+        return
+    previous = sender.objects.filter(pk=instance.pk).first()
+    instance._kpi_previous_dates = get_affected_dates(previous) if previous else set()
+
+
+@receiver(post_save, sender=BatchEntry)
+@receiver(post_save, sender=BatchIncubation)
+@receiver(post_save, sender=BatchHatching)
+@receiver(post_save, sender=BatchDistribution)
+@receiver(post_save, sender=BatchDistributionItem)
+@receiver(post_save, sender=CulledSale)
+def handle_kpi_source_save(sender, instance, created, raw=False, **kwargs):
+    """تحديث مؤشرات الأيام المتأثرة بإضافة أو تعديل سجل"""
+    if raw:
+        return
+    dates = get_affected_dates(instance, with_dependents=not created)
+    dates.update(getattr(instance, '_kpi_previous_dates', ()))
+    schedule_refresh(dates)
+
+
+@receiver(post_delete, sender=BatchEntry)
+@receiver(post_delete, sender=BatchIncubation)
+@receiver(post_delete, sender=BatchHatching)
+@receiver(post_delete, sender=BatchDistribution)
+@receiver(post_delete, sender=BatchDistributionItem)
+@receiver(post_delete, sender=CulledSale)
+def handle_kpi_source_delete(sender, instance, **kwargs):
+    """تحديث مؤشرات يوم السجل المحذوف (السجلات التالية له تحذف معه وترسل إشاراتها)"""
+    schedule_refresh(get_affected_dates(instance, with_dependents=False))
@@ -87,6 +87,7 @@ urlpatterns = [
 
     # Reports URLs
     path('reports/daily/', views.daily_report, name='daily_report'),
+    path('reports/kpi/', views.kpi_report, name='kpi_report'),
     path('reports/', views.reports_home, name='reports'),
     path('settings/print/', views.print_settings, name='print_settings'),
 
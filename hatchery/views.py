@@ -2,11 +2,15 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
-from django.db.models import Sum, Q, F
+from django.db import transaction
+from django.db.models import Sum, Q, F, Prefetch
 from django.http import HttpResponse, JsonResponse
 from django.template.loader import render_to_string
 
+from core.pagination import paginate, keyset_paginate, get_querystring
+
 import io
+from datetime import timedelta
 import xlsxwriter
 
 # لا نحتاج إلى استيراد pdfmetrics و TTFont لأننا نستخدم الخطوط المدمجة
@@ -14,7 +18,7 @@ from .models import (
     BatchName, BatchEntry, BatchIncubation, BatchHatching,
     Customer, CulledSale, DisinfectantCategory, DisinfectantInventory,
     DisinfectantTransaction, BatchDistribution, BatchDistributionItem,
-    MergedBatchDistribution
+    MergedBatchDistribution, BatchDailyKPI
 )
 from .forms import (
     BatchNameForm, BatchEntryForm, BatchIncubationForm, BatchHatchingForm,
@@ -24,6 +28,7 @@ from .forms import (
     MergedBatchDistributionForm, MergedBatchDistributionItemFormSet,
     PrintSettingsForm
 )
+from .reports import build_daily_report
 import json
 
 @login_required
@@ -113,7 +118,7 @@ def batch_name_delete(request, pk):
 @login_required
 def batch_list(request):
     """عرض قائمة الدفعات الواردة"""
-    batches = BatchEntry.objects.all().order_by('-date')
+    batches = BatchEntry.objects.all().order_by('-date', '-id')
 
     # البحث
     search_query = request.GET.get('q')
@@ -162,8 +167,12 @@ def batch_list(request):
             'to_date': to_date
         })
 
+    page = paginate(request, batches.select_related('batch_name'))
+
     return render(request, 'hatchery/batch_list.html', {
-        'batches': batches,
+        'batches': page,
+        'page_obj': page,
+        'page_querystring': get_querystring(request),
         'batch_filters': batch_filters,
         'search_query': search_query,
         'from_date': from_date,
@@ -578,7 +587,7 @@ def customer_delete(request, pk):
 @login_required
 def culled_sale_list(request):
     """عرض قائمة مبيعات الفرزة"""
-    sales = CulledSale.objects.all().order_by('-invoice_date')
+    sales = CulledSale.objects.all().order_by('-invoice_date', '-id')
 
     # البحث
     search_query = request.GET.get('q')
@@ -667,8 +676,12 @@ def culled_sale_list(request):
             'to_date': to_date
         })
 
+    page = paginate(request, sales.select_related('customer', 'hatching__incubation__batch_entry__batch_name'))
+
     return render(request, 'hatchery/culled_sale_list.html', {
-        'sales': sales,
+        'sales': page,
+        'page_obj': page,
+        'page_querystring': get_querystring(request),
         'available_hatchings': available_hatchings,
         'sale_filters': sale_filters,
         'search_query': search_query,
@@ -860,7 +873,16 @@ def disinfectant_inventory_create(request):
     if request.method == 'POST':
         form = DisinfectantInventoryForm(request.POST)
         if form.is_valid():
-            form.save()
+            with transaction.atomic():
+                inventory_item = form.save()
+                opening_stock = form.cleaned_data.get('opening_stock')
+                if opening_stock:
+                    DisinfectantTransaction.objects.create(
+                        disinfectant=inventory_item,
+                        transaction_type='receive',
+                        quantity=opening_stock,
+                        notes='رصيد افتتاحي'
+                    )
             messages.success(request, 'تم إضافة المطهر للمخزون بنجاح')
             return redirect('hatchery:disinfectant_inventory_list')
     else:
@@ -915,7 +937,7 @@ def disinfectant_inventory_delete(request, pk):
 @login_required
 def disinfectant_transaction_list(request):
     """عرض قائمة حركات المطهرات"""
-    transactions = DisinfectantTransaction.objects.all().order_by('-transaction_date')
+    transactions = DisinfectantTransaction.objects.all().order_by('-transaction_date', '-id')
 
     # البحث
     search_query = request.GET.get('q')
@@ -996,8 +1018,13 @@ def disinfectant_transaction_list(request):
     elif export_type == 'pdf':
         return export_disinfectant_transaction_pdf(transactions)
 
+    # ترقيم بالمؤشر على (تاريخ الحركة، المعرف)، أما الطباعة والتصدير فتشمل كل الحركات المصفاة
+    page = keyset_paginate(request, transactions.select_related('disinfectant__category'), date_field='transaction_date')
+
     return render(request, 'hatchery/disinfectant_transaction_list.html', {
-        'transactions': transactions,
+        'transactions': page,
+        'page_obj': page,
+        'page_querystring': get_querystring(request),
         'transaction_filters': transaction_filters,
         'search_query': search_query,
         'from_date': from_date,
@@ -1044,30 +1071,11 @@ def disinfectant_transaction_update(request, pk):
     """تحديث بيانات حركة مطهر"""
     transaction = get_object_or_404(DisinfectantTransaction, pk=pk)
 
-    # حفظ القيم القديمة للحركة
-    old_quantity = transaction.quantity
-    old_transaction_type = transaction.transaction_type
-
     if request.method == 'POST':
         form = DisinfectantTransactionForm(request.POST, instance=transaction)
         if form.is_valid():
-            # إلغاء تأثير الحركة القديمة على المخزون
-            if old_transaction_type == 'receive':
-                transaction.disinfectant.current_stock -= old_quantity
-            else:  # صرف
-                transaction.disinfectant.current_stock += old_quantity
-
-            # حفظ الحركة الجديدة
-            transaction = form.save(commit=False)
-
-            # تطبيق تأثير الحركة الجديدة على المخزون
-            if transaction.transaction_type == 'receive':
-                transaction.disinfectant.current_stock += transaction.quantity
-            else:  # صرف
-                transaction.disinfectant.current_stock -= transaction.quantity
-
-            transaction.disinfectant.save()
-            transaction.save()
+            # يتم تعديل المخزون بفرق الحركة عند الحفظ
+            transaction = form.save()
 
             messages.success(request, 'تم تحديث بيانات حركة المطهر بنجاح')
             return redirect('hatchery:disinfectant_transaction_detail', pk=pk)
@@ -1083,13 +1091,7 @@ def disinfectant_transaction_delete(request, pk):
 
     if request.method == 'POST':
         try:
-            # إلغاء تأثير الحركة على المخزون
-            if transaction.transaction_type == 'receive':
-                transaction.disinfectant.current_stock -= transaction.quantity
-            else:  # صرف
-                transaction.disinfectant.current_stock += transaction.quantity
-
-            transaction.disinfectant.save()
+            # يتم إلغاء تأثير الحركة على المخزون عند الحذف
             transaction.delete()
 
             messages.success(request, 'تم حذف حركة المطهر بنجاح')
@@ -1105,7 +1107,8 @@ def disinfectant_transaction_delete(request, pk):
 @login_required
 def distribution_list(request):
     """عرض قائمة توزيعات الدفعات"""
-    distributions = BatchDistribution.objects.all().order_by('-distribution_date')
+    # الإجماليات وأسماء الدفعات محسوبة في الاستعلام نفسه بدلًا من استعلامات لكل توزيع
+    distributions = BatchDistribution.objects.with_totals().order_by('-distribution_date', '-id')
 
     # البحث
     search_query = request.GET.get('q')
@@ -1165,7 +1168,10 @@ def distribution_list(request):
     # التحقق من نوع الطلب (عرض عادي أو تصدير)
     export_type = request.GET.get('export')
     if export_type == 'print':
-        # الحصول على عناصر التوزيع لكل توزيع
+        # الحصول على عناصر التوزيع لكل التوزيعات في استعلام واحد
+        distributions = distributions.prefetch_related(
+            Prefetch('distribution_items', queryset=BatchDistributionItem.objects.select_related('customer'))
+        )
         for distribution in distributions:
             distribution.items = distribution.distribution_items.all()
 
@@ -1177,8 +1183,12 @@ def distribution_list(request):
             'to_date': to_date
         })
 
+    page = paginate(request, distributions)
+
     return render(request, 'hatchery/distribution_list.html', {
-        'distributions': distributions,
+        'distributions': page,
+        'page_obj': page,
+        'page_querystring': get_querystring(request),
         'today_hatchings': today_hatchings,
         'distribution_filters': distribution_filters,
         'search_query': search_query,
@@ -1357,99 +1367,8 @@ def daily_report(request):
     settings = get_print_settings(request)
     show_created_today = settings['show_created_today'] == '1'
 
-    # الدفعات الواردة المسجلة اليوم
-    if show_created_today:
-        # عرض الدفعات التي تم تسجيلها اليوم بغض النظر عن تاريخ الدخول
-        today_entries = BatchEntry.objects.filter(
-            created_at__date=report_date
-        ).order_by('-date')
-    else:
-        # عرض الدفعات التي تاريخ دخولها هو اليوم فقط
-        today_entries = BatchEntry.objects.filter(
-            date=report_date
-        ).order_by('-date')
-
-    # الدفعات التي تم تسكينها اليوم
-    today_incubations = BatchIncubation.objects.filter(
-        incubation_date=report_date
-    ).order_by('-incubation_date')
-
-    # الدفعات التي خرجت اليوم
-    today_hatchings = BatchHatching.objects.filter(
-        hatch_date=report_date
-    ).order_by('-hatch_date')
-
-    # توزيعات الدفعات اليوم
-    today_distributions = BatchDistribution.objects.filter(
-        distribution_date=report_date
-    ).order_by('-distribution_date')
-
-    # المطهرات الواردة اليوم
-    today_received_disinfectants = DisinfectantTransaction.objects.filter(
-        transaction_date=report_date,
-        transaction_type='receive'
-    ).order_by('-transaction_date')
-
-    # المطهرات المنصرفة اليوم
-    today_dispensed_disinfectants = DisinfectantTransaction.objects.filter(
-        transaction_date=report_date,
-        transaction_type='dispense'
-    ).order_by('-transaction_date')
-
-    # مبيعات الكتاكيت الفرزة اليوم
-    today_culled_sales = CulledSale.objects.filter(
-        invoice_date=report_date
-    ).order_by('-invoice_date')
-
-    # إحصائيات إضافية
-
-    # إجمالي عدد الكتاكيت الواردة اليوم
-    total_entries_count = today_entries.aggregate(total=Sum('quantity'))['total'] or 0
-
-    # إجمالي عدد الكتاكيت المسكنة اليوم
-    total_incubations_count = today_incubations.aggregate(total=Sum('incubation_quantity'))['total'] or 0
-
-    # إجمالي عدد الكتاكيت الخارجة اليوم
-    total_hatchings_count = today_hatchings.aggregate(
-        total_chicks=Sum('chicks_count'),
-        total_culled=Sum('culled_count'),
-        total_dead=Sum('dead_count')
-    )
-
-    # حساب إجمالي المعدم (wasted_count هو خاصية وليس حقلاً)
-    total_wasted = sum(hatching.wasted_count for hatching in today_hatchings)
-    if total_hatchings_count:
-        total_hatchings_count['total_wasted'] = total_wasted
-
-    # إجمالي عدد الكتاكيت الموزعة اليوم
-    total_distributed_count = sum(d.total_distributed_count for d in today_distributions)
-
-    # إجمالي عدد الكتاكيت الفرزة المباعة اليوم
-    total_culled_sales_count = today_culled_sales.aggregate(total=Sum('quantity'))['total'] or 0
-
-    # إجمالي المبالغ المحصلة من مبيعات الفرزة اليوم
-    total_culled_sales_amount = today_culled_sales.aggregate(total=Sum('paid_amount'))['total'] or 0
-
-    # إجمالي المبالغ المحصلة من توزيعات الدفعات اليوم
-    total_distributions_amount = sum(d.total_paid_amount for d in today_distributions)
-
-    context = {
-        'report_date': report_date,
-        'today_entries': today_entries,
-        'today_incubations': today_incubations,
-        'today_hatchings': today_hatchings,
-        'today_distributions': today_distributions,
-        'today_received_disinfectants': today_received_disinfectants,
-        'today_dispensed_disinfectants': today_dispensed_disinfectants,
-        'today_culled_sales': today_culled_sales,
-        'total_entries_count': total_entries_count,
-        'total_incubations_count': total_incubations_count,
-        'total_hatchings_count': total_hatchings_count,
-        'total_distributed_count': total_distributed_count,
-        'total_culled_sales_count': total_culled_sales_count,
-        'total_culled_sales_amount': total_culled_sales_amount,
-        'total_distributions_amount': total_distributions_amount,
-    }
+    # جميع أقسام التقرير وإجمالياته (مشتركة بين العرض والطباعة والتصدير)
+    context = build_daily_report(report_date, show_created_today)
 
     # التحقق من نوع الطلب (عرض عادي أو تصدير)
     export_type = request.GET.get('export')
@@ -1462,21 +1381,60 @@ def daily_report(request):
         context['current_datetime'] = timezone.now()
 
         # إضافة إعدادات الطباعة إلى السياق
-        settings = get_print_settings(request)
-        context['show_created_today'] = settings['show_created_today'] == '1'
+        context['show_created_today'] = show_created_today
         context['show_price_in_distribution'] = settings['show_price_in_distribution'] == '1'
         context['show_distribution_notes'] = settings['show_distribution_notes'] == '1'
         context['show_price_in_culled_sales'] = settings['show_price_in_culled_sales'] == '1'
         context['hide_empty_sections'] = settings['hide_empty_sections'] == '1'
 
-        # حساب إجمالي المبلغ المدفوع من مبيعات الفرزة
-        context['total_culled_sales_paid'] = today_culled_sales.aggregate(total=Sum('paid_amount'))['total'] or 0
-
         return render(request, 'hatchery/daily_report_print.html', context)
 
     return render(request, 'hatchery/daily_report.html', context)
 
 
+
+@login_required
+def kpi_report(request):
+    """تقرير مؤشرات المعمل لفترة (يومي أو أسبوعي أو شهري) من جدول المؤشرات المجمعة"""
+    today = timezone.now().date()
+    try:
+        date_to = timezone.datetime.strptime(request.GET.get('date_to', ''), '%Y-%m-%d').date()
+    except ValueError:
+        date_to = today
+    try:
+        date_from = timezone.datetime.strptime(request.GET.get('date_from', ''), '%Y-%m-%d').date()
+    except ValueError:
+        date_from = date_to - timedelta(days=29)
+
+    period = request.GET.get('period', 'day')
+    if period not in BatchDailyKPI.PERIODS:
+        period = 'day'
+
+    # تجاهل قيمة الدفعة غير الصحيحة وعرض كل الدفعات
+    batch_name = None
+    batch_name_id = request.GET.get('batch_name', '')
+    if batch_name_id.isdecimal():
+        batch_name = BatchName.objects.filter(pk=int(batch_name_id)).first()
+
+    trend = BatchDailyKPI.get_trend(date_from, date_to, period, batch_name)
+
+    # إجماليات الفترة كلها من صفوف التقرير
+    totals = {
+        field: sum(row[field] or 0 for row in trend)
+        for field in ['entered_count', 'incubated_count', 'chicks_count', 'culled_count', 'dead_count',
+                      'wasted_count', 'distributed_count', 'culled_sold_count', 'revenue']
+    }
+
+    return render(request, 'hatchery/kpi_report.html', {
+        'trend': trend,
+        'totals': totals,
+        'date_from': date_from,
+        'date_to': date_to,
+        'period': period,
+        'batch_name': batch_name,
+        'batch_names': BatchName.objects.all(),
+    })
+
 def export_daily_report_excel(context, request=None):
     """تصدير التقرير اليومي بصيغة Excel"""
     # استرجاع إعدادات الطباعة
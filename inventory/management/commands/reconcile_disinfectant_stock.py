@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from inventory.models import Disinfectant
+
+
+class Command(BaseCommand):
+    help = 'مطابقة رصيد المطهرات المخزن مع حركات الوارد والصرف وتصحيح الفروق'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='عرض الفروق فقط بدون تصحيحها')
+
+    def handle(self, *args, **options):
+        mismatches = Disinfectant.reconcile(fix=not options['dry_run'])
+
+        for disinfectant, stored, actual in mismatches:
+            self.stdout.write(f'{disinfectant}: الرصيد المسجل {stored} - الرصيد الصحيح {actual}')
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('أرصدة جميع المطهرات مطابقة للحركات.'))
+        elif options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'يوجد فرق في رصيد {len(mismatches)} مطهر.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'تم تصحيح رصيد {len(mismatches)} مطهر.'))
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.1 on 2026-10-18 05:04
+
+from django.db import migrations, models
+
+
+def build_current_stock(apps, schema_editor):
+    """
+    حساب رصيد المطهرات الموجودة من حركات الوارد والصرف
+    """
+    Disinfectant = apps.get_model('inventory', 'Disinfectant')
+    DisinfectantReceived = apps.get_model('inventory', 'DisinfectantReceived')
+    DisinfectantIssued = apps.get_model('inventory', 'DisinfectantIssued')
+
+    stocks = {}
+    for row in DisinfectantReceived.objects.order_by().values('disinfectant_id').annotate(total=models.Sum('quantity')):
+        stocks[row['disinfectant_id']] = stocks.get(row['disinfectant_id'], 0) + row['total']
+    for row in DisinfectantIssued.objects.order_by().values('disinfectant_id').annotate(total=models.Sum('quantity')):
+        stocks[row['disinfectant_id']] = stocks.get(row['disinfectant_id'], 0) - row['total']
+
+    for disinfectant_id, stock in stocks.items():
+        Disinfectant.objects.filter(pk=disinfectant_id).update(current_stock=stock)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='disinfectant',
+            name='current_stock',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='الرصيد الحالي'),
+        ),
+        migrations.RunPython(build_current_stock, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,10 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
-from django.db.models import Sum, F
+from django.db.models import Sum, F, Q
 from django.core.exceptions import ValidationError
 
+from core.stock import StoredStockMixin, StockMovementMixin
+
 # Create your models here.
 
 class Supplier(models.Model):
@@ -42,7 +44,7 @@ class DisinfectantCategory(models.Model):
         return self.name
 
 
-class Disinfectant(models.Model):
+class Disinfectant(StoredStockMixin, models.Model):
     """نموذج لتسجيل بيانات المطهرات"""
 
     name = models.CharField(max_length=255, verbose_name="اسم المطهر")
@@ -59,6 +61,14 @@ class Disinfectant(models.Model):
         default=0,
         verbose_name="الحد الأدنى للمخزون"
     )
+    # الرصيد = الوارد - المنصرف، ويتم تحديثه مع كل إضافة أو تعديل أو حذف لحركة وارد أو صرف
+    current_stock = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=0,
+        editable=False,
+        verbose_name="الرصيد الحالي"
+    )
     description = models.TextField(blank=True, null=True, verbose_name="وصف المطهر")
     is_active = models.BooleanField(default=True, verbose_name="نشط")
     notes = models.TextField(blank=True, null=True, verbose_name="ملاحظات")
@@ -73,12 +83,54 @@ class Disinfectant(models.Model):
     def __str__(self):
         return self.name
 
-    @property
-    def current_stock(self):
-        """حساب الرصيد الحالي للمطهر"""
-        received = self.received_items.aggregate(total=Sum('quantity'))['total'] or 0
-        issued = self.issued_items.aggregate(total=Sum('quantity'))['total'] or 0
-        return received - issued
+    @staticmethod
+    def get_low_stock():
+        """المطهرات النشطة منخفضة المخزون أو التي نفذت (استعلام واحد على الرصيد المخزن)"""
+        return Disinfectant.objects.filter(is_active=True).filter(
+            Q(current_stock__lte=0) | Q(current_stock__lt=F('minimum_stock'))
+        )
+
+    @staticmethod
+    def calculate_stocks(disinfectant_ids=None):
+        """
+        حساب أرصدة المطهرات من حركات الوارد والصرف
+
+        يرجع: {disinfectant_id: الرصيد}
+        """
+        received = DisinfectantReceived.objects.all()
+        issued = DisinfectantIssued.objects.all()
+        if disinfectant_ids is not None:
+            received = received.filter(disinfectant_id__in=disinfectant_ids)
+            issued = issued.filter(disinfectant_id__in=disinfectant_ids)
+
+        stocks = {}
+        for disinfectant_id, total in received.order_by().values('disinfectant_id').annotate(
+            total=Sum('quantity')
+        ).values_list('disinfectant_id', 'total'):
+            stocks[disinfectant_id] = stocks.get(disinfectant_id, 0) + total
+        for disinfectant_id, total in issued.order_by().values('disinfectant_id').annotate(
+            total=Sum('quantity')
+        ).values_list('disinfectant_id', 'total'):
+            stocks[disinfectant_id] = stocks.get(disinfectant_id, 0) - total
+        return stocks
+
+    @staticmethod
+    def reconcile(fix=True):
+        """
+        مقارنة الرصيد المخزن لكل مطهر بالرصيد المحسوب من الحركات وتصحيح الفروق
+
+        يرجع قائمة الفروق: [(المطهر، الرصيد المخزن، الرصيد الصحيح)]
+        """
+        stocks = Disinfectant.calculate_stocks()
+        mismatches = []
+        with transaction.atomic():
+            for disinfectant in Disinfectant.objects.select_for_update().order_by('pk'):
+                actual = stocks.get(disinfectant.pk, 0)
+                if disinfectant.current_stock != actual:
+                    mismatches.append((disinfectant, disinfectant.current_stock, actual))
+                    if fix:
+                        Disinfectant.objects.filter(pk=disinfectant.pk).update(current_stock=actual)
+        return mismatches
 
     @property
     def stock_status(self):
@@ -92,7 +144,27 @@ class Disinfectant(models.Model):
             return "طبيعي"
 
 
-class DisinfectantReceived(models.Model):
+class DisinfectantMovement(StockMovementMixin, models.Model):
+    """
+    حركة على رصيد مطهر (وارد أو صرف)
+
+    يتم تعديل رصيد المطهر بأثر الحركة في نفس المعاملة عند الإضافة أو التعديل أو الحذف (StockMovementMixin).
+    """
+
+    STOCK_ITEM_FIELD = 'disinfectant'
+
+    # أثر الحركة على الرصيد: 1 للوارد و -1 للصرف
+    STOCK_SIGN = 1
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def calculate_stock_effect(cls, values):
+        return cls.STOCK_SIGN * values['quantity']
+
+
+class DisinfectantReceived(DisinfectantMovement):
     """نموذج لتسجيل المطهرات الواردة من الشركات الموردة"""
 
     disinfectant = models.ForeignKey(
@@ -130,9 +202,11 @@ class DisinfectantReceived(models.Model):
         return self.quantity * self.unit_price
 
 
-class DisinfectantIssued(models.Model):
+class DisinfectantIssued(DisinfectantMovement):
     """نموذج لتسجيل المطهرات المنصرفة للمعمل"""
 
+    STOCK_SIGN = -1
+
     disinfectant = models.ForeignKey(
         Disinfectant,
         on_delete=models.PROTECT,
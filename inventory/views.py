@@ -17,10 +17,7 @@ def home(request):
     categories_count = DisinfectantCategory.objects.count()
 
     # المطهرات منخفضة المخزون
-    low_stock_disinfectants = []
-    for disinfectant in Disinfectant.objects.filter(is_active=True):
-        if disinfectant.stock_status in ["منخفض", "نفذ"]:
-            low_stock_disinfectants.append(disinfectant)
+    low_stock_disinfectants = Disinfectant.get_low_stock()
 
     context = {
         'disinfectants_count': disinfectants_count,
@@ -4,6 +4,9 @@ from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
 from django.http import HttpResponseRedirect
 from django.contrib import messages
+from django.utils import timezone
+from core import sequences
+from core.models import SystemSettings
 from .models import Invoice, InvoiceItem, Payment
 
 class InvoiceItemInline(admin.TabularInline):
@@ -27,26 +30,19 @@ class InvoiceAdmin(admin.ModelAdmin):
         """تعديل النموذج لإضافة رقم فاتورة تلقائي"""
         form = super().get_form(request, obj, **kwargs)
         if obj is None:  # فقط عند إنشاء فاتورة جديدة
-            # إنشاء رقم فاتورة جديد
-            last_invoice = Invoice.objects.order_by('-id').first()
-            if not last_invoice:
-                new_number = "1"  # أول فاتورة في النظام
-            else:
-                # استخراج الرقم من آخر فاتورة
-                try:
-                    if '-' in last_invoice.number:
-                        last_number = int(last_invoice.number.split('-')[1])
-                    else:
-                        last_number = int(last_invoice.number)
-                    new_number = str(last_number + 1)  # زيادة الرقم بمقدار 1
-                except (ValueError, IndexError):
-                    # في حالة حدوث خطأ في تحليل الرقم، استخدم الرقم 1
-                    new_number = "1"
-
-            # تعيين القيمة الافتراضية لحقل رقم الفاتورة
-            form.base_fields['number'].initial = new_number
+            # تعيين الرقم المقترح كقيمة افتراضية لحقل رقم الفاتورة (يتم حجزه عند الحفظ)
+            default_store = SystemSettings.get_settings().default_store
+            form.base_fields['number'].initial = sequences.preview(
+                'invoice', branch_id=default_store.branch_id if default_store else None, date=timezone.localdate()
+            )
         return form
 
+    def save_model(self, request, obj, form, change):
+        """حجز رقم الفاتورة الجديدة من عداد الترقيم"""
+        if not change:
+            obj.number = sequences.claim('invoice', obj.number, branch_id=obj.store.branch_id, date=obj.date)
+        super().save_model(request, obj, form, change)
+
     def get_readonly_fields(self, request, obj=None):
         """جعل بعض الحقول للقراءة فقط بناءً على حالة الكائن"""
         readonly_fields = list(self.readonly_fields)
@@ -124,10 +120,12 @@ class InvoiceAdmin(admin.ModelAdmin):
 
     def post_multiple_invoices(self, request, queryset):
         """ترحيل فواتير متعددة من خلال القائمة"""
-        posted_count = 0
-        for invoice in queryset:
-            if invoice.post_invoice():
-                posted_count += 1
+        try:
+            # ترحيل جميع الفواتير غير المرحلة دفعة واحدة
+            posted_count = len(Invoice.post_many(queryset.filter(is_posted=False)))
+        except Exception as e:
+            messages.error(request, f'حدث خطأ أثناء ترحيل الفواتير: {str(e)}')
+            return
 
         if posted_count:
             messages.success(request, f'تم ترحيل {posted_count} فاتورة بنجاح.')
@@ -179,26 +177,19 @@ class PaymentAdmin(admin.ModelAdmin):
         """تعديل النموذج لإضافة رقم مستند تلقائي"""
         form = super().get_form(request, obj, **kwargs)
         if obj is None:  # فقط عند إنشاء مستند جديد
-            # إنشاء رقم مستند جديد
-            last_payment = Payment.objects.order_by('-id').first()
-            if not last_payment:
-                new_number = "1"  # أول مستند في النظام
-            else:
-                # استخراج الرقم من آخر مستند
-                try:
-                    if '-' in last_payment.number:
-                        last_number = int(last_payment.number.split('-')[1])
-                    else:
-                        last_number = int(last_payment.number)
-                    new_number = str(last_number + 1)  # زيادة الرقم بمقدار 1
-                except (ValueError, IndexError):
-                    # في حالة حدوث خطأ في تحليل الرقم، استخدم الرقم 1
-                    new_number = "1"
-
-            # تعيين القيمة الافتراضية لحقل رقم المستند
-            form.base_fields['number'].initial = new_number
+            # تعيين الرقم المقترح كقيمة افتراضية لحقل رقم المستند (يتم حجزه عند الحفظ)
+            default_safe = SystemSettings.get_settings().default_safe
+            form.base_fields['number'].initial = sequences.preview(
+                'payment', branch_id=default_safe.branch_id if default_safe else None, date=timezone.localdate()
+            )
         return form
 
+    def save_model(self, request, obj, form, change):
+        """حجز رقم المستند الجديد من عداد الترقيم"""
+        if not change:
+            obj.number = sequences.claim('payment', obj.number, branch_id=obj.safe.branch_id, date=obj.date)
+        super().save_model(request, obj, form, change)
+
     def get_payment_type_colored(self, obj):
         """عرض نوع العملية بألوان مختلفة حسب النوع"""
         colors = {
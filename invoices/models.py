@@ -1,9 +1,15 @@
+import logging
+
 from django.db import models, transaction
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from core.models import Contact, Store, Safe, Representative, Driver
 from products.models import Product, ProductUnit
 from finances.models import SafeTransaction, ContactTransaction
+from finances import ledger
+from core import instrumentation
+
+logger = logging.getLogger(__name__)
 
 class Invoice(models.Model):
     SALE = 'sale'
@@ -52,6 +58,11 @@ class Invoice(models.Model):
     class Meta:
         verbose_name = _("فاتورة")
         verbose_name_plural = _("الفواتير")
+        indexes = [
+            # قوائم الفواتير مرتبة حسب (-date, -id) مع أو بدون التصفية حسب النوع
+            models.Index(fields=['date', 'id'], name='invoice_date_idx'),
+            models.Index(fields=['invoice_type', 'date'], name='invoice_type_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.get_invoice_type_display()} {self.number} - {self.contact.name}"
@@ -70,31 +81,17 @@ class Invoice(models.Model):
         is_new = self.pk is None
 
         # حفظ الفاتورة
-        print(f"حفظ الفاتورة {self.number} - جديدة: {is_new}, مرحلة: {self.is_posted}")
+        logger.debug("حفظ الفاتورة %s - جديدة: %s, مرحلة: %s", self.number, is_new, self.is_posted)
         super().save(*args, **kwargs)
 
         # إذا كانت الفاتورة جديدة ومرحلة، قم بإنشاء المعاملات المالية والمخزنية
+        # (الفاتورة الجديدة لا يمكن أن تكون لها معاملات سابقة فلا حاجة لاستعلامات التحقق)
         if is_new and self.is_posted:
-            print(f"الفاتورة {self.number} جديدة ومرحلة، جاري إنشاء المعاملات المالية والمخزنية...")
-            # التحقق من وجود معاملات مالية ومخزنية مرتبطة بالفاتورة
-            from finances.models import ContactTransaction, SafeTransaction, ProductTransaction
-
-            contact_transactions = ContactTransaction.objects.filter(invoice=self)
-            safe_transactions = SafeTransaction.objects.filter(invoice=self)
-            product_transactions = ProductTransaction.objects.filter(invoice=self)
-
-            if contact_transactions.count() == 0 and safe_transactions.count() == 0 and product_transactions.count() == 0:
-                print(f"لا توجد معاملات مالية ومخزنية مرتبطة بالفاتورة {self.number}، جاري إنشاؤها...")
-                try:
-                    self.create_related_transactions()
-                    print(f"تم إنشاء المعاملات المالية والمخزنية للفاتورة {self.number} بنجاح")
-                except Exception as e:
-                    print(f"خطأ في إنشاء المعاملات المالية والمخزنية للفاتورة {self.number}: {str(e)}")
-            else:
-                print(f"توجد معاملات مالية ومخزنية مرتبطة بالفاتورة {self.number} بالفعل")
-                print(f"عدد معاملات العملاء/الموردين: {contact_transactions.count()}")
-                print(f"عدد معاملات الخزنة: {safe_transactions.count()}")
-                print(f"عدد معاملات المخزون: {product_transactions.count()}")
+            logger.debug("الفاتورة %s جديدة ومرحلة، جاري إنشاء المعاملات المالية والمخزنية", self.number)
+            try:
+                self.create_related_transactions()
+            except Exception:
+                logger.exception("خطأ في إنشاء المعاملات المالية والمخزنية للفاتورة %s", self.number)
 
     def calculate_totals(self):
         """حساب إجماليات الفاتورة من بنودها"""
@@ -118,18 +115,87 @@ class Invoice(models.Model):
         else:
             self.remaining_amount = self.net_amount - self.paid_amount
 
-    @transaction.atomic
+    def get_stock_shortages(self):
+        """
+        بنود الفاتورة التي تتجاوز كميتها رصيد المنتج في مخزن الفاتورة
+        (للفواتير التي تنقص المخزون فقط)، بقراءة واحدة من جدول أرصدة المخازن
+        """
+        from finances.models import ProductTransaction, StockBalance
+
+        if self.invoice_type not in ProductTransaction.DECREASING_TYPES:
+            return []
+        return StockBalance.get_shortages(self.store_id, self.items.select_related('product', 'product_unit'))
+
+    @staticmethod
+    def get_ledger_accounts(invoices):
+        """حسابات (الخزن، جهات الاتصال، المنتجات) التي تؤثر عليها مجموعة فواتير، لقفلها قبل الترحيل"""
+        safes = [invoice.safe for invoice in invoices]
+        contacts = [invoice.contact for invoice in invoices]
+        products = [item.product for invoice in invoices for item in invoice.items.all()]
+        return safes, contacts, products
+
+    @staticmethod
+    def get_posted_ledger_accounts(invoice_ids):
+        """
+        حسابات الحركات الموجودة لمجموعة فواتير (قد تختلف عن حسابات الفواتير بعد تعديل الطرف أو الخزنة أو البنود)،
+        لقفلها مع حسابات الترحيل الجديد بالترتيب الثابت قبل حذف هذه الحركات
+        """
+        from core.models import Safe, Contact
+        from products.models import Product
+        from finances.models import ContactTransaction, SafeTransaction, ProductTransaction
+
+        safes = Safe.objects.filter(
+            pk__in=SafeTransaction.objects.filter(invoice_id__in=invoice_ids).values('safe_id')
+        ).only('id', 'current_balance')
+        contacts = Contact.objects.filter(
+            pk__in=ContactTransaction.objects.filter(invoice_id__in=invoice_ids).values('contact_id')
+        ).only('id', 'current_balance')
+        products = Product.objects.filter(
+            pk__in=ProductTransaction.objects.filter(invoice_id__in=invoice_ids).values('product_id')
+        ).only('id', 'current_balance')
+        return list(safes), list(contacts), list(products)
+
     def create_related_transactions(self):
-        """إنشاء المعاملات المالية والمخزنية المرتبطة بالفاتورة عند ترحيلها"""
+        """
+        إنشاء المعاملات المالية والمخزنية المرتبطة بالفاتورة عند ترحيلها
+        (إدراج جماعي داخل معاملة واحدة بعد قفل الحسابات المتأثرة، مع إعادة حساب أرصدة كل حساب متأثر مرة واحدة في النهاية)
+        """
+        from django.db.models import prefetch_related_objects
+
+        prefetch_related_objects([self], 'items__product', 'items__product_unit')
+        with ledger.posting(*Invoice.get_ledger_accounts([self])):
+            contact_rows, safe_rows, product_rows = self.build_related_transactions()
+            ledger.bulk_insert(contact_rows=contact_rows, safe_rows=safe_rows, product_rows=product_rows)
+
+        instrumentation.count('invoices_posted')
+        logger.debug(
+            "تم إنشاء المعاملات للفاتورة %s - العملاء/الموردين: %s، الخزنة: %s، المخزون: %s",
+            self.number, len(contact_rows), len(safe_rows), len(product_rows),
+        )
+
+        return contact_rows, safe_rows, product_rows
+
+    def build_related_transactions(self):
+        """
+        بناء المعاملات المالية والمخزنية للفاتورة في الذاكرة بدون حفظها
+        تعيد (حركات العميل/المورد، حركات الخزنة، حركات المنتجات)، والأرصدة فيها مبدئية
+        ويتم تصحيحها عند إعادة حساب أرصدة الحسابات بعد الإدراج
+        """
         # استيراد النماذج هنا لتجنب التبعيات الدائرية
         from finances.models import ContactTransaction, SafeTransaction, ProductTransaction
 
-        print(f"=== بدء إنشاء المعاملات المالية والمخزنية للفاتورة رقم {self.number} ===")
-        print(f"نوع الفاتورة: {self.invoice_type}")
-        print(f"نوع الدفع: {self.payment_type}")
-        print(f"المبلغ الصافي: {self.net_amount}")
-        print(f"المبلغ المدفوع: {self.paid_amount}")
-        print(f"المبلغ المتبقي: {self.remaining_amount}")
+        contact_rows = []
+        safe_rows = []
+        product_rows = []
+
+        # تفاصيل كل بند تُسجل فقط عند تفعيل مستوى DEBUG
+        debug = logger.isEnabledFor(logging.DEBUG)
+
+        logger.debug(
+            "بناء معاملات الفاتورة %s - النوع: %s، الدفع: %s، الصافي: %s، المدفوع: %s، المتبقي: %s",
+            self.number, self.invoice_type, self.payment_type,
+            self.net_amount, self.paid_amount, self.remaining_amount,
+        )
 
         # إنشاء حركة حساب العميل/المورد للفاتورة
         # في حالة الفاتورة النقدية أو الفاتورة الآجلة مع دفعة جزئية، نقوم بإنشاء حركتين: واحدة للفاتورة وواحدة للدفع
@@ -244,8 +310,7 @@ class Invoice(models.Model):
             elif self.invoice_type == self.PURCHASE_RETURN:
                 safe_transaction.transaction_type = SafeTransaction.PURCHASE_RETURN_INVOICE
 
-            safe_transaction.save()
-            print(f"تم إنشاء حركة خزنة بمبلغ {payment_amount} للفاتورة {self.number}")
+            safe_rows.append(safe_transaction)
 
             # 2. إنشاء حركة حساب العميل/المورد للدفع النقدي أو الجزئي
             if self.invoice_type in [self.SALE, self.PURCHASE_RETURN]:
@@ -265,8 +330,7 @@ class Invoice(models.Model):
                     balance_before=current_balance,  # تعيين الرصيد قبل العملية
                     balance_after=balance_after  # تعيين الرصيد بعد العملية
                 )
-                payment_transaction.save()
-                print(f"تم إنشاء حركة تحصيل من العميل بمبلغ {payment_amount} للفاتورة {self.number}")
+                contact_rows.append(payment_transaction)
             elif self.invoice_type in [self.PURCHASE, self.SALE_RETURN]:
                 # في حالة فاتورة الشراء أو مرتجع البيع، نضيف دفع للمورد
                 current_balance = self.contact.current_balance
@@ -284,20 +348,15 @@ class Invoice(models.Model):
                     balance_before=current_balance,  # تعيين الرصيد قبل العملية
                     balance_after=balance_after  # تعيين الرصيد بعد العملية
                 )
-                payment_transaction.save()
-                print(f"تم إنشاء حركة دفع للمورد بمبلغ {payment_amount} للفاتورة {self.number}")
+                contact_rows.append(payment_transaction)
 
-        # تُحفظ معاملة جهة الاتصال للفاتورة
-        contact_transaction.save()
+        # تُضاف معاملة جهة الاتصال للفاتورة
+        contact_rows.append(contact_transaction)
 
         # إنشاء حركات المنتجات
-        print(f"=== بدء إنشاء حركات المنتجات للفاتورة {self.number} ===")
         items = self.items.all()
-        print(f"عدد بنود الفاتورة: {items.count()}")
 
         for item in items:
-            print(f"معالجة بند الفاتورة: المنتج {item.product.name}, الكمية {item.quantity}, الوحدة {item.product_unit.unit.name}")
-
             # الحصول على الرصيد الحالي للمنتج
             if hasattr(item.product, 'current_balance'):
                 current_balance = item.product.current_balance
@@ -305,24 +364,24 @@ class Invoice(models.Model):
                 current_balance = item.product.initial_balance
                 setattr(item.product, 'current_balance', current_balance)
 
-            print(f"الرصيد الحالي للمنتج {item.product.name}: {current_balance}")
-
             # تحويل الكمية إلى الوحدة الأساسية
             base_quantity = item.quantity * item.product_unit.conversion_factor
-            print(f"الكمية بالوحدة الأساسية: {base_quantity} (معامل التحويل: {item.product_unit.conversion_factor})")
 
             # حساب الرصيد بعد العملية بناءً على نوع الفاتورة
             balance_after = current_balance
             if self.invoice_type in [self.SALE, self.SALE_RETURN]:
                 # عمليات تنقص المخزون
                 balance_after = current_balance - base_quantity
-                print(f"نوع الفاتورة {self.invoice_type} ينقص المخزون")
             else:
                 # عمليات تزيد المخزون
                 balance_after = current_balance + base_quantity
-                print(f"نوع الفاتورة {self.invoice_type} يزيد المخزون")
 
-            print(f"الرصيد بعد العملية: {balance_after}")
+            if debug:
+                logger.debug(
+                    "بند الفاتورة %s: المنتج %s، الكمية %s %s، الكمية الأساسية %s، الرصيد قبل/بعد %s/%s",
+                    self.number, item.product.name, item.quantity, item.product_unit.unit.name,
+                    base_quantity, current_balance, balance_after,
+                )
 
             try:
                 product_transaction = ProductTransaction(
@@ -349,145 +408,135 @@ class Invoice(models.Model):
                 elif self.invoice_type == self.PURCHASE_RETURN:
                     product_transaction.transaction_type = ProductTransaction.PURCHASE_RETURN
 
-                print(f"نوع حركة المنتج: {product_transaction.transaction_type}")
-
-                product_transaction.save()
-                print(f"تم حفظ حركة المنتج بنجاح (ID: {product_transaction.id})")
-            except Exception as e:
-                print(f"خطأ في إنشاء حركة المنتج: {str(e)}")
-                import traceback
-                print(f"تتبع الخطأ: {traceback.format_exc()}")
+                product_rows.append(product_transaction)
+            except Exception:
+                logger.exception("خطأ في إنشاء حركة المنتج للفاتورة %s", self.number)
                 raise
 
-        # طباعة معلومات عن المعاملات التي تم إنشاؤها
+        return contact_rows, safe_rows, product_rows
+
+    def verify_related_transactions(self, contact_rows, safe_rows, product_rows):
+        """التحقق من اكتمال المعاملات المبنية للفاتورة من الحالة في الذاكرة بدون استعلامات عدّ"""
+        if not contact_rows:
+            raise ValueError(f"لم يتم إنشاء معاملات العملاء/الموردين للفاتورة {self.number}")
+
+        if (self.payment_type == self.CASH or self.paid_amount > 0) and not safe_rows:
+            raise ValueError(f"لم يتم إنشاء معاملات الخزنة للفاتورة النقدية أو الفاتورة الآجلة مع دفعة جزئية {self.number}")
+
+        items_count = len(self.items.all())
+        if len(product_rows) != items_count:
+            raise ValueError(f"عدد معاملات المخزون ({len(product_rows)}) لا يتطابق مع عدد بنود الفاتورة ({items_count}) للفاتورة {self.number}")
+
+    @classmethod
+    def post_many(cls, invoices):
+        """
+        ترحيل مجموعة فواتير (QuerySet أو قائمة) دفعة واحدة داخل معاملة واحدة:
+        حذف أي معاملات سابقة لها، ثم بناء جميع الحركات في الذاكرة والتحقق منها وإدراجها بـ bulk_create،
+        مع إعادة حساب أرصدة كل خزنة وجهة اتصال ومنتج متأثر مرة واحدة فقط.
+        يثير ValueError ويتراجع عن كل شيء إذا كانت معاملات أي فاتورة غير مكتملة.
+        """
+        from django.db.models import prefetch_related_objects
         from finances.models import ContactTransaction, SafeTransaction, ProductTransaction
-        contact_transactions = ContactTransaction.objects.filter(invoice=self)
-        safe_transactions = SafeTransaction.objects.filter(invoice=self)
-        product_transactions = ProductTransaction.objects.filter(invoice=self)
-
-        print(f"=== تم إنشاء المعاملات المالية والمخزنية للفاتورة رقم {self.number} ===")
-        print(f"عدد معاملات العملاء/الموردين: {contact_transactions.count()}")
-        print(f"عدد معاملات الخزنة: {safe_transactions.count()}")
-        print(f"عدد معاملات المخزون: {product_transactions.count()}")
-
-    def post_invoice(self):
-        """ترحيل الفاتورة وإنشاء المعاملات المالية والمخزنية"""
-        # التحقق من وجود معاملات مالية ومخزنية مرتبطة بالفاتورة
-        from finances.models import ContactTransaction, SafeTransaction, ProductTransaction
-        from django.db import transaction as db_transaction
         from core.models import SystemSettings
 
-        contact_transactions = ContactTransaction.objects.filter(invoice=self)
-        safe_transactions = SafeTransaction.objects.filter(invoice=self)
-        product_transactions = ProductTransaction.objects.filter(invoice=self)
+        if isinstance(invoices, models.QuerySet):
+            invoices = invoices.select_related('contact', 'safe', 'store')
+        invoices = list(invoices)
+        if not invoices:
+            return []
 
-        # الحصول على إعدادات النظام
+        prefetch_related_objects(invoices, 'items__product', 'items__product_unit__unit')
+        invoice_ids = [invoice.pk for invoice in invoices]
         settings = SystemSettings.get_settings()
 
-        print(f"=== بدء ترحيل الفاتورة {self.number} ===")
-        print(f"حالة الترحيل الحالية: {self.is_posted}")
-        print(f"عدد معاملات العملاء/الموردين الحالية: {contact_transactions.count()}")
-        print(f"عدد معاملات الخزنة الحالية: {safe_transactions.count()}")
-        print(f"عدد معاملات المخزون الحالية: {product_transactions.count()}")
-
-        # إذا كانت هناك معاملات موجودة بالفعل، قم بحذفها أولاً
-        if contact_transactions.count() > 0 or safe_transactions.count() > 0 or product_transactions.count() > 0:
-            print(f"حذف المعاملات الموجودة للفاتورة {self.number} قبل إعادة الترحيل")
-            with db_transaction.atomic():
-                contact_transactions.delete()
-                safe_transactions.delete()
-                product_transactions.delete()
-
-        # إنشاء المعاملات المالية والمخزنية
-        try:
-            with db_transaction.atomic():
-                # إنشاء المعاملات المالية والمخزنية
-                self.create_related_transactions()
-
-                # التحقق من نجاح إنشاء المعاملات
-                new_contact_transactions = ContactTransaction.objects.filter(invoice=self)
-                new_safe_transactions = SafeTransaction.objects.filter(invoice=self)
-                new_product_transactions = ProductTransaction.objects.filter(invoice=self)
-
-                print(f"عدد معاملات العملاء/الموردين بعد الترحيل: {new_contact_transactions.count()}")
-                print(f"عدد معاملات الخزنة بعد الترحيل: {new_safe_transactions.count()}")
-                print(f"عدد معاملات المخزون بعد الترحيل: {new_product_transactions.count()}")
-
-                # التحقق من إنشاء جميع المعاملات المطلوبة
-                items_count = self.items.count()
-                expected_product_transactions = items_count
-
-                if new_contact_transactions.count() == 0:
-                    raise Exception("لم يتم إنشاء معاملات العملاء/الموردين")
-
-                if (self.payment_type == 'cash' or self.paid_amount > 0) and new_safe_transactions.count() == 0:
-                    raise Exception("لم يتم إنشاء معاملات الخزنة للفاتورة النقدية أو الفاتورة الآجلة مع دفعة جزئية")
+        # قفل كل الحسابات المتأثرة (حسابات الفواتير وحسابات حركاتها السابقة التي سيتم حذفها) مرة واحدة
+        # بالترتيب الثابت قبل قراءة أرصدتها، حتى لا تتداخل مع ترحيل آخر على نفس الحسابات
+        safes, contacts, products = cls.get_ledger_accounts(invoices)
+        posted_safes, posted_contacts, posted_products = cls.get_posted_ledger_accounts(invoice_ids)
+        with ledger.posting(safes + posted_safes, contacts + posted_contacts, products + posted_products):
+            # حذف المعاملات الموجودة للفواتير قبل إعادة الترحيل
+            ledger.bulk_delete(
+                ContactTransaction.objects.filter(invoice_id__in=invoice_ids),
+                SafeTransaction.objects.filter(invoice_id__in=invoice_ids),
+                ProductTransaction.objects.filter(invoice_id__in=invoice_ids),
+            )
 
-                if new_product_transactions.count() != expected_product_transactions:
-                    raise Exception(f"عدد معاملات المخزون ({new_product_transactions.count()}) لا يتطابق مع عدد بنود الفاتورة ({expected_product_transactions})")
+            # بناء حركات جميع الفواتير في الذاكرة والتحقق منها قبل الإدراج
+            contact_rows, safe_rows, product_rows = [], [], []
+            for invoice in invoices:
+                invoice_contact_rows, invoice_safe_rows, invoice_product_rows = invoice.build_related_transactions()
+                invoice.verify_related_transactions(invoice_contact_rows, invoice_safe_rows, invoice_product_rows)
+                contact_rows.extend(invoice_contact_rows)
+                safe_rows.extend(invoice_safe_rows)
+                product_rows.extend(invoice_product_rows)
 
-                # تحديث أسعار المنتجات بناءً على إعدادات النظام
-                self.update_product_prices(settings)
+            ledger.bulk_insert(contact_rows=contact_rows, safe_rows=safe_rows, product_rows=product_rows)
 
-                # ثم تعيين حالة الترحيل وحفظ النموذج
-                self.is_posted = True
-                self.save(update_fields=['is_posted'])
+            # تحديث أسعار المنتجات بناءً على إعدادات النظام
+            cls.update_products_prices(invoices, settings)
 
-                print(f"تم ترحيل الفاتورة {self.number} وإنشاء المعاملات المالية والمخزنية بنجاح")
-                return True
-        except Exception as e:
-            print(f"خطأ في ترحيل الفاتورة {self.number}: {str(e)}")
-            import traceback
-            print(f"تتبع الخطأ: {traceback.format_exc()}")
+            cls.objects.filter(pk__in=invoice_ids).update(is_posted=True)
+            for invoice in invoices:
+                invoice.is_posted = True
 
-            # محاولة تنظيف أي معاملات قد تكون تم إنشاؤها جزئيًا
-            try:
-                with db_transaction.atomic():
-                    ContactTransaction.objects.filter(invoice=self).delete()
-                    SafeTransaction.objects.filter(invoice=self).delete()
-                    ProductTransaction.objects.filter(invoice=self).delete()
-                    print(f"تم تنظيف المعاملات الجزئية للفاتورة {self.number}")
-            except Exception as cleanup_error:
-                print(f"خطأ في تنظيف المعاملات الجزئية: {str(cleanup_error)}")
+        instrumentation.count('invoices_posted', len(invoices))
+        logger.debug(
+            "تم ترحيل %s فاتورة: %s حركة عملاء/موردين، %s حركة خزنة، %s حركة مخزون",
+            len(invoices), len(contact_rows), len(safe_rows), len(product_rows),
+        )
+        return invoices
 
+    def post_invoice(self):
+        """ترحيل الفاتورة وإنشاء المعاملات المالية والمخزنية"""
+        try:
+            Invoice.post_many([self])
+            return True
+        except Exception:
+            logger.exception("خطأ في ترحيل الفاتورة %s", self.number)
             return False
 
     def update_product_prices(self, settings):
         """تحديث أسعار المنتجات بناءً على إعدادات النظام"""
-        print(f"=== تحديث أسعار المنتجات للفاتورة {self.number} ===")
-
+        Invoice.update_products_prices([self], settings)
+
+    @staticmethod
+    def update_products_prices(invoices, settings):
+        """
+        تحديث أسعار وحدات المنتجات من بنود مجموعة فواتير بناءً على إعدادات النظام
+        باستعلام bulk_update واحد لكل نوع سعر (عند تكرار الوحدة يُعتمد سعر آخر فاتورة)
+        """
         # التحقق من إعدادات تحديث الأسعار
         update_purchase_price = settings.update_purchase_price
         update_sale_price = settings.update_sale_price
 
         # لا نقوم بتحديث الأسعار إذا كانت الإعدادات معطلة
         if not update_purchase_price and not update_sale_price:
-            print("تحديث الأسعار معطل في إعدادات النظام")
+            logger.debug("تحديث الأسعار معطل في إعدادات النظام")
             return
 
-        # تحديث أسعار المنتجات بناءً على نوع الفاتورة
-        for item in self.items.all():
-            product = item.product
-            product_unit = item.product_unit
-            unit_price = item.unit_price
+        purchase_units = {}
+        sale_units = {}
+        for invoice in invoices:
+            for item in invoice.items.all():
+                product_unit = item.product_unit
 
-            print(f"معالجة المنتج: {product.name}, الوحدة: {product_unit.unit.name}, السعر: {unit_price}")
+                # تحديث سعر الشراء للمنتج في فواتير الشراء
+                if invoice.invoice_type == Invoice.PURCHASE and update_purchase_price:
+                    product_unit.purchase_price = item.unit_price
+                    purchase_units[product_unit.pk] = product_unit
 
-            # تحديث سعر الشراء للمنتج في فواتير الشراء
-            if self.invoice_type == self.PURCHASE and update_purchase_price:
-                print(f"تحديث سعر الشراء للمنتج {product.name} من {product_unit.purchase_price} إلى {unit_price}")
-                product_unit.purchase_price = unit_price
-                product_unit.save(update_fields=['purchase_price'])
-                print(f"تم تحديث سعر الشراء للمنتج {product.name} إلى {product_unit.purchase_price}")
+                # تحديث سعر البيع للمنتج في فواتير البيع
+                elif invoice.invoice_type == Invoice.SALE and update_sale_price:
+                    product_unit.selling_price = item.unit_price
+                    sale_units[product_unit.pk] = product_unit
 
-            # تحديث سعر البيع للمنتج في فواتير البيع
-            elif self.invoice_type == self.SALE and update_sale_price:
-                print(f"تحديث سعر البيع للمنتج {product.name} من {product_unit.sale_price} إلى {unit_price}")
-                product_unit.sale_price = unit_price
-                product_unit.save(update_fields=['sale_price'])
-                print(f"تم تحديث سعر البيع للمنتج {product.name} إلى {product_unit.sale_price}")
+        if purchase_units:
+            ProductUnit.objects.bulk_update(purchase_units.values(), ['purchase_price'])
+        if sale_units:
+            ProductUnit.objects.bulk_update(sale_units.values(), ['selling_price'])
 
-        print(f"=== تم تحديث أسعار المنتجات للفاتورة {self.number} ===")
+        instrumentation.count('prices_updated', len(purchase_units) + len(sale_units))
+        logger.debug("تم تحديث أسعار %s وحدة شراء و%s وحدة بيع", len(purchase_units), len(sale_units))
 
     def unpost_invoice(self):
         """إلغاء ترحيل الفاتورة (يتطلب إلغاء المعاملات المالية والمخزنية المرتبطة)"""
@@ -581,6 +630,10 @@ class Payment(models.Model):
         verbose_name = _("تحصيل/دفع")
         verbose_name_plural = _("التحصيلات والمدفوعات")
         ordering = ['-date']
+        indexes = [
+            # قائمة المدفوعات مقسمة إلى صفحات بالمؤشر على (-date, -id)
+            models.Index(fields=['date', 'id'], name='payment_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.number} - {self.contact.name} - {self.amount}"
@@ -619,72 +672,78 @@ class Payment(models.Model):
         if self.invoice:
             description += f" - الفاتورة رقم {self.invoice.number}"
 
-        # 1. إنشاء معاملة خزنة
-        current_balance = self.safe.current_balance
-
-        # تحديد تأثير العملية على رصيد الخزنة
-        if self.payment_type == self.RECEIPT:
-            # تحصيل من العميل يزيد رصيد الخزنة
-            balance_after = current_balance + self.amount
-        else:  # PAYMENT
-            # دفع للمورد ينقص رصيد الخزنة
-            balance_after = current_balance - self.amount
-
-        safe_transaction = SafeTransaction(
-            safe=self.safe,
-            date=self.date,  # استخدام تاريخ التحصيل/الدفع
-            amount=self.amount,
-            transaction_type=transaction_type,
-            description=description,
-            reference_number=self.number,
-            balance_before=current_balance,
-            balance_after=balance_after
-        )
+        # قفل الخزنة وجهة الاتصال وقراءة رصيدهما الحالي قبل إنشاء الحركات
+        with ledger.posting(safes=[self.safe], contacts=[self.contact]):
+            # 1. إنشاء معاملة خزنة
+            current_balance = self.safe.current_balance
 
-        if self.invoice:
-            safe_transaction.invoice = self.invoice
-            safe_transaction.contact = self.contact
+            # تحديد تأثير العملية على رصيد الخزنة
+            if self.payment_type == self.RECEIPT:
+                # تحصيل من العميل يزيد رصيد الخزنة
+                balance_after = current_balance + self.amount
+            else:  # PAYMENT
+                # دفع للمورد ينقص رصيد الخزنة
+                balance_after = current_balance - self.amount
 
-        safe_transaction.save()
-        self.created_transaction = safe_transaction
+            safe_transaction = SafeTransaction(
+                safe=self.safe,
+                date=self.date,  # استخدام تاريخ التحصيل/الدفع
+                amount=self.amount,
+                transaction_type=transaction_type,
+                description=description,
+                reference_number=self.number,
+                balance_before=current_balance,
+                balance_after=balance_after
+            )
 
-        # 2. إنشاء معاملة حساب العميل/المورد
-        current_balance = self.contact.current_balance
-        balance_after = current_balance + contact_amount
+            if self.invoice:
+                safe_transaction.invoice = self.invoice
+                safe_transaction.contact = self.contact
 
-        contact_transaction = ContactTransaction(
-            contact=self.contact,
-            date=self.date,  # استخدام تاريخ التحصيل/الدفع
-            amount=contact_amount,
-            transaction_type=transaction_effect,
-            description=description,
-            reference_number=self.number,
-            balance_before=current_balance,
-            balance_after=balance_after
-        )
-
-        if self.invoice:
-            contact_transaction.invoice = self.invoice
+            safe_transaction.save()
+            self.created_transaction = safe_transaction
 
-        contact_transaction.save()
-        self.contact_transaction = contact_transaction
+            # 2. إنشاء معاملة حساب العميل/المورد
+            current_balance = self.contact.current_balance
+            balance_after = current_balance + contact_amount
 
-        # 3. تحديث الفاتورة المرتبطة إذا وجدت
-        if self.invoice:
-            # تحديث المبلغ المدفوع والمتبقي في الفاتورة
-            if self.payment_type == self.RECEIPT and self.invoice.invoice_type == 'sale':
-                # تحصيل من العميل لفاتورة بيع
-                self.invoice.paid_amount += self.amount
-                self.invoice.remaining_amount = self.invoice.net_amount - self.invoice.paid_amount
-                self.invoice.save(update_fields=['paid_amount', 'remaining_amount'])
-            elif self.payment_type == self.PAYMENT and self.invoice.invoice_type == 'purchase':
-                # دفع للمورد لفاتورة شراء
-                self.invoice.paid_amount += self.amount
-                self.invoice.remaining_amount = self.invoice.net_amount - self.invoice.paid_amount
-                self.invoice.save(update_fields=['paid_amount', 'remaining_amount'])
+            contact_transaction = ContactTransaction(
+                contact=self.contact,
+                date=self.date,  # استخدام تاريخ التحصيل/الدفع
+                amount=contact_amount,
+                transaction_type=transaction_effect,
+                description=description,
+                reference_number=self.number,
+                balance_before=current_balance,
+                balance_after=balance_after
+            )
 
-        # حفظ التغييرات في الدفعة
-        self.save(update_fields=['created_transaction', 'contact_transaction'])
+            if self.invoice:
+                contact_transaction.invoice = self.invoice
+
+            contact_transaction.save()
+            self.contact_transaction = contact_transaction
+
+            # 3. تحديث الفاتورة المرتبطة إذا وجدت
+            if self.invoice:
+                # قراءة المبلغ المدفوع من صف الفاتورة بعد قفله حتى لا يضيع تحصيل آخر على نفس الفاتورة
+                self.invoice.paid_amount = Invoice.objects.select_for_update().values_list(
+                    'paid_amount', flat=True
+                ).get(pk=self.invoice_id)
+                # تحديث المبلغ المدفوع والمتبقي في الفاتورة
+                if self.payment_type == self.RECEIPT and self.invoice.invoice_type == 'sale':
+                    # تحصيل من العميل لفاتورة بيع
+                    self.invoice.paid_amount += self.amount
+                    self.invoice.remaining_amount = self.invoice.net_amount - self.invoice.paid_amount
+                    self.invoice.save(update_fields=['paid_amount', 'remaining_amount'])
+                elif self.payment_type == self.PAYMENT and self.invoice.invoice_type == 'purchase':
+                    # دفع للمورد لفاتورة شراء
+                    self.invoice.paid_amount += self.amount
+                    self.invoice.remaining_amount = self.invoice.net_amount - self.invoice.paid_amount
+                    self.invoice.save(update_fields=['paid_amount', 'remaining_amount'])
+
+            # حفظ التغييرات في الدفعة
+            self.save(update_fields=['created_transaction', 'contact_transaction'])
 
         return True
 
@@ -715,13 +774,19 @@ class Payment(models.Model):
                 self.invoice.paid_amount -= self.amount
                 self.invoice.remaining_amount = self.invoice.net_amount - self.invoice.paid_amount
                 self.invoice.save(update_fields=['paid_amount', 'remaining_amount'])
-                print(f"تم تحديث الفاتورة {self.invoice.number} - المبلغ المدفوع: {self.invoice.paid_amount}, المبلغ المتبقي: {self.invoice.remaining_amount}")
+                logger.debug(
+                    "تم تحديث الفاتورة %s - المبلغ المدفوع: %s، المبلغ المتبقي: %s",
+                    self.invoice.number, self.invoice.paid_amount, self.invoice.remaining_amount,
+                )
             elif self.payment_type == self.PAYMENT and self.invoice.invoice_type == 'purchase':
                 # إلغاء دفع للمورد لفاتورة شراء
                 self.invoice.paid_amount -= self.amount
                 self.invoice.remaining_amount = self.invoice.net_amount - self.invoice.paid_amount
                 self.invoice.save(update_fields=['paid_amount', 'remaining_amount'])
-                print(f"تم تحديث الفاتورة {self.invoice.number} - المبلغ المدفوع: {self.invoice.paid_amount}, المبلغ المتبقي: {self.invoice.remaining_amount}")
+                logger.debug(
+                    "تم تحديث الفاتورة %s - المبلغ المدفوع: %s، المبلغ المتبقي: %s",
+                    self.invoice.number, self.invoice.paid_amount, self.invoice.remaining_amount,
+                )
 
         # حذف معاملة الخزنة إذا وجدت
         if self.created_transaction:
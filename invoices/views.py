@@ -1,4 +1,4 @@
-
+import logging
 
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse
@@ -13,8 +13,12 @@ from django.db.models import Q, Sum
 from .models import Invoice, InvoiceItem, Payment
 from .forms import InvoiceForm, InvoiceItemFormSet, PaymentForm
 from core.models import Contact, Store, Safe, Representative, Driver, SystemSettings
+from core.pagination import keyset_paginate, get_querystring
+from core import sequences
 from products.models import Product, ProductUnit
 
+logger = logging.getLogger(__name__)
+
 @login_required
 def invoice_list(request):
     """عرض قائمة الفواتير"""
@@ -42,8 +46,13 @@ def invoice_list(request):
         is_posted_bool = is_posted == 'true'
         invoices = invoices.filter(is_posted=is_posted_bool)
 
+    # ترقيم بالمؤشر على (التاريخ، المعرف) بدلاً من عرض كل الفواتير
+    page = keyset_paginate(request, invoices.select_related('contact', 'store'))
+
     context = {
-        'invoices': invoices,
+        'invoices': page,
+        'page_obj': page,
+        'page_querystring': get_querystring(request),
         'query': query,
         'invoice_type': invoice_type,
         'is_posted': is_posted,
@@ -72,8 +81,12 @@ def sale_invoice_list(request):
         is_posted_bool = is_posted == 'true'
         invoices = invoices.filter(is_posted=is_posted_bool)
 
+    page = keyset_paginate(request, invoices.select_related('contact', 'store'))
+
     context = {
-        'invoices': invoices,
+        'invoices': page,
+        'page_obj': page,
+        'page_querystring': get_querystring(request),
         'query': query,
         'invoice_type': Invoice.SALE,
         'is_posted': is_posted,
@@ -103,8 +116,12 @@ def purchase_invoice_list(request):
         is_posted_bool = is_posted == 'true'
         invoices = invoices.filter(is_posted=is_posted_bool)
 
+    page = keyset_paginate(request, invoices.select_related('contact', 'store'))
+
     context = {
-        'invoices': invoices,
+        'invoices': page,
+        'page_obj': page,
+        'page_querystring': get_querystring(request),
         'query': query,
         'invoice_type': Invoice.PURCHASE,
         'is_posted': is_posted,
@@ -134,8 +151,12 @@ def sale_return_invoice_list(request):
         is_posted_bool = is_posted == 'true'
         invoices = invoices.filter(is_posted=is_posted_bool)
 
+    page = keyset_paginate(request, invoices.select_related('contact', 'store'))
+
     context = {
-        'invoices': invoices,
+        'invoices': page,
+        'page_obj': page,
+        'page_querystring': get_querystring(request),
         'query': query,
         'invoice_type': Invoice.SALE_RETURN,
         'is_posted': is_posted,
@@ -165,8 +186,12 @@ def purchase_return_invoice_list(request):
         is_posted_bool = is_posted == 'true'
         invoices = invoices.filter(is_posted=is_posted_bool)
 
+    page = keyset_paginate(request, invoices.select_related('contact', 'store'))
+
     context = {
-        'invoices': invoices,
+        'invoices': page,
+        'page_obj': page,
+        'page_querystring': get_querystring(request),
         'query': query,
         'invoice_type': Invoice.PURCHASE_RETURN,
         'is_posted': is_posted,
@@ -204,41 +229,25 @@ def invoice_detail(request, pk):
 @login_required
 def invoice_create(request):
     """إنشاء فاتورة جديدة"""
-    # إنشاء رقم فاتورة جديد
-    last_invoice = Invoice.objects.order_by('-id').first()
-    if not last_invoice:
-        new_number = "1"  # أول فاتورة في النظام
-    else:
-        # استخراج الرقم من آخر فاتورة
-        try:
-            if '-' in last_invoice.number:
-                last_number = int(last_invoice.number.split('-')[1])
-            else:
-                last_number = int(last_invoice.number)
-            new_number = str(last_number + 1)  # زيادة الرقم بمقدار 1
-        except (ValueError, IndexError):
-            # في حالة حدوث خطأ في تحليل الرقم، استخدم الرقم 1
-            new_number = "1"
+    # رقم الفاتورة المقترح لفرع المخزن الافتراضي (يتم حجزه عند الحفظ، أو حجز رقم آخر لفرع المخزن المختار)
+    settings = SystemSettings.get_settings()
+    default_store = settings.default_store or Store.objects.first()
+    new_number = sequences.preview(
+        'invoice', branch_id=default_store.branch_id if default_store else None, date=timezone.localdate()
+    )
 
     if request.method == 'POST':
-        print("\n\n=== بدء معالجة طلب POST ===")
-        print("البيانات المرسلة:", request.POST)
-        print("الملفات المرسلة:", request.FILES)
-
-        # طباعة جميع المفاتيح في request.POST
-        print("مفاتيح POST:", list(request.POST.keys()))
+        logger.debug("طلب إنشاء فاتورة - مفاتيح POST: %s", list(request.POST.keys()))
 
         # التحقق من وجود بيانات البنود
         items_data = request.POST.get('items_data', '[]')
-        print("بيانات البنود (الخام):", items_data)
 
         try:
             import json
             items = json.loads(items_data)
-            print("بيانات البنود (JSON):", items)
-            print("عدد البنود:", len(items))
+            logger.debug("عدد بنود الفاتورة المرسلة: %s", len(items))
         except json.JSONDecodeError as e:
-            print("خطأ في تحليل بيانات البنود JSON:", str(e))
+            logger.warning("خطأ في تحليل بيانات البنود JSON: %s", e)
             messages.error(request, f'خطأ في تحليل بيانات البنود: {str(e)}')
             return render(request, 'invoices/invoice/form.html', {
                 'form': InvoiceForm(request.POST),
@@ -255,16 +264,12 @@ def invoice_create(request):
         required_fields = ['invoice_type', 'payment_type', 'contact', 'store', 'safe', 'number']
         missing_fields = [field for field in required_fields if not request.POST.get(field)]
 
-        # طباعة قيم الحقول المطلوبة
-        for field in required_fields:
-            print(f"قيمة الحقل {field}: '{request.POST.get(field, '')}'")
-
         # التحقق من رقم الفاتورة بشكل خاص
         if not request.POST.get('number'):
-            print("تحذير: رقم الفاتورة غير موجود، سيتم استخدام الرقم التلقائي:", new_number)
+            logger.debug("رقم الفاتورة غير موجود، سيتم استخدام الرقم التلقائي: %s", new_number)
 
         if missing_fields:
-            print("حقول مفقودة:", missing_fields)
+            logger.debug("حقول مفقودة: %s", missing_fields)
             messages.error(request, f'الحقول التالية مطلوبة: {", ".join(missing_fields)}')
             return render(request, 'invoices/invoice/form.html', {
                 'form': InvoiceForm(request.POST),
@@ -278,40 +283,24 @@ def invoice_create(request):
             })
 
         form = InvoiceForm(request.POST)
-        print("تم إنشاء نموذج InvoiceForm")
 
         if form.is_valid():
-            print("النموذج صالح")
-            print("البيانات المنظفة:", form.cleaned_data)
-
             try:
                 with transaction.atomic():
-                    print("بدء المعاملة")
                     invoice = form.save(commit=False)
-                    if not invoice.number:
-                        invoice.number = new_number
-
-                    print("بيانات الفاتورة قبل الحفظ:", {
-                        'id': invoice.id,
-                        'number': invoice.number,
-                        'invoice_type': invoice.invoice_type,
-                        'payment_type': invoice.payment_type,
-                        'contact_id': invoice.contact_id,
-                        'store_id': invoice.store_id,
-                        'safe_id': invoice.safe_id,
-                    })
+                    # حجز الرقم المقترح، أو الرقم التالي إذا حصل عليه مستخدم آخر قبل الحفظ
+                    invoice.number = sequences.claim(
+                        'invoice', invoice.number, branch_id=invoice.store.branch_id, date=invoice.date
+                    )
 
                     invoice.save()
-                    print("تم حفظ الفاتورة:", invoice.id)
 
                     # حذف البنود القديمة في حالة التعديل
                     if invoice.id:
-                        deleted_count = InvoiceItem.objects.filter(invoice=invoice).delete()
-                        print("تم حذف البنود القديمة:", deleted_count)
+                        InvoiceItem.objects.filter(invoice=invoice).delete()
 
                     # إضافة البنود الجديدة
                     for i, item in enumerate(items):
-                        print(f"إضافة بند #{i+1}:", item)
                         try:
                             InvoiceItem.objects.create(
                                 invoice=invoice,
@@ -323,18 +312,13 @@ def invoice_create(request):
                                 tax_amount=item['tax_amount'],
                                 net_price=item['net_price']
                             )
-                            print(f"تم إضافة البند #{i+1} بنجاح")
                         except Exception as item_error:
-                            print(f"خطأ في إضافة البند #{i+1}:", str(item_error))
                             raise Exception(f"خطأ في إضافة البند #{i+1}: {str(item_error)}")
 
                     # تحديث إجماليات الفاتورة
-                    print("حساب إجماليات الفاتورة")
                     if hasattr(invoice, 'calculate_totals') and callable(getattr(invoice, 'calculate_totals')):
                         invoice.calculate_totals()
-                        print("تم استدعاء دالة calculate_totals بنجاح")
                     else:
-                        print("تحذير: دالة calculate_totals غير موجودة، حساب الإجماليات يدوياً")
                         # حساب الإجماليات يدوياً
                         items = invoice.items.all()
                         total_amount = sum(item.quantity * item.unit_price for item in items)
@@ -353,110 +337,30 @@ def invoice_create(request):
                             invoice.remaining_amount = invoice.net_amount - invoice.paid_amount
 
                     invoice.save()
-                    print("تم حفظ الفاتورة بعد حساب الإجماليات")
-                    print("بيانات الفاتورة النهائية:", {
-                        'id': invoice.id,
-                        'number': invoice.number,
-                        'total_amount': invoice.total_amount,
-                        'discount_amount': invoice.discount_amount,
-                        'tax_amount': invoice.tax_amount,
-                        'net_amount': invoice.net_amount,
-                        'paid_amount': invoice.paid_amount,
-                        'remaining_amount': invoice.remaining_amount,
-                    })
+                    logger.debug("تم حفظ الفاتورة %s - الصافي: %s، المدفوع: %s", invoice.number, invoice.net_amount, invoice.paid_amount)
 
                     # ترحيل الفاتورة وإنشاء المعاملات المالية والمخزنية مباشرة
                     try:
-                        print("=== بدء ترحيل الفاتورة الجديدة ===")
-
-                        # استخدام دالة post_invoice بدلاً من create_related_transactions
-                        if hasattr(invoice, 'post_invoice') and callable(getattr(invoice, 'post_invoice')):
-                            # تأكد من أن الفاتورة غير مرحلة أولاً
-                            invoice.is_posted = False
-                            invoice.save(update_fields=['is_posted'])
-
-                            # ثم قم بترحيلها
-                            result = invoice.post_invoice()
-                            print(f"نتيجة استدعاء post_invoice: {result}")
-
-                            # التحقق من نجاح إنشاء المعاملات
-                            from finances.models import ContactTransaction, SafeTransaction, ProductTransaction
-                            contact_transactions = ContactTransaction.objects.filter(invoice=invoice)
-                            safe_transactions = SafeTransaction.objects.filter(invoice=invoice)
-                            product_transactions = ProductTransaction.objects.filter(invoice=invoice)
-
-                            print(f"عدد معاملات العملاء/الموردين بعد الترحيل: {contact_transactions.count()}")
-                            print(f"عدد معاملات الخزنة بعد الترحيل: {safe_transactions.count()}")
-                            print(f"عدد معاملات المخزون بعد الترحيل: {product_transactions.count()}")
-
-                            # التحقق من إنشاء جميع المعاملات المطلوبة
-                            items_count = invoice.items.count()
-                            expected_product_transactions = items_count
-                            has_error = False
-                            error_message = ""
-
-                            if contact_transactions.count() == 0:
-                                print("تحذير: لم يتم إنشاء معاملات العملاء/الموردين")
-                                # محاولة إعادة الترحيل
-                                invoice.is_posted = False
-                                invoice.save(update_fields=['is_posted'])
-                                result = invoice.post_invoice()
-                                print(f"نتيجة إعادة الترحيل: {result}")
-
-                                # التحقق مرة أخرى
-                                contact_transactions = ContactTransaction.objects.filter(invoice=invoice)
-                                safe_transactions = SafeTransaction.objects.filter(invoice=invoice)
-                                product_transactions = ProductTransaction.objects.filter(invoice=invoice)
-
-                                print(f"عدد معاملات العملاء/الموردين بعد إعادة الترحيل: {contact_transactions.count()}")
-                                print(f"عدد معاملات الخزنة بعد إعادة الترحيل: {safe_transactions.count()}")
-                                print(f"عدد معاملات المخزون بعد إعادة الترحيل: {product_transactions.count()}")
-
-                                # التحقق مرة أخرى بعد إعادة الترحيل
-                                if contact_transactions.count() == 0:
-                                    has_error = True
-                                    error_message += "لم يتم إنشاء معاملات العملاء/الموردين. "
-
-                            if (invoice.payment_type == 'cash' or invoice.paid_amount > 0) and safe_transactions.count() == 0:
-                                print("تحذير: لم يتم إنشاء معاملات الخزنة للفاتورة النقدية أو الفاتورة الآجلة مع دفعة جزئية")
-                                has_error = True
-                                error_message += "لم يتم إنشاء معاملات الخزنة للفاتورة النقدية أو الفاتورة الآجلة مع دفعة جزئية. "
-
-                            if product_transactions.count() != expected_product_transactions:
-                                print(f"تحذير: عدد معاملات المخزون ({product_transactions.count()}) لا يتطابق مع عدد بنود الفاتورة ({expected_product_transactions})")
-                                has_error = True
-                                error_message += f"عدد معاملات المخزون ({product_transactions.count()}) لا يتطابق مع عدد بنود الفاتورة ({expected_product_transactions}). "
+                        # التنبيه على البنود التي تتجاوز رصيد المخزن قبل الترحيل
+                        for shortage in invoice.get_stock_shortages():
+                            messages.warning(
+                                request,
+                                f'كمية {shortage["product"].name} ({shortage["required"]}) '
+                                f'تتجاوز رصيد المخزن ({shortage["available"]})'
+                            )
 
-                            # إذا كان هناك خطأ، قم بالتراجع عن إنشاء الفاتورة
-                            if has_error:
-                                print("خطأ في ترحيل الفاتورة:", error_message)
-                                # إلغاء المعاملة بإثارة استثناء
-                                raise Exception(f"فشل في ترحيل الفاتورة: {error_message}")
-                        else:
-                            print("تحذير: دالة post_invoice غير موجودة، استخدام create_related_transactions كبديل")
-                            # استخدام create_related_transactions كبديل
-                            if hasattr(invoice, 'create_related_transactions') and callable(getattr(invoice, 'create_related_transactions')):
-                                invoice.create_related_transactions()
-                                invoice.is_posted = True
-                                invoice.save(update_fields=['is_posted'])
-                                print("تم إنشاء المعاملات المالية والمخزنية بنجاح")
-                            else:
-                                print("تحذير: دالة create_related_transactions غير موجودة أيضًا")
-                    except Exception as e:
-                        print("خطأ في ترحيل الفاتورة:", str(e))
-                        import traceback
-                        print("تتبع الخطأ:", traceback.format_exc())
+                        # تأكد من أن الفاتورة غير مرحلة أولاً ثم قم بترحيلها
+                        # (post_invoice يتحقق من اكتمال المعاملات في الذاكرة ويتراجع عنها بالكامل عند الفشل)
+                        invoice.is_posted = False
+                        invoice.save(update_fields=['is_posted'])
+                        if not invoice.post_invoice():
+                            raise Exception("فشل في ترحيل الفاتورة")
+                    except Exception:
+                        logger.exception("خطأ في ترحيل الفاتورة %s", invoice.number)
                         # لا نريد إيقاف العملية إذا فشلت عملية الترحيل
 
-                    print("=== تمت معالجة الطلب بنجاح ===\n\n")
                     messages.success(request, 'تم إنشاء الفاتورة وترحيلها بنجاح')
 
-                    # طباعة معلومات التوجيه
-                    print(f"=== معلومات التوجيه ===")
-                    print(f"معرف الفاتورة: {invoice.id}")
-                    print(f"رقم الفاتورة: {invoice.number}")
-                    print(f"URL التوجيه: {reverse('invoice_detail', kwargs={'pk': invoice.id})}")
-
                     # التحقق مما إذا كان الطلب يتوقع استجابة JSON
                     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                         return JsonResponse({
@@ -468,10 +372,7 @@ def invoice_create(request):
                         # استخدام HttpResponseRedirect بدلاً من redirect للتأكد من التوجيه الصحيح
                         return HttpResponseRedirect(reverse('invoice_detail', kwargs={'pk': invoice.id}))
             except Exception as e:
-                print("حدث خطأ أثناء حفظ الفاتورة:", str(e))
-                print("نوع الخطأ:", type(e).__name__)
-                import traceback
-                print("تتبع الخطأ:", traceback.format_exc())
+                logger.exception("حدث خطأ أثناء حفظ الفاتورة")
                 messages.error(request, f'حدث خطأ أثناء حفظ الفاتورة: {str(e)}')
 
                 # التحقق مما إذا كان الطلب يتوقع استجابة JSON
@@ -483,10 +384,7 @@ def invoice_create(request):
                         'error_type': type(e).__name__
                     }, status=400)
         else:
-            print("النموذج غير صالح")
-            print("أخطاء النموذج:", form.errors)
-            for field, errors in form.errors.items():
-                print(f"أخطاء الحقل {field}:", errors)
+            logger.debug("النموذج غير صالح: %s", form.errors)
             messages.error(request, 'يرجى تصحيح الأخطاء أدناه')
 
             # التحقق مما إذا كان الطلب يتوقع استجابة JSON
@@ -525,7 +423,6 @@ def invoice_create(request):
             initial_data['safe'] = settings.default_safe.id
 
         form = InvoiceForm(initial=initial_data)
-        print("تم تعيين القيم الافتراضية للفاتورة من إعدادات النظام")
 
     # الحصول على البيانات الافتراضية
     # تحديد العميل/المورد الافتراضي بناءً على نوع الفاتورة ومن إعدادات النظام
@@ -540,7 +437,6 @@ def invoice_create(request):
     else:
         default_contact = Contact.objects.first()
 
-    default_store = settings.default_store or Store.objects.first()
     default_safe = settings.default_safe or Safe.objects.first()
     default_payment_type = settings.default_invoice_type
 
@@ -619,7 +515,7 @@ def invoice_edit(request, pk):
                     # إلغاء الترحيل أولاً إذا كانت الفاتورة مرحلة
                     if invoice.is_posted and hasattr(invoice, 'unpost_invoice') and callable(getattr(invoice, 'unpost_invoice')):
                         invoice.unpost_invoice()
-                        print("تم إلغاء ترحيل الفاتورة بنجاح")
+                        logger.debug("تم إلغاء ترحيل الفاتورة %s", invoice.number)
                     else:
                         # إلغاء الترحيل يدويًا إذا لم تكن دالة unpost_invoice متاحة
                         from finances.models import ContactTransaction, SafeTransaction, ProductTransaction
@@ -629,10 +525,10 @@ def invoice_edit(request, pk):
                             ProductTransaction.objects.filter(invoice=invoice).delete()
                             invoice.is_posted = False
                             invoice.save(update_fields=['is_posted'])
-                            print("تم إلغاء ترحيل الفاتورة يدويًا")
+                            logger.debug("تم إلغاء ترحيل الفاتورة %s يدويًا", invoice.number)
 
                     # إعادة ترحيل الفاتورة
-                    print("=== بدء إعادة ترحيل الفاتورة ===")
+                    logger.debug("بدء إعادة ترحيل الفاتورة %s", invoice.number)
                     if hasattr(invoice, 'post_invoice') and callable(getattr(invoice, 'post_invoice')):
                         # تأكد من أن الفاتورة غير مرحلة أولاً
                         invoice.is_posted = False
@@ -640,8 +536,7 @@ def invoice_edit(request, pk):
 
                         # ثم قم بترحيلها
                         result = invoice.post_invoice()
-                        print(f"نتيجة استدعاء post_invoice: {result}")
-                        print(f"حالة الترحيل بعد الاستدعاء: {invoice.is_posted}")
+                        logger.debug("نتيجة ترحيل الفاتورة %s: %s - مرحلة: %s", invoice.number, result, invoice.is_posted)
 
                         # التحقق من نجاح إنشاء المعاملات
                         from finances.models import ContactTransaction, SafeTransaction, ProductTransaction
@@ -649,9 +544,10 @@ def invoice_edit(request, pk):
                         safe_transactions = SafeTransaction.objects.filter(invoice=invoice)
                         product_transactions = ProductTransaction.objects.filter(invoice=invoice)
 
-                        print(f"عدد معاملات العملاء/الموردين بعد الترحيل: {contact_transactions.count()}")
-                        print(f"عدد معاملات الخزنة بعد الترحيل: {safe_transactions.count()}")
-                        print(f"عدد معاملات المخزون بعد الترحيل: {product_transactions.count()}")
+                        logger.debug(
+                            "معاملات الفاتورة %s بعد الترحيل - العملاء/الموردين: %s، الخزنة: %s، المخزون: %s",
+                            invoice.number, contact_transactions.count(), safe_transactions.count(), product_transactions.count(),
+                        )
 
                         # التحقق من إنشاء جميع المعاملات المطلوبة
                         items_count = invoice.items.count()
@@ -660,21 +556,22 @@ def invoice_edit(request, pk):
                         error_message = ""
 
                         if contact_transactions.count() == 0:
-                            print("تحذير: لم يتم إنشاء معاملات العملاء/الموردين")
+                            logger.warning("لم يتم إنشاء معاملات العملاء/الموردين للفاتورة %s", invoice.number)
                             # محاولة إعادة الترحيل
                             invoice.is_posted = False
                             invoice.save(update_fields=['is_posted'])
                             result = invoice.post_invoice()
-                            print(f"نتيجة إعادة الترحيل: {result}")
+                            logger.debug("نتيجة إعادة ترحيل الفاتورة %s: %s", invoice.number, result)
 
                             # التحقق مرة أخرى
                             contact_transactions = ContactTransaction.objects.filter(invoice=invoice)
                             safe_transactions = SafeTransaction.objects.filter(invoice=invoice)
                             product_transactions = ProductTransaction.objects.filter(invoice=invoice)
 
-                            print(f"عدد معاملات العملاء/الموردين بعد إعادة الترحيل: {contact_transactions.count()}")
-                            print(f"عدد معاملات الخزنة بعد إعادة الترحيل: {safe_transactions.count()}")
-                            print(f"عدد معاملات المخزون بعد إعادة الترحيل: {product_transactions.count()}")
+                            logger.debug(
+                                "معاملات الفاتورة %s بعد إعادة الترحيل - العملاء/الموردين: %s، الخزنة: %s، المخزون: %s",
+                                invoice.number, contact_transactions.count(), safe_transactions.count(), product_transactions.count(),
+                            )
 
                             # التحقق مرة أخرى بعد إعادة الترحيل
                             if contact_transactions.count() == 0:
@@ -682,42 +579,39 @@ def invoice_edit(request, pk):
                                 error_message += "لم يتم إنشاء معاملات العملاء/الموردين. "
 
                         if (invoice.payment_type == 'cash' or invoice.paid_amount > 0) and safe_transactions.count() == 0:
-                            print("تحذير: لم يتم إنشاء معاملات الخزنة للفاتورة النقدية أو الفاتورة الآجلة مع دفعة جزئية")
+                            logger.warning("لم يتم إنشاء معاملات الخزنة للفاتورة %s (نقدية أو آجلة مع دفعة جزئية)", invoice.number)
                             has_error = True
                             error_message += "لم يتم إنشاء معاملات الخزنة للفاتورة النقدية أو الفاتورة الآجلة مع دفعة جزئية. "
 
                         if product_transactions.count() != expected_product_transactions:
-                            print(f"تحذير: عدد معاملات المخزون ({product_transactions.count()}) لا يتطابق مع عدد بنود الفاتورة ({expected_product_transactions})")
+                            logger.warning(
+                                "عدد معاملات المخزون (%s) لا يتطابق مع عدد بنود الفاتورة (%s) للفاتورة %s",
+                                product_transactions.count(), expected_product_transactions, invoice.number,
+                            )
                             has_error = True
                             error_message += f"عدد معاملات المخزون ({product_transactions.count()}) لا يتطابق مع عدد بنود الفاتورة ({expected_product_transactions}). "
 
                         # إذا كان هناك خطأ، قم بالتراجع عن تعديل الفاتورة
                         if has_error:
-                            print("خطأ في ترحيل الفاتورة:", error_message)
+                            logger.warning("خطأ في ترحيل الفاتورة %s: %s", invoice.number, error_message)
                             # إلغاء المعاملة بإثارة استثناء
                             raise Exception(f"فشل في ترحيل الفاتورة: {error_message}")
                     else:
-                        print("تحذير: دالة post_invoice غير موجودة، استخدام create_related_transactions كبديل")
+                        logger.warning("دالة post_invoice غير موجودة، استخدام create_related_transactions كبديل")
                         # استخدام create_related_transactions كبديل
                         if hasattr(invoice, 'create_related_transactions') and callable(getattr(invoice, 'create_related_transactions')):
                             invoice.create_related_transactions()
                             invoice.is_posted = True
                             invoice.save(update_fields=['is_posted'])
-                            print("تم إنشاء المعاملات المالية والمخزنية بنجاح")
+                            logger.debug("تم إنشاء المعاملات المالية والمخزنية للفاتورة %s", invoice.number)
                         else:
-                            print("تحذير: دالة create_related_transactions غير موجودة أيضًا")
+                            logger.warning("دالة create_related_transactions غير موجودة أيضًا")
                 except Exception as e:
-                    print("خطأ في إعادة ترحيل الفاتورة:", str(e))
-                    import traceback
-                    print("تتبع الخطأ:", traceback.format_exc())
+                    logger.exception("خطأ في إعادة ترحيل الفاتورة %s", invoice.number)
                     # لا نريد إيقاف العملية إذا فشلت عملية الترحيل
 
                 messages.success(request, 'تم تعديل الفاتورة وترحيلها بنجاح')
-                # طباعة معلومات التوجيه
-                print(f"=== معلومات التوجيه ===")
-                print(f"معرف الفاتورة: {invoice.id}")
-                print(f"رقم الفاتورة: {invoice.number}")
-                print(f"URL التوجيه: {reverse('invoice_detail', kwargs={'pk': invoice.id})}")
+                logger.debug("تم تعديل الفاتورة %s (ID: %s)", invoice.number, invoice.id)
 
                 # التحقق مما إذا كان الطلب يتوقع استجابة JSON
                 if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -738,21 +632,13 @@ def invoice_edit(request, pk):
     # تحميل بنود الفاتورة مع المنتجات والوحدات المرتبطة بها
     invoice_items = InvoiceItem.objects.filter(invoice=invoice).select_related('product', 'product_unit')
 
-    print(f"=== بدء تحميل بنود الفاتورة رقم {invoice.number} ===")
-    print(f"عدد البنود: {invoice_items.count()}")
-
     # تحميل وحدات المنتجات لكل بند
     for item in invoice_items:
         item.product_units = item.product.units.all()
-        print(f"بند الفاتورة: {item.id}")
-        print(f"- المنتج: {item.product.name} (ID: {item.product.id})")
-        print(f"- الوحدة: {item.product_unit.unit.name} (ID: {item.product_unit.id})")
-        print(f"- الكمية: {item.quantity} (نوع البيانات: {type(item.quantity)})")
-        print(f"- سعر الوحدة: {item.unit_price}")
-        print(f"- السعر الإجمالي: {item.total_price}")
-        print(f"- الخصم: {item.discount_amount}")
-        print(f"- الضريبة: {item.tax_amount}")
-        print(f"- الصافي: {item.net_price}")
+        logger.debug(
+            "بند الفاتورة %s: %s - المنتج: %s، الوحدة: %s، الكمية: %s، السعر: %s، الصافي: %s",
+            invoice.number, item.id, item.product_id, item.product_unit_id, item.quantity, item.unit_price, item.net_price,
+        )
 
     # الحصول على إعدادات النظام
     settings = SystemSettings.get_settings()
@@ -786,15 +672,15 @@ def invoice_delete(request, pk):
             if invoice.is_posted:
                 if hasattr(invoice, 'unpost_invoice') and callable(getattr(invoice, 'unpost_invoice')):
                     invoice.unpost_invoice()
-                    print("تم إلغاء ترحيل الفاتورة قبل الحذف")
+                    logger.debug("تم إلغاء ترحيل الفاتورة %s قبل الحذف", invoice.number)
                 else:
-                    print("تحذير: دالة unpost_invoice غير موجودة، محاولة حذف المعاملات المالية والمخزنية يدويًا")
+                    logger.warning("دالة unpost_invoice غير موجودة، حذف المعاملات المالية والمخزنية يدويًا")
                     # محاولة حذف المعاملات المالية والمخزنية يدويًا
                     from finances.models import ContactTransaction, SafeTransaction, ProductTransaction
                     ProductTransaction.objects.filter(invoice=invoice).delete()
                     ContactTransaction.objects.filter(invoice=invoice).delete()
                     SafeTransaction.objects.filter(invoice=invoice).delete()
-                    print("تم حذف المعاملات المالية والمخزنية يدويًا")
+                    logger.debug("تم حذف المعاملات المالية والمخزنية للفاتورة %s يدويًا", invoice.number)
 
             # حذف الفاتورة
             invoice.delete()
@@ -817,92 +703,11 @@ def invoice_post(request, pk):
         return redirect('invoice_detail', pk=invoice.id)
 
     try:
-        with transaction.atomic():
-            # استخدام دالة post_invoice بدلاً من create_related_transactions
-            if hasattr(invoice, 'post_invoice') and callable(getattr(invoice, 'post_invoice')):
-                # تأكد من أن الفاتورة غير مرحلة أولاً
-                invoice.is_posted = False
-                invoice.save(update_fields=['is_posted'])
-
-                # ثم قم بترحيلها
-                result = invoice.post_invoice()
-                print(f"نتيجة استدعاء post_invoice: {result}")
-
-                # التحقق من نجاح إنشاء المعاملات
-                from finances.models import ContactTransaction, SafeTransaction, ProductTransaction
-                contact_transactions = ContactTransaction.objects.filter(invoice=invoice)
-                safe_transactions = SafeTransaction.objects.filter(invoice=invoice)
-                product_transactions = ProductTransaction.objects.filter(invoice=invoice)
-
-                print(f"عدد معاملات العملاء/الموردين بعد الترحيل: {contact_transactions.count()}")
-                print(f"عدد معاملات الخزنة بعد الترحيل: {safe_transactions.count()}")
-                print(f"عدد معاملات المخزون بعد الترحيل: {product_transactions.count()}")
-
-                # التحقق من إنشاء جميع المعاملات المطلوبة
-                items_count = invoice.items.count()
-                expected_product_transactions = items_count
-                has_error = False
-                error_message = ""
-
-                if contact_transactions.count() == 0:
-                    print("تحذير: لم يتم إنشاء معاملات العملاء/الموردين")
-                    # محاولة إعادة الترحيل
-                    invoice.is_posted = False
-                    invoice.save(update_fields=['is_posted'])
-                    result = invoice.post_invoice()
-                    print(f"نتيجة إعادة الترحيل: {result}")
-
-                    # التحقق مرة أخرى
-                    contact_transactions = ContactTransaction.objects.filter(invoice=invoice)
-                    safe_transactions = SafeTransaction.objects.filter(invoice=invoice)
-                    product_transactions = ProductTransaction.objects.filter(invoice=invoice)
-
-                    print(f"عدد معاملات العملاء/الموردين بعد إعادة الترحيل: {contact_transactions.count()}")
-                    print(f"عدد معاملات الخزنة بعد إعادة الترحيل: {safe_transactions.count()}")
-                    print(f"عدد معاملات المخزون بعد إعادة الترحيل: {product_transactions.count()}")
-
-                    # التحقق مرة أخرى بعد إعادة الترحيل
-                    if contact_transactions.count() == 0:
-                        has_error = True
-                        error_message += "لم يتم إنشاء معاملات العملاء/الموردين. "
-
-                if (invoice.payment_type == 'cash' or invoice.paid_amount > 0) and safe_transactions.count() == 0:
-                    print("تحذير: لم يتم إنشاء معاملات الخزنة للفاتورة النقدية أو الفاتورة الآجلة مع دفعة جزئية")
-                    has_error = True
-                    error_message += "لم يتم إنشاء معاملات الخزنة للفاتورة النقدية أو الفاتورة الآجلة مع دفعة جزئية. "
-
-                if product_transactions.count() != expected_product_transactions:
-                    print(f"تحذير: عدد معاملات المخزون ({product_transactions.count()}) لا يتطابق مع عدد بنود الفاتورة ({expected_product_transactions})")
-                    has_error = True
-                    error_message += f"عدد معاملات المخزون ({product_transactions.count()}) لا يتطابق مع عدد بنود الفاتورة ({expected_product_transactions}). "
-
-                # إذا كان هناك خطأ، قم بالتراجع عن ترحيل الفاتورة
-                if has_error:
-                    print("خطأ في ترحيل الفاتورة:", error_message)
-                    # إلغاء المعاملة بإثارة استثناء
-                    raise Exception(f"فشل في ترحيل الفاتورة: {error_message}")
-
-                if result:
-                    messages.success(request, 'تم ترحيل الفاتورة بنجاح')
-                else:
-                    messages.warning(request, 'لم يتم ترحيل الفاتورة بشكل كامل. يرجى التحقق من المعاملات المالية والمخزنية.')
-            else:
-                # الطريقة القديمة كبديل
-                # حذف أي معاملات موجودة أولاً
-                from finances.models import ContactTransaction, SafeTransaction, ProductTransaction
-                ContactTransaction.objects.filter(invoice=invoice).delete()
-                SafeTransaction.objects.filter(invoice=invoice).delete()
-                ProductTransaction.objects.filter(invoice=invoice).delete()
-
-                # ثم إنشاء معاملات جديدة
-                invoice.create_related_transactions()
-                invoice.is_posted = True
-                invoice.save()
-                messages.success(request, 'تم ترحيل الفاتورة بنجاح')
+        # ترحيل الفاتورة بالمسار الجماعي: بناء الحركات في الذاكرة والتحقق منها وإدراجها دفعة واحدة
+        Invoice.post_many(Invoice.objects.filter(pk=invoice.pk))
+        messages.success(request, 'تم ترحيل الفاتورة بنجاح')
     except Exception as e:
-        print("خطأ في ترحيل الفاتورة:", str(e))
-        import traceback
-        print("تتبع الخطأ:", traceback.format_exc())
+        logger.exception("خطأ في ترحيل الفاتورة %s", invoice.number)
         messages.error(request, f'حدث خطأ أثناء ترحيل الفاتورة: {str(e)}')
 
     return redirect('invoice_detail', pk=invoice.id)
@@ -958,15 +763,22 @@ def invoice_print(request, pk):
 def payment_list(request):
     """عرض قائمة المدفوعات"""
     payments = Payment.objects.all().order_by('-date', '-id')
-    # Create a directory for payment templates if it doesn't exist
-    return render(request, 'invoices/payment/list.html', {'payments': payments})
+    page = keyset_paginate(request, payments.select_related('contact', 'safe'))
+    return render(request, 'invoices/payment/list.html', {
+        'payments': page,
+        'page_obj': page,
+        'page_querystring': get_querystring(request),
+    })
 
 @login_required
 def receipt_list(request):
     """عرض قائمة التحصيلات من العملاء"""
     payments = Payment.objects.filter(payment_type=Payment.RECEIPT).order_by('-date', '-id')
+    page = keyset_paginate(request, payments.select_related('contact', 'safe'))
     return render(request, 'invoices/payment/list.html', {
-        'payments': payments,
+        'payments': page,
+        'page_obj': page,
+        'page_querystring': get_querystring(request),
         'title': 'التحصيلات من العملاء',
         'payment_type': Payment.RECEIPT
     })
@@ -975,8 +787,11 @@ def receipt_list(request):
 def payment_to_supplier_list(request):
     """عرض قائمة المدفوعات للموردين"""
     payments = Payment.objects.filter(payment_type=Payment.PAYMENT).order_by('-date', '-id')
+    page = keyset_paginate(request, payments.select_related('contact', 'safe'))
     return render(request, 'invoices/payment/list.html', {
-        'payments': payments,
+        'payments': page,
+        'page_obj': page,
+        'page_querystring': get_querystring(request),
         'title': 'المدفوعات للموردين',
         'payment_type': Payment.PAYMENT
     })
@@ -984,29 +799,20 @@ def payment_to_supplier_list(request):
 @login_required
 def payment_add(request):
     """إضافة دفعة جديدة"""
-    # إنشاء رقم دفعة جديد
-    last_payment = Payment.objects.order_by('-id').first()
-    if not last_payment:
-        new_number = "1"  # أول مستند في النظام
-    else:
-        # استخراج الرقم من آخر مستند
-        try:
-            if '-' in last_payment.number:
-                last_number = int(last_payment.number.split('-')[1])
-            else:
-                last_number = int(last_payment.number)
-            new_number = str(last_number + 1)  # زيادة الرقم بمقدار 1
-        except (ValueError, IndexError):
-            # في حالة حدوث خطأ في تحليل الرقم، استخدم الرقم 1
-            new_number = "1"
+    # رقم المستند المقترح لفرع الخزنة الافتراضية (يتم حجزه عند الحفظ، أو حجز رقم آخر لفرع الخزنة المختارة)
+    default_safe = SystemSettings.get_settings().default_safe
+    new_number = sequences.preview(
+        'payment', branch_id=default_safe.branch_id if default_safe else None, date=timezone.localdate()
+    )
 
     if request.method == 'POST':
         form = PaymentForm(request.POST)
         if form.is_valid():
             with transaction.atomic():
                 payment = form.save(commit=False)
-                if not payment.number:
-                    payment.number = new_number
+                payment.number = sequences.claim(
+                    'payment', payment.number, branch_id=payment.safe.branch_id, date=payment.date
+                )
                 payment.save()
                 messages.success(request, 'تم إضافة الدفعة بنجاح')
                 return redirect('payment_detail', pk=payment.id)
@@ -1054,17 +860,16 @@ def payment_post(request, pk):
 
                 # التحقق من تحديث الفاتورة المرتبطة إذا وجدت
                 if payment.invoice:
-                    print(f"الفاتورة المرتبطة: {payment.invoice.number}")
-                    print(f"المبلغ المدفوع: {payment.invoice.paid_amount}")
-                    print(f"المبلغ المتبقي: {payment.invoice.remaining_amount}")
+                    logger.debug(
+                        "الفاتورة المرتبطة: %s - المدفوع: %s، المتبقي: %s",
+                        payment.invoice.number, payment.invoice.paid_amount, payment.invoice.remaining_amount,
+                    )
 
                 messages.success(request, 'تم ترحيل الدفعة بنجاح')
             else:
                 messages.warning(request, 'لم يتم ترحيل الدفعة. قد تكون مرحلة بالفعل.')
     except Exception as e:
-        print(f"خطأ في ترحيل الدفعة: {str(e)}")
-        import traceback
-        print(f"تتبع الخطأ: {traceback.format_exc()}")
+        logger.exception("خطأ في ترحيل الدفعة %s", payment.number)
         messages.error(request, f'حدث خطأ أثناء ترحيل الدفعة: {str(e)}')
 
     return redirect('payment_detail', pk=payment.id)
@@ -1087,17 +892,16 @@ def payment_unpost(request, pk):
             if result:
                 # التحقق من تحديث الفاتورة المرتبطة إذا وجدت
                 if payment.invoice:
-                    print(f"الفاتورة المرتبطة بعد إلغاء الترحيل: {payment.invoice.number}")
-                    print(f"المبلغ المدفوع: {payment.invoice.paid_amount}")
-                    print(f"المبلغ المتبقي: {payment.invoice.remaining_amount}")
+                    logger.debug(
+                        "الفاتورة المرتبطة بعد إلغاء الترحيل: %s - المدفوع: %s، المتبقي: %s",
+                        payment.invoice.number, payment.invoice.paid_amount, payment.invoice.remaining_amount,
+                    )
 
                 messages.success(request, 'تم إلغاء ترحيل الدفعة بنجاح')
             else:
                 messages.warning(request, 'لم يتم إلغاء ترحيل الدفعة. قد تكون غير مرحلة بالفعل.')
     except Exception as e:
-        print(f"خطأ في إلغاء ترحيل الدفعة: {str(e)}")
-        import traceback
-        print(f"تتبع الخطأ: {traceback.format_exc()}")
+        logger.exception("خطأ في إلغاء ترحيل الدفعة %s", payment.number)
         messages.error(request, f'حدث خطأ أثناء إلغاء ترحيل الدفعة: {str(e)}')
 
     return redirect('payment_detail', pk=payment.id)
\ No newline at end of file
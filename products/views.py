@@ -1,3 +1,5 @@
+import logging
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
@@ -7,6 +9,8 @@ from .models import Category, Unit, Product, ProductUnit
 from .forms import CategoryForm, UnitForm, ProductForm, ProductUnitFormSet
 from users.decorators import can_create, can_edit, can_delete
 
+logger = logging.getLogger(__name__)
+
 # Category Views
 @login_required
 def category_list(request):
@@ -394,15 +398,11 @@ def product_units_api(request, product_id):
 def product_info_api(request, product_id):
     """API to get product information including units and prices"""
     try:
-        print(f"🔍 تم استلام طلب API للمنتج رقم: {product_id}")
-
         # التحقق من وجود المنتج
-        product = get_object_or_404(Product, pk=product_id)
-        print(f"✅ تم العثور على المنتج: {product.name} (#{product.id})")
+        product = get_object_or_404(Product.objects.select_related('category'), pk=product_id)
 
         # جلب وحدات المنتج
-        product_units = product.units.all()
-        print(f"📊 عدد وحدات المنتج: {product_units.count()}")
+        product_units = product.units.select_related('unit')
 
         units_data = []
 
@@ -419,7 +419,6 @@ def product_info_api(request, product_id):
                 'selling_price': unit.selling_price
             }
             units_data.append(unit_data)
-            print(f"🏷️ إضافة وحدة: {unit.unit.name} - سعر البيع: {unit.selling_price}, سعر الشراء: {unit.purchase_price}")
 
         # تجميع معلومات المنتج
         product_data = {
@@ -431,12 +430,18 @@ def product_info_api(request, product_id):
             'units': units_data
         }
 
+        # رصيد المنتج في المخزن المحدد (بالوحدة الأساسية) للتحقق من الكمية في الفاتورة
+        store_id = request.GET.get('store')
+        if store_id:
+            from finances.models import StockBalance
+            product_data['store_balance'] = StockBalance.get_quantity(product, store_id)
+
         # إعادة البيانات كـ JSON
-        print(f"✅ إرسال استجابة كاملة بـ {len(units_data)} وحدة للمنتج {product.name}")
+        logger.debug("إرسال معلومات المنتج %s بـ %s وحدة", product_id, len(units_data))
         return JsonResponse(product_data)
 
     except Exception as e:
-        print(f"❌ خطأ في طلب API للمنتج {product_id}: {str(e)}")
+        logger.exception("خطأ في طلب API للمنتج %s", product_id)
         return JsonResponse({
             'error': str(e),
             'message': f'حدث خطأ أثناء جلب معلومات المنتج رقم {product_id}'
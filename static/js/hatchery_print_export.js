@@ -145,8 +145,9 @@ function exportToExcel(title) {
 }
 
 // دالة لتهيئة DataTables مع دعم اللغة العربية
-function initDataTable(tableId, orderColumn = 0, orderDir = 'desc') {
-    return $(`#${tableId}`).DataTable({
+// options: إعدادات إضافية تستبدل الافتراضية، مثل {paging: false} للجداول المقسمة إلى صفحات من الخادم
+function initDataTable(tableId, orderColumn = 0, orderDir = 'desc', options = {}) {
+    return $(`#${tableId}`).DataTable($.extend({
         "language": {
             "url": "https://cdn.datatables.net/plug-ins/1.13.7/i18n/ar.json"
         },
@@ -223,7 +224,7 @@ function initDataTable(tableId, orderColumn = 0, orderDir = 'desc') {
                 }
             }
         ]
-    });
+    }, options));
 }
 
 // دالة لفتح صفحة الطباعة
@@ -0,0 +1,21 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from .models import Profile
+
+class ProfileModelBackend(ModelBackend):
+    """
+    ModelBackend that loads the user's profile in the same query as the user on every request,
+    so request.profile, role checks and permission checks need no extra queries
+    """
+
+    def get_user(self, user_id):
+        UserModel = get_user_model()
+        try:
+            user = UserModel._default_manager.select_related('profile').get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        if not self.user_can_authenticate(user):
+            return None
+        # إنشاء الملف الشخصي للمستخدمين القدامى بدونه (بدون استعلام إذا كان موجودًا)
+        Profile.get_for_user(user)
+        return user
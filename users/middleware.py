@@ -1,19 +1,17 @@
-from django.contrib.auth.models import User
+from django.utils.functional import SimpleLazyObject
 from .models import Profile
 
 class ProfileMiddleware:
+    """
+    Add request.profile as a lazy object, evaluated only when used
+
+    The profile is loaded with the user by ProfileModelBackend, so middleware, decorators
+    and context processors share the same object without extra queries.
+    """
+
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        # التحقق من وجود مستخدم مسجل الدخول
-        if request.user.is_authenticated:
-            try:
-                # محاولة الوصول إلى الملف الشخصي
-                profile = request.user.profile
-            except User.profile.RelatedObjectDoesNotExist:
-                # إذا لم يكن للمستخدم ملف شخصي، قم بإنشاء واحد
-                Profile.objects.create(user=request.user)
-        
-        response = self.get_response(request)
-        return response
+        request.profile = SimpleLazyObject(lambda: Profile.get_for_user(request.user))
+        return self.get_response(request)
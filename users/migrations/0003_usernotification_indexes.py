@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 04:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_profile_browser_notifications_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usernotification',
+            index=models.Index(fields=['recipient', 'is_read'], name='notification_unread_idx'),
+        ),
+    ]
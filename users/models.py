@@ -1,7 +1,7 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
 from django.utils.translation import gettext_lazy as _
 
 class Profile(models.Model):
@@ -31,6 +31,22 @@ class Profile(models.Model):
         """Get the display name for the role"""
         return dict(self.ROLE_CHOICES).get(self.role, self.role)
 
+    @classmethod
+    def get_for_user(cls, user):
+        """
+        Get the profile of a user, creating it for users created before the profile signal
+        (no query when the profile was loaded with the user by ProfileModelBackend)
+
+        Returns:
+            Profile object, or None for anonymous users
+        """
+        if not user.is_authenticated:
+            return None
+        try:
+            return user.profile
+        except ObjectDoesNotExist:
+            return cls.objects.create(user=user)
+
 class UserNotification(models.Model):
     NOTIFICATION_TYPES = (
         ('invoice', _('فاتورة جديدة')),
@@ -53,27 +69,47 @@ class UserNotification(models.Model):
     created_at = models.DateTimeField(_("تاريخ الإنشاء"), auto_now_add=True)
     updated_at = models.DateTimeField(_("تاريخ التحديث"), auto_now=True)
 
+    # عدد الإشعارات غير المقروءة لكل مستخدم محفوظ في الذاكرة المؤقتة، ويُلغى عند أي تغيير في إشعاراته
+    # (المدة تحد من بقاء قيمة قديمة إذا كانت الذاكرة المؤقتة خاصة بكل عملية)
+    UNREAD_COUNT_CACHE_KEY = 'users:unread_notifications:%s'
+    UNREAD_COUNT_CACHE_TIMEOUT = 300
+
     class Meta:
         verbose_name = _("إشعار")
         verbose_name_plural = _("الإشعارات")
         ordering = ['-created_at']
+        indexes = [
+            # عدّ الإشعارات غير المقروءة للمستخدم عند عدم وجوده في الذاكرة المؤقتة
+            models.Index(fields=['recipient', 'is_read'], name='notification_unread_idx'),
+        ]
 
     def __str__(self):
         return f"{self.notification_type} - {self.title} - {self.recipient.username}"
 
     def mark_as_read(self):
+        if self.is_read:
+            return
         self.is_read = True
-        self.save()
-
-@receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
-    if created:
-        Profile.objects.create(user=instance)
-
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, created, **kwargs):
-    try:
-        instance.profile.save()
-    except User.profile.RelatedObjectDoesNotExist:
-        # إذا لم يكن للمستخدم ملف شخصي، قم بإنشاء واحد
-        Profile.objects.create(user=instance)
+        self.save(update_fields=['is_read', 'updated_at'])
+
+    @classmethod
+    def get_unread_count(cls, user_id):
+        """Get the unread notifications count of a user, counting only when it is not cached"""
+        key = cls.UNREAD_COUNT_CACHE_KEY % user_id
+        count = cache.get(key)
+        if count is None:
+            count = cls.objects.filter(recipient_id=user_id, is_read=False).count()
+            cache.set(key, count, cls.UNREAD_COUNT_CACHE_TIMEOUT)
+        return count
+
+    @classmethod
+    def clear_unread_count(cls, user_ids):
+        """
+        Forget the cached unread counts of the given users
+
+        Cleared now and again after commit, so a count read before the change is committed is not kept.
+        """
+        keys = [cls.UNREAD_COUNT_CACHE_KEY % user_id for user_id in set(user_ids)]
+        if keys:
+            cache.delete_many(keys)
+            transaction.on_commit(lambda: cache.delete_many(keys))
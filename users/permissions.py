@@ -0,0 +1,101 @@
+"""
+سجل الصلاحيات المجمّع
+
+يتم تحويل صلاحيات الأدوار المعرفة في users/roles.py إلى مجموعات ثابتة (frozenset) مرة واحدة عند الاستيراد،
+ويتم حفظ دور المستخدم وصلاحياته على كائن المستخدم طوال الطلب، فيصبح كل فحص صلاحية مجرد بحث في مجموعة
+بدون إنشاء قواميس وبدون استعلامات إضافية مهما تكررت الفحوص في القوالب والقوائم.
+"""
+from types import MappingProxyType
+
+from django.core.exceptions import ObjectDoesNotExist
+from rolepermissions.roles import RolesManager
+
+from . import roles  # noqa: F401 تسجيل الأدوار
+
+NO_PERMISSIONS = frozenset()
+
+# الصلاحيات الممنوحة لكل دور: {'admin': frozenset({'create_company', ...}), ...}
+ROLE_PERMISSIONS = MappingProxyType({
+    role.get_name(): frozenset(
+        permission for permission, granted in role.available_permissions.items() if granted
+    )
+    for role in RolesManager.get_roles()
+})
+
+# اسم الخاصية التي يحفظ فيها (الدور، الصلاحيات) على كائن المستخدم خلال الطلب
+_CACHE_ATTR = '_role_permissions_cache'
+
+
+def get_role_permissions(role):
+    """
+    Get the compiled permission set of a role
+
+    Args:
+        role: Role name (from Profile.ROLE_CHOICES)
+
+    Returns:
+        frozenset of granted permission names
+    """
+    return ROLE_PERMISSIONS.get(role, NO_PERMISSIONS)
+
+
+def _resolve(user):
+    """Resolve (role, permissions) once per user object, i.e. once per request"""
+    cached = getattr(user, _CACHE_ATTR, None)
+    if cached is not None:
+        return cached
+
+    try:
+        role = user.profile.role
+    except ObjectDoesNotExist:
+        role = None
+
+    cached = (role, get_role_permissions(role))
+    setattr(user, _CACHE_ATTR, cached)
+    return cached
+
+
+def get_user_role(user):
+    """
+    Get the role of a user (cached on the user object for the rest of the request)
+
+    Returns:
+        Role name, or None if the user is anonymous or has no profile
+    """
+    if not user.is_authenticated:
+        return None
+    return _resolve(user)[0]
+
+
+def get_user_permissions(user):
+    """
+    Get the compiled permission set of a user (cached on the user object for the rest of the request)
+
+    Returns:
+        frozenset of granted permission names
+    """
+    if not user.is_authenticated:
+        return NO_PERMISSIONS
+    return _resolve(user)[1]
+
+
+def user_has_permission(user, permission_name):
+    """
+    Check if user has specific permission
+
+    Args:
+        user: User object
+        permission_name: Permission name (e.g., 'create_company', 'edit_product')
+
+    Returns:
+        Boolean indicating if user has permission
+    """
+    return permission_name in get_user_permissions(user)
+
+
+def clear_user_permissions_cache(user):
+    """Forget the cached role and permissions of a user (after changing the role)"""
+    try:
+        delattr(user, _CACHE_ATTR)
+    except AttributeError:
+        pass
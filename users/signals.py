@@ -0,0 +1,14 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Profile, UserNotification
+
+@receiver(post_save, sender=User)
+def create_user_profile(sender, instance, created, raw=False, **kwargs):
+    """إنشاء الملف الشخصي مرة واحدة عند إنشاء المستخدم (بدلاً من التحقق منه في كل طلب)"""
+    if created and not raw:
+        Profile.objects.get_or_create(user=instance)
+
+@receiver([post_save, post_delete], sender=UserNotification)
+def clear_notification_unread_count(sender, instance, **kwargs):
+    UserNotification.clear_unread_count([instance.recipient_id])
@@ -1,5 +1,5 @@
 from django import template
-from users.utils import user_has_permission
+from users.permissions import user_has_permission, get_user_permissions
 
 register = template.Library()
 
@@ -28,6 +28,20 @@ def user_can(user, permission_name):
     """
     return user_has_permission(user, permission_name)
 
+@register.simple_tag(takes_context=True)
+def user_permissions(context):
+    """
+    Template tag returning the compiled permission set of the current user,
+    for pages (such as menus) that check many permissions
+    
+    Usage in template:
+    {% user_permissions as perms %}
+    {% if "create_company" in perms %}
+        <a href="...">إنشاء شركة</a>
+    {% endif %}
+    """
+    return get_user_permissions(context['user'])
+
 @register.inclusion_tag('users/permission_check.html')
 def show_if_permitted(user, permission_name, content=""):
     """
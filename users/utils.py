@@ -1,9 +1,26 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
 from django.contrib.auth.models import User
+from django.db import close_old_connections, transaction
+from django.db.models import QuerySet
 from django.utils.translation import gettext_lazy as _
 from .models import UserNotification
+from .permissions import user_has_permission, clear_user_permissions_cache  # noqa: F401
 from rolepermissions.roles import assign_role
 from rolepermissions.permissions import grant_permission, revoke_permission
 
+logger = logging.getLogger(__name__)
+
+# عدد الإشعارات في كل جملة INSERT عند الإرسال الجماعي
+NOTIFICATION_BATCH_SIZE = 500
+
+# أقصى مدة (بالثواني) لانتظار إرسال الإشعارات المتبقية في الخلفية عند إيقاف العملية
+NOTIFICATION_SHUTDOWN_TIMEOUT = 10
+
 def send_notification(recipient, notification_type, title, message, sender=None,
                      related_object_id=None, related_object_type=None, url=None):
     """
@@ -46,13 +63,14 @@ def send_notification(recipient, notification_type, title, message, sender=None,
 
     return notification
 
-def send_notification_to_role(role, notification_type, title, message, sender=None,
-                             related_object_id=None, related_object_type=None, url=None):
+def send_bulk_notification(recipients, notification_type, title, message, sender=None,
+                           related_object_id=None, related_object_type=None, url=None, background=False):
     """
-    Send a notification to all users with a specific role
+    Send the same notification to many users: recipients are resolved with one query
+    and all notifications are inserted with bulk_create
 
     Args:
-        role: Role name (from Profile.ROLE_CHOICES)
+        recipients: QuerySet of users, or an iterable of User objects or User IDs
         notification_type: Type of notification (from UserNotification.NOTIFICATION_TYPES)
         title: Notification title
         message: Notification message
@@ -60,31 +78,125 @@ def send_notification_to_role(role, notification_type, title, message, sender=No
         related_object_id: ID of related object (optional)
         related_object_type: Type of related object (optional)
         url: URL to redirect to when notification is clicked (optional)
+        background: Deliver from the notifications worker thread after the current transaction
+            commits, so the calling request returns immediately (optional)
 
     Returns:
-        List of created UserNotification objects
+        List of created UserNotification objects (empty list when delivered in the background)
     """
-    from .models import Profile
-
-    # Get all users with the specified role
-    users = User.objects.filter(profile__role=role)
-
-    notifications = []
-    for user in users:
-        notification = send_notification(
-            recipient=user,
+    if isinstance(recipients, QuerySet):
+        recipients = recipients.values_list('id', flat=True)
+    recipient_ids = [getattr(recipient, 'pk', recipient) for recipient in recipients]
+    sender_id = getattr(sender, 'pk', sender)
+
+    if background:
+        transaction.on_commit(lambda: _enqueue_notification(
+            recipient_ids, notification_type, title, message, sender_id,
+            related_object_id, related_object_type, url
+        ))
+        return []
+
+    return _create_notifications(recipient_ids, notification_type, title, message, sender_id,
+                                 related_object_id, related_object_type, url)
+
+def _create_notifications(recipient_ids, notification_type, title, message, sender_id,
+                          related_object_id, related_object_type, url):
+    """Insert one notification per recipient with bulk_create and clear their cached unread counts"""
+    if not recipient_ids:
+        return []
+
+    # المرسل غير الموجود يتم تجاهله كما في send_notification
+    if sender_id is not None and not User.objects.filter(id=sender_id).exists():
+        sender_id = None
+
+    notifications = UserNotification.objects.bulk_create([
+        UserNotification(
+            recipient_id=recipient_id,
+            sender_id=sender_id,
             notification_type=notification_type,
             title=title,
             message=message,
-            sender=sender,
             related_object_id=related_object_id,
             related_object_type=related_object_type,
             url=url
         )
-        notifications.append(notification)
+        for recipient_id in recipient_ids
+    ], batch_size=NOTIFICATION_BATCH_SIZE)
 
+    # الإدخال الجماعي لا يرسل إشارات، لذلك يتم إلغاء الأعداد المحفوظة هنا
+    UserNotification.clear_unread_count(recipient_ids)
     return notifications
 
+# عامل خلفي واحد لكل عملية يرسل الإشعارات الجماعية بالترتيب
+_notification_queue = queue.Queue()
+_notification_worker = None
+_notification_worker_lock = threading.Lock()
+
+def _enqueue_notification(*args):
+    global _notification_worker
+    with _notification_worker_lock:
+        if _notification_worker is None or not _notification_worker.is_alive():
+            _notification_worker = threading.Thread(
+                target=_notification_worker_loop, name='notifications-worker', daemon=True
+            )
+            _notification_worker.start()
+    _notification_queue.put(args)
+
+def _notification_worker_loop():
+    while True:
+        args = _notification_queue.get()
+        close_old_connections()
+        try:
+            _create_notifications(*args)
+        except Exception:
+            logger.exception("فشل إرسال الإشعارات في الخلفية (%s مستلم)", len(args[0]))
+        finally:
+            close_old_connections()
+            _notification_queue.task_done()
+
+@atexit.register
+def _drain_notification_queue():
+    """Wait for queued background notifications when the process exits (worker recycle, deploy)"""
+    if _notification_worker is None:
+        return
+    deadline = time.monotonic() + NOTIFICATION_SHUTDOWN_TIMEOUT
+    while _notification_queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.05)
+    if _notification_queue.unfinished_tasks:
+        logger.error("تم إيقاف العملية قبل إرسال %s دفعة إشعارات في الخلفية", _notification_queue.unfinished_tasks)
+
+def send_notification_to_role(role, notification_type, title, message, sender=None,
+                             related_object_id=None, related_object_type=None, url=None,
+                             background=False):
+    """
+    Send a notification to all users with a specific role
+
+    Args:
+        role: Role name (from Profile.ROLE_CHOICES)
+        notification_type: Type of notification (from UserNotification.NOTIFICATION_TYPES)
+        title: Notification title
+        message: Notification message
+        sender: User object or User ID (optional)
+        related_object_id: ID of related object (optional)
+        related_object_type: Type of related object (optional)
+        url: URL to redirect to when notification is clicked (optional)
+        background: Deliver from the notifications worker thread (optional, see send_bulk_notification)
+
+    Returns:
+        List of created UserNotification objects
+    """
+    return send_bulk_notification(
+        User.objects.filter(profile__role=role),
+        notification_type=notification_type,
+        title=title,
+        message=message,
+        sender=sender,
+        related_object_id=related_object_id,
+        related_object_type=related_object_type,
+        url=url,
+        background=background
+    )
+
 def assign_user_role(user, role_name):
     """
     Assign a role to a user and update their profile
@@ -96,6 +208,7 @@ def assign_user_role(user, role_name):
     # Update the user's profile
     user.profile.role = role_name
     user.profile.save()
+    clear_user_permissions_cache(user)
 
     # Try to assign the role using django-role-permissions
     try:
@@ -109,8 +222,7 @@ def assign_user_role(user, role_name):
             assign_role(user, 'Viewer')
     except Exception as e:
         # If role assignment fails, just continue with profile update
-        print(f"Warning: Could not assign role permissions: {e}")
-        pass
+        logger.warning("تعذر تعيين صلاحيات الدور %s للمستخدم %s: %s", role_name, user.username, e)
 
     return user
 
@@ -122,9 +234,9 @@ def get_unread_notifications_count(user):
         user: User object
 
     Returns:
-        Integer count of unread notifications
+        Integer count of unread notifications (cached per user, see UserNotification.get_unread_count)
     """
-    return UserNotification.objects.filter(recipient=user, is_read=False).count()
+    return UserNotification.get_unread_count(user.pk)
 
 def mark_all_notifications_as_read(user):
     """
@@ -136,13 +248,13 @@ def mark_all_notifications_as_read(user):
     Returns:
         Number of notifications marked as read
     """
-    notifications = UserNotification.objects.filter(recipient=user, is_read=False)
-    count = notifications.count()
-    notifications.update(is_read=True)
+    count = UserNotification.objects.filter(recipient=user, is_read=False).update(is_read=True)
+    # التحديث الجماعي لا يرسل إشارات، لذلك يتم إلغاء العدد المحفوظ هنا
+    UserNotification.clear_unread_count([user.pk])
     return count
 
 def send_notification_to_admins(notification_type, title, message, related_object_id=None,
-                               related_object_type=None, url=None):
+                               related_object_type=None, url=None, background=False):
     """
     Send a notification to all admin users
 
@@ -153,218 +265,18 @@ def send_notification_to_admins(notification_type, title, message, related_objec
         related_object_id: ID of related object (optional)
         related_object_type: Type of related object (optional)
         url: URL to redirect to when notification is clicked (optional)
+        background: Deliver from the notifications worker thread (optional, see send_bulk_notification)
 
     Returns:
         List of created UserNotification objects
     """
-    from .models import Profile
-    from django.contrib.auth.models import User
-
-    # Get all admin users
-    admin_users = User.objects.filter(profile__role='admin')
-
-    notifications = []
-    for user in admin_users:
-        notification = send_notification(
-            recipient=user,
-            notification_type=notification_type,
-            title=title,
-            message=message,
-            sender=None,
-            related_object_id=related_object_id,
-            related_object_type=related_object_type,
-            url=url
-        )
-        notifications.append(notification)
-
-    return notifications
-
-def user_has_permission(user, permission_name):
-    """
-    Check if user has specific permission
-
-    Args:
-        user: User object
-        permission_name: Permission name (e.g., 'create_company', 'edit_product')
-
-    Returns:
-        Boolean indicating if user has permission
-    """
-    if not user.is_authenticated:
-        return False
-
-    if not hasattr(user, 'profile'):
-        return False
-
-    user_role = user.profile.role
-
-    # Define permissions for each role
-    permissions = {
-        'admin': {
-            'create_company': True,
-            'edit_company': True,
-            'delete_company': True,
-            'view_companies': True,
-            'create_branch': True,
-            'edit_branch': True,
-            'delete_branch': True,
-            'view_branches': True,
-            'create_store': True,
-            'edit_store': True,
-            'delete_store': True,
-            'view_stores': True,
-            'create_safe': True,
-            'edit_safe': True,
-            'delete_safe': True,
-            'view_safes': True,
-            'create_contact': True,
-            'edit_contact': True,
-            'delete_contact': True,
-            'view_contacts': True,
-            'create_product': True,
-            'edit_product': True,
-            'delete_product': True,
-            'view_products': True,
-            'create_invoice': True,
-            'edit_invoice': True,
-            'delete_invoice': True,
-            'view_invoices': True,
-            'create_transaction': True,
-            'edit_transaction': True,
-            'delete_transaction': True,
-            'view_transactions': True,
-            'create_user': True,
-            'edit_user': True,
-            'delete_user': True,
-            'view_users': True,
-            'view_reports': True,
-            'export_data': True,
-            'import_data': True,
-        },
-        'manager': {
-            'create_company': False,
-            'edit_company': False,
-            'delete_company': False,
-            'view_companies': True,
-            'create_branch': True,
-            'edit_branch': True,
-            'delete_branch': False,
-            'view_branches': True,
-            'create_store': True,
-            'edit_store': True,
-            'delete_store': False,
-            'view_stores': True,
-            'create_safe': True,
-            'edit_safe': True,
-            'delete_safe': False,
-            'view_safes': True,
-            'create_contact': True,
-            'edit_contact': True,
-            'delete_contact': False,
-            'view_contacts': True,
-            'create_product': True,
-            'edit_product': True,
-            'delete_product': False,
-            'view_products': True,
-            'create_invoice': True,
-            'edit_invoice': True,
-            'delete_invoice': False,
-            'view_invoices': True,
-            'create_transaction': True,
-            'edit_transaction': True,
-            'delete_transaction': False,
-            'view_transactions': True,
-            'create_user': False,
-            'edit_user': False,
-            'delete_user': False,
-            'view_users': True,
-            'view_reports': True,
-            'export_data': True,
-            'import_data': False,
-        },
-        'employee': {
-            'create_company': False,
-            'edit_company': False,
-            'delete_company': False,
-            'view_companies': True,
-            'create_branch': False,
-            'edit_branch': False,
-            'delete_branch': False,
-            'view_branches': True,
-            'create_store': False,
-            'edit_store': False,
-            'delete_store': False,
-            'view_stores': True,
-            'create_safe': False,
-            'edit_safe': False,
-            'delete_safe': False,
-            'view_safes': True,
-            'create_contact': True,
-            'edit_contact': True,
-            'delete_contact': False,
-            'view_contacts': True,
-            'create_product': False,
-            'edit_product': False,
-            'delete_product': False,
-            'view_products': True,
-            'create_invoice': True,
-            'edit_invoice': False,
-            'delete_invoice': False,
-            'view_invoices': True,
-            'create_transaction': True,
-            'edit_transaction': False,
-            'delete_transaction': False,
-            'view_transactions': True,
-            'create_user': False,
-            'edit_user': False,
-            'delete_user': False,
-            'view_users': False,
-            'view_reports': False,
-            'export_data': False,
-            'import_data': False,
-        },
-        'viewer': {
-            'create_company': False,
-            'edit_company': False,
-            'delete_company': False,
-            'view_companies': True,
-            'create_branch': False,
-            'edit_branch': False,
-            'delete_branch': False,
-            'view_branches': True,
-            'create_store': False,
-            'edit_store': False,
-            'delete_store': False,
-            'view_stores': True,
-            'create_safe': False,
-            'edit_safe': False,
-            'delete_safe': False,
-            'view_safes': True,
-            'create_contact': False,
-            'edit_contact': False,
-            'delete_contact': False,
-            'view_contacts': True,
-            'create_product': False,
-            'edit_product': False,
-            'delete_product': False,
-            'view_products': True,
-            'create_invoice': False,
-            'edit_invoice': False,
-            'delete_invoice': False,
-            'view_invoices': True,
-            'create_transaction': False,
-            'edit_transaction': False,
-            'delete_transaction': False,
-            'view_transactions': True,
-            'create_user': False,
-            'edit_user': False,
-            'delete_user': False,
-            'view_users': False,
-            'view_reports': True,
-            'export_data': False,
-            'import_data': False,
-        }
-    }
-
-    role_permissions = permissions.get(user_role, {})
-    return role_permissions.get(permission_name, False)
\ No newline at end of file
+    return send_notification_to_role(
+        'admin',
+        notification_type=notification_type,
+        title=title,
+        message=message,
+        related_object_id=related_object_id,
+        related_object_type=related_object_type,
+        url=url,
+        background=background
+    )
@@ -15,7 +15,7 @@ from django.contrib.auth.views import (
 )
 from .models import Profile, UserNotification
 from .forms import UserRegisterForm, UserUpdateForm, ProfileUpdateForm
-from .utils import send_notification, get_unread_notifications_count, mark_all_notifications_as_read, assign_user_role
+from .utils import send_notification_to_admins, get_unread_notifications_count, mark_all_notifications_as_read, assign_user_role
 
 def register_view(request):
     error_message = None
@@ -46,17 +46,14 @@ def register_view(request):
                     user = form.save()
                     # Assign default role
                     assign_user_role(user, 'employee')
-                    # Send notification to admin users
-                    admin_users = User.objects.filter(profile__role='admin')
-                    for admin in admin_users:
-                        send_notification(
-                            recipient=admin,
-                            notification_type='user',
-                            title='مستخدم جديد',
-                            message=f'تم تسجيل مستخدم جديد: {user.username}',
-                            related_object_id=user.id,
-                            related_object_type='User'
-                        )
+                    # Send notification to admin users (a single bulk insert)
+                    send_notification_to_admins(
+                        notification_type='user',
+                        title='مستخدم جديد',
+                        message=f'تم تسجيل مستخدم جديد: {user.username}',
+                        related_object_id=user.id,
+                        related_object_type='User'
+                    )
                     login(request, user)
                     messages.success(request, 'تم إنشاء حسابك بنجاح!')
                     return redirect('home')